@@ -608,31 +608,35 @@ class ConsumoParceiroCreateView(BaseTenantCreateView):
                 assinatura_file.seek(0)
                 primeiro.assinatura.save(assinatura_file.name, assinatura_file, save=True)
                 assinatura_name = primeiro.assinatura.name
-                MovimentacaoEstoque.objects.create(
-                    company=request.tenant,
-                    estoque=estoque_first,
-                    tipo=MovimentacaoEstoque.SAIDA,
-                    quantidade=first["quantidade"],
-                    observacao=f"Consumo terceiro: {terceiro}",
-                    created_by=request.user,
-                    updated_by=request.user,
-                )
+                movimentos = [
+                    MovimentacaoEstoque(
+                        company=request.tenant,
+                        estoque=estoque_first,
+                        tipo=MovimentacaoEstoque.SAIDA,
+                        quantidade=first["quantidade"],
+                        observacao=f"Consumo terceiro: {terceiro}",
+                        created_by=request.user,
+                        updated_by=request.user,
+                    )
+                ]
                 for row in parsed_items[1:]:
-                    estoque_obj = Estoque.objects.select_for_update().filter(
+                    estoque_obj = Estoque.objects.filter(
                         company=request.tenant,
                         produto_id=row["produto_id"],
                         deposito_id=row["deposito_id"],
                     ).first()
                     if not estoque_obj:
                         raise ValidationError("Produto nao cadastrado no deposito informado.")
-                    MovimentacaoEstoque.objects.create(
-                        company=request.tenant,
-                        estoque=estoque_obj,
-                        tipo=MovimentacaoEstoque.SAIDA,
-                        quantidade=row["quantidade"],
-                        observacao=f"Consumo terceiro: {terceiro}",
-                        created_by=request.user,
-                        updated_by=request.user,
+                    movimentos.append(
+                        MovimentacaoEstoque(
+                            company=request.tenant,
+                            estoque=estoque_obj,
+                            tipo=MovimentacaoEstoque.SAIDA,
+                            quantidade=row["quantidade"],
+                            observacao=f"Consumo terceiro: {terceiro}",
+                            created_by=request.user,
+                            updated_by=request.user,
+                        )
                     )
                     ConsumoParceiro.objects.create(
                         company=request.tenant,
@@ -646,6 +650,7 @@ class ConsumoParceiroCreateView(BaseTenantCreateView):
                         created_by=request.user,
                         updated_by=request.user,
                     )
+                MovimentacaoEstoque.objects.bulk_apply(movimentos)
         except ValidationError as exc:
             form.add_error(None, "; ".join(exc.messages) if getattr(exc, "messages", None) else str(exc))
             if request.headers.get("X-Requested-With") == "XMLHttpRequest":
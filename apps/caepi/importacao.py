@@ -0,0 +1,178 @@
+import csv
+import hashlib
+import io
+from datetime import datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+from django_tenants.utils import schema_context
+
+from .models import CaEPI
+from .services import invalidar_status_cas, reconstruir_ca_atual
+
+# Ordem das colunas no arquivo exportado pelo governo (tgg_export_caepi.txt).
+COLUNAS_ARQUIVO = [
+    "registro_ca",
+    "data_validade",
+    "situacao",
+    "nr_processo",
+    "cnpj",
+    "razao_social",
+    "natureza",
+    "nome_equipamento",
+    "descricao_equipamento",
+    "marca_ca",
+    "referencia",
+    "cor",
+    "aprovado_para_laudo",
+    "restricao_laudo",
+    "observacao_analise_laudo",
+    "cnpj_laboratorio",
+    "razao_social_laboratorio",
+    "nr_laudo",
+    "norma",
+]
+TAMANHO_LOTE = 5000
+# Acima disso vale mais recriar CaEPIAtual inteira do que refazer CA por CA.
+LIMITE_RECONSTRUCAO_PARCIAL = 20000
+STAGING = "caepi_importacao"
+DIFF = "caepi_importacao_diff"
+
+
+def _data(valor):
+    valor = (valor or "").strip()
+    if not valor:
+        return ""
+    for formato in ("%d/%m/%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(valor, formato).date().isoformat()
+        except ValueError:
+            continue
+    return ""
+
+
+def _preparar_linha(linha):
+    valores = [(valor or "").strip() for valor in list(linha)[: len(COLUNAS_ARQUIVO)]]
+    valores += [""] * (len(COLUNAS_ARQUIVO) - len(valores))
+    if not valores[0]:
+        return None
+    valores[1] = _data(valores[1])
+    hash_conteudo = hashlib.md5("\x1f".join(valores).encode("utf-8")).hexdigest()
+    return valores + [hash_conteudo]
+
+
+def _copiar_lote(cursor, buffer):
+    # Campo vazio vira NULL so em data_validade; as colunas de texto recebem "".
+    texto = ", ".join(coluna for coluna in COLUNAS_ARQUIVO if coluna != "data_validade")
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY {STAGING} ({', '.join(COLUNAS_ARQUIVO)}, hash_conteudo) "
+        f"FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL ({texto}))",
+        buffer,
+    )
+
+
+def _carregar_staging(cursor, linhas, tamanho_lote):
+    colunas = ", ".join(f"{coluna} text" for coluna in COLUNAS_ARQUIVO if coluna != "data_validade")
+    cursor.execute(
+        f"CREATE TEMP TABLE {STAGING} (data_validade date, {colunas}, hash_conteudo text) ON COMMIT DROP"
+    )
+    total = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    pendentes = 0
+    for linha in linhas:
+        valores = _preparar_linha(linha)
+        if valores is None:
+            continue
+        writer.writerow(valores)
+        pendentes += 1
+        if pendentes >= tamanho_lote:
+            _copiar_lote(cursor, buffer)
+            total += pendentes
+            pendentes = 0
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+    if pendentes:
+        _copiar_lote(cursor, buffer)
+        total += pendentes
+    cursor.execute(f"CREATE INDEX ON {STAGING} (registro_ca)")
+    cursor.execute(f"ANALYZE {STAGING}")
+    return total
+
+
+def importar_base_caepi(linhas, remover_ausentes=True, tamanho_lote=TAMANHO_LOTE):
+    """
+    Importa a base de CAs em streaming: as linhas (listas na ordem de
+    COLUNAS_ARQUIVO) vao por COPY, em lotes, para uma tabela temporaria e sao
+    comparadas com CaEPI por registro_ca e hash do conteudo. So os CAs novos,
+    alterados e (com remover_ausentes) removidos sao gravados, na mesma transacao
+    que atualiza CaEPIAtual; leitores veem a base antiga ate o commit. Depois do
+    commit o cache de status dos CAs e republicado.
+
+    Retorna {"linhas", "inseridos", "atualizados", "removidos"} (contagem de CAs).
+    """
+    tabela = CaEPI._meta.db_table
+    colunas = ", ".join(COLUNAS_ARQUIVO)
+    agora = timezone.now()
+    with schema_context("public"), transaction.atomic(), connection.cursor() as cursor:
+        total_linhas = _carregar_staging(cursor, linhas, tamanho_lote)
+        cursor.execute(
+            f"""
+            CREATE TEMP TABLE {DIFF} ON COMMIT DROP AS
+            WITH novo AS (
+                SELECT registro_ca, md5(string_agg(hash_conteudo, '' ORDER BY hash_conteudo)) AS assinatura
+                FROM {STAGING} GROUP BY registro_ca
+            ),
+            atual AS (
+                SELECT registro_ca, md5(string_agg(hash_conteudo, '' ORDER BY hash_conteudo)) AS assinatura
+                FROM {tabela} GROUP BY registro_ca
+            )
+            SELECT
+                coalesce(novo.registro_ca, atual.registro_ca) AS registro_ca,
+                CASE
+                    WHEN atual.registro_ca IS NULL THEN 'I'
+                    WHEN novo.registro_ca IS NULL THEN 'D'
+                    ELSE 'U'
+                END AS operacao
+            FROM novo FULL OUTER JOIN atual ON atual.registro_ca = novo.registro_ca
+            WHERE novo.assinatura IS DISTINCT FROM atual.assinatura
+            """
+        )
+        if not remover_ausentes:
+            cursor.execute(f"DELETE FROM {DIFF} WHERE operacao = 'D'")
+        cursor.execute(
+            f"""
+            DELETE FROM {tabela} AS live USING {DIFF} AS diff
+            WHERE live.registro_ca = diff.registro_ca AND diff.operacao IN ('U', 'D')
+            """
+        )
+        cursor.execute(
+            f"""
+            INSERT INTO {tabela} ({colunas}, hash_conteudo, ultima_atualizacao)
+            SELECT {", ".join(f"staging.{coluna}" for coluna in COLUNAS_ARQUIVO)}, staging.hash_conteudo, %s
+            FROM {STAGING} AS staging
+            JOIN {DIFF} AS diff ON diff.registro_ca = staging.registro_ca
+            WHERE diff.operacao IN ('I', 'U')
+            """,
+            [agora],
+        )
+        cursor.execute(f"SELECT operacao, registro_ca FROM {DIFF}")
+        contagem = {"I": 0, "U": 0, "D": 0}
+        alterados = []
+        for operacao, registro_ca in cursor.fetchall():
+            contagem[operacao] += 1
+            alterados.append(registro_ca)
+        if len(alterados) > LIMITE_RECONSTRUCAO_PARCIAL:
+            reconstruir_ca_atual()
+        elif alterados:
+            reconstruir_ca_atual(alterados)
+
+    if alterados:
+        invalidar_status_cas()
+    return {
+        "linhas": total_linhas,
+        "inseridos": contagem["I"],
+        "atualizados": contagem["U"],
+        "removidos": contagem["D"],
+    }
@@ -0,0 +1,133 @@
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from django_tenants.utils import schema_context
+
+from apps.caepi.models import CaEPI
+from apps.caepi.services import buscar_cas, ca_atual, reconstruir_ca_atual
+
+EQUIPAMENTOS = [
+    "Luva de seguranca",
+    "Calcado de seguranca",
+    "Bota de borracha",
+    "Capacete de seguranca",
+    "Oculos de protecao",
+    "Protetor auditivo tipo plug",
+    "Protetor auditivo tipo concha",
+    "Respirador purificador de ar",
+    "Mascara de solda",
+    "Cinturao de seguranca tipo paraquedista",
+    "Avental de raspa",
+    "Vestimenta de protecao contra agentes termicos",
+    "Mangote de protecao",
+    "Creme protetor de seguranca",
+    "Talabarte de seguranca",
+]
+MATERIAIS = ["nitrilica", "látex", "vaqueta", "couro", "PVC", "policarbonato", "algodão", "aramida", "silicone"]
+USOS = ["agentes químicos", "agentes abrasivos", "impactos", "calor", "eletricidade", "umidade", "poeiras"]
+FABRICANTES = [
+    "Proteção Total Indústria",
+    "Segurança Brasil EPI",
+    "Volk do Brasil",
+    "Danny Equipamentos",
+    "Marluvas Calçados",
+    "Kalipso Equipamentos",
+    "3M do Brasil",
+    "Delta Plus Brasil",
+    "Super Safety",
+    "Plastcor do Brasil",
+]
+TERMOS = ["luva", "nitril", "bota", "capacete", "oculos", "protetor auditivo", "respirador", "solda", "cinturao", "raspa"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Gera uma base sintetica de CAs (em transacao desfeita ao final) e mede a latencia da "
+        "busca por descricao, fabricante e numero de CA."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--linhas", type=int, default=150000, help="Linhas sinteticas em CaEPI.")
+        parser.add_argument("--consultas", type=int, default=200, help="Consultas por tipo de busca.")
+        parser.add_argument("--meta-ms", type=float, default=50.0, help="Meta de p95 em milissegundos.")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        with schema_context("public"), transaction.atomic():
+            registros = self._gerar_base(rng, options["linhas"])
+            started = time.perf_counter()
+            total = reconstruir_ca_atual()
+            self.stdout.write(
+                f"base: {options['linhas']} linhas, {total} CAs distintos, "
+                f"reconstrucao em {(time.perf_counter() - started) * 1000:.0f}ms"
+            )
+
+            consultas = options["consultas"]
+            cenarios = {
+                "descricao": lambda: buscar_cas(descricao=rng.choice(TERMOS)),
+                "descricao+validos": lambda: buscar_cas(descricao=rng.choice(TERMOS), somente_validos=True),
+                "fabricante": lambda: buscar_cas(fabricante=rng.choice(FABRICANTES).split()[0]),
+                "descricao+fabricante": lambda: buscar_cas(
+                    descricao=rng.choice(TERMOS), fabricante=rng.choice(FABRICANTES).split()[0]
+                ),
+                "pagina 3": lambda: buscar_cas(descricao=rng.choice(TERMOS), offset=40),
+                "ca": lambda: buscar_cas(ca=rng.choice(registros)),
+                "status ca": lambda: ca_atual(rng.choice(registros)),
+            }
+            falhou = False
+            for nome, consulta in cenarios.items():
+                tempos = []
+                for _ in range(consultas):
+                    started = time.perf_counter()
+                    consulta()
+                    tempos.append((time.perf_counter() - started) * 1000)
+                p50 = statistics.median(tempos)
+                p95 = statistics.quantiles(tempos, n=20)[-1]
+                falhou = falhou or p95 > options["meta_ms"]
+                self.stdout.write(f"{nome:<22} p50={p50:6.1f}ms p95={p95:6.1f}ms max={max(tempos):6.1f}ms")
+            transaction.set_rollback(True)
+
+        if falhou:
+            self.stdout.write(self.style.WARNING(f"p95 acima de {options['meta_ms']:.0f}ms em algum cenario."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"p95 abaixo de {options['meta_ms']:.0f}ms em todos os cenarios."))
+
+    def _gerar_base(self, rng, linhas):
+        agora = timezone.now()
+        hoje = date.today()
+        registros = []
+        lote = []
+        for indice in range(linhas):
+            # ~10% das linhas repetem um CA ja gerado (versoes antigas do mesmo registro).
+            if registros and rng.random() < 0.1:
+                registro = rng.choice(registros)
+            else:
+                registro = str(10000 + indice)
+                registros.append(registro)
+            equipamento = rng.choice(EQUIPAMENTOS)
+            lote.append(
+                CaEPI(
+                    registro_ca=registro,
+                    data_validade=hoje + timedelta(days=rng.randint(-1500, 1500)),
+                    situacao="VÁLIDO",
+                    razao_social=rng.choice(FABRICANTES),
+                    nome_equipamento=equipamento.upper(),
+                    descricao_equipamento=(
+                        f"{equipamento} confeccionada em {rng.choice(MATERIAIS)}, "
+                        f"para proteção contra {rng.choice(USOS)}."
+                    ),
+                    ultima_atualizacao=agora,
+                )
+            )
+            if len(lote) >= 5000:
+                CaEPI.objects.bulk_create(lote)
+                lote = []
+        if lote:
+            CaEPI.objects.bulk_create(lote)
+        return registros
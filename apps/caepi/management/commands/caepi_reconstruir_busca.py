@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from apps.caepi.services import invalidar_status_cas, reconstruir_ca_atual
+
+
+class Command(BaseCommand):
+    help = "Recria a tabela de busca de CAs (um registro por CA) a partir da base CaEPI importada."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ca", action="append", default=None, help="Refaz apenas o CA informado (repetivel).")
+
+    def handle(self, *args, **options):
+        total = reconstruir_ca_atual(options["ca"])
+        invalidar_status_cas()
+        self.stdout.write(self.style.SUCCESS(f"Busca de CAs atualizada. Registros gravados: {total}"))
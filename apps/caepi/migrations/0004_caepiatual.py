@@ -0,0 +1,88 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+ACENTOS = "áàâãäéèêëíìîïóòôõöúùûüçñ"
+SEM_ACENTOS = "aaaaaeeeeiiiiooooouuuucn"
+
+
+def _sql_normalizado(coluna):
+    return (
+        f"btrim(regexp_replace(translate(lower(coalesce({coluna}, '')), '{ACENTOS}', '{SEM_ACENTOS}'), "
+        f"'\\s+', ' ', 'g'))"
+    )
+
+
+def preencher_ca_atual(apps, schema_editor):
+    # Uma linha por registro_ca: a de maior data_validade, depois a mais recente.
+    CaEPIAtual = apps.get_model("caepi", "CaEPIAtual")
+    colunas = ", ".join(
+        field.column
+        for field in CaEPIAtual._meta.concrete_fields
+        if field.column not in {"id", "nome_busca", "descricao_busca", "fabricante_busca"}
+    )
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {CaEPIAtual._meta.db_table} ({colunas}, nome_busca, descricao_busca, fabricante_busca)
+            SELECT DISTINCT ON (registro_ca)
+                {colunas},
+                {_sql_normalizado("nome_equipamento")},
+                {_sql_normalizado("descricao_equipamento")},
+                {_sql_normalizado("razao_social")}
+            FROM {apps.get_model("caepi", "CaEPI")._meta.db_table}
+            WHERE registro_ca <> ''
+            ORDER BY registro_ca, data_validade DESC NULLS LAST, ultima_atualizacao DESC, id DESC
+            """
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("caepi", "0003_alter_caepi_more_unlimited_fields"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.CreateModel(
+            name="CaEPIAtual",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("registro_ca", models.CharField(max_length=50, unique=True)),
+                ("data_validade", models.DateField(blank=True, db_index=True, null=True)),
+                ("situacao", models.TextField(blank=True)),
+                ("nr_processo", models.TextField(blank=True)),
+                ("cnpj", models.CharField(blank=True, max_length=20)),
+                ("razao_social", models.CharField(blank=True, max_length=255)),
+                ("natureza", models.TextField(blank=True)),
+                ("nome_equipamento", models.CharField(blank=True, max_length=255)),
+                ("descricao_equipamento", models.TextField(blank=True)),
+                ("marca_ca", models.TextField(blank=True)),
+                ("referencia", models.TextField(blank=True)),
+                ("cor", models.TextField(blank=True)),
+                ("aprovado_para_laudo", models.TextField(blank=True)),
+                ("restricao_laudo", models.TextField(blank=True)),
+                ("observacao_analise_laudo", models.TextField(blank=True)),
+                ("cnpj_laboratorio", models.CharField(blank=True, max_length=20)),
+                ("razao_social_laboratorio", models.CharField(blank=True, max_length=255)),
+                ("nr_laudo", models.TextField(blank=True)),
+                ("norma", models.TextField(blank=True)),
+                ("ultima_atualizacao", models.DateTimeField()),
+                ("nome_busca", models.TextField(blank=True, default="")),
+                ("descricao_busca", models.TextField(blank=True, default="")),
+                ("fabricante_busca", models.TextField(blank=True, default="")),
+            ],
+            options={
+                "ordering": ["-data_validade", "registro_ca"],
+                "abstract": False,
+                "indexes": [
+                    GinIndex(fields=["nome_busca"], name="caepi_atual_nome_trgm", opclasses=["gin_trgm_ops"]),
+                    GinIndex(fields=["descricao_busca"], name="caepi_atual_desc_trgm", opclasses=["gin_trgm_ops"]),
+                    GinIndex(fields=["fabricante_busca"], name="caepi_atual_fab_trgm", opclasses=["gin_trgm_ops"]),
+                ],
+            },
+        ),
+        migrations.RunPython(preencher_ca_atual, migrations.RunPython.noop),
+    ]
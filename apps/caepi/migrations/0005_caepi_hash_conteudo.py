@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("caepi", "0004_caepiatual"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="caepi",
+            name="hash_conteudo",
+            field=models.CharField(blank=True, default="", editable=False, max_length=32),
+        ),
+    ]
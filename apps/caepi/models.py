@@ -1,7 +1,8 @@
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 
 
-class CaEPI(models.Model):
+class CaEPIBase(models.Model):
     registro_ca = models.CharField(max_length=50, db_index=True)
     data_validade = models.DateField(null=True, blank=True, db_index=True)
     situacao = models.TextField(blank=True)
@@ -24,7 +25,33 @@ class CaEPI(models.Model):
     ultima_atualizacao = models.DateTimeField()
 
     class Meta:
+        abstract = True
         ordering = ["-data_validade", "registro_ca"]
 
     def __str__(self):
         return f"{self.registro_ca} - {self.nome_equipamento}"
+
+
+class CaEPI(CaEPIBase):
+    # md5 da linha importada; a importacao compara por registro_ca + hash.
+    hash_conteudo = models.CharField(max_length=32, blank=True, default="", editable=False)
+
+
+class CaEPIAtual(CaEPIBase):
+    """
+    Uma linha por registro_ca (o registro mais recente da base importada), com os
+    campos de busca normalizados (minusculas, sem acento) e indices trigram.
+    Reconstruida por apps.caepi.services.reconstruir_ca_atual.
+    """
+
+    registro_ca = models.CharField(max_length=50, unique=True)
+    nome_busca = models.TextField(blank=True, default="")
+    descricao_busca = models.TextField(blank=True, default="")
+    fabricante_busca = models.TextField(blank=True, default="")
+
+    class Meta(CaEPIBase.Meta):
+        indexes = [
+            GinIndex(fields=["nome_busca"], name="caepi_atual_nome_trgm", opclasses=["gin_trgm_ops"]),
+            GinIndex(fields=["descricao_busca"], name="caepi_atual_desc_trgm", opclasses=["gin_trgm_ops"]),
+            GinIndex(fields=["fabricante_busca"], name="caepi_atual_fab_trgm", opclasses=["gin_trgm_ops"]),
+        ]
@@ -0,0 +1,210 @@
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django_tenants.utils import schema_context
+
+from .models import CaEPI, CaEPIAtual
+
+# Mesma troca feita em Python (normalizar_busca) e no SQL da reconstrucao, para o
+# termo buscado e as colunas *_busca ficarem no mesmo formato.
+ACENTOS = "áàâãäéèêëíìîïóòôõöúùûüçñ"
+SEM_ACENTOS = "aaaaaeeeeiiiiooooouuuucn"
+_TABELA_ACENTOS = str.maketrans(ACENTOS, SEM_ACENTOS)
+
+# Sem CACHES configurado o cache e por processo (LocMem): a importacao roda em
+# outro processo e nao alcanca o cache dos workers web. O TTL curto limita o
+# tempo que um status antigo fica em uso.
+STATUS_CACHE_TIMEOUT = 60 * 5
+
+_CAMPOS_COPIADOS = [
+    field.column
+    for field in CaEPIAtual._meta.concrete_fields
+    if field.column not in {"id", "nome_busca", "descricao_busca", "fabricante_busca"}
+]
+
+
+def normalizar_busca(texto):
+    return " ".join((texto or "").lower().translate(_TABELA_ACENTOS).split())
+
+
+def _sql_normalizado(coluna):
+    return (
+        f"btrim(regexp_replace(translate(lower(coalesce({coluna}, '')), '{ACENTOS}', '{SEM_ACENTOS}'), "
+        f"'\\s+', ' ', 'g'))"
+    )
+
+
+def reconstruir_ca_atual(registros=None):
+    """
+    Recria CaEPIAtual a partir de CaEPI: por registro_ca fica a linha de maior
+    data_validade (depois a mais recente). Com registros, refaz apenas esses CAs.
+    Retorna a quantidade de linhas gravadas.
+    """
+    origem = CaEPI._meta.db_table
+    destino = CaEPIAtual._meta.db_table
+    colunas = ", ".join(_CAMPOS_COPIADOS)
+    filtro = ""
+    params = []
+    if registros is not None:
+        registros = sorted({str(registro).strip() for registro in registros if str(registro).strip()})
+        if not registros:
+            return 0
+        filtro = "AND registro_ca = ANY(%s)"
+        params = [registros]
+
+    with schema_context("public"), transaction.atomic(), connection.cursor() as cursor:
+        if registros is None:
+            cursor.execute(f"DELETE FROM {destino}")
+        else:
+            cursor.execute(f"DELETE FROM {destino} WHERE registro_ca = ANY(%s)", params)
+        cursor.execute(
+            f"""
+            INSERT INTO {destino} ({colunas}, nome_busca, descricao_busca, fabricante_busca)
+            SELECT DISTINCT ON (registro_ca)
+                {colunas},
+                {_sql_normalizado("nome_equipamento")},
+                {_sql_normalizado("descricao_equipamento")},
+                {_sql_normalizado("razao_social")}
+            FROM {origem}
+            WHERE registro_ca <> '' {filtro}
+            ORDER BY registro_ca, data_validade DESC NULLS LAST, ultima_atualizacao DESC, id DESC
+            """,
+            params,
+        )
+        total = cursor.rowcount
+        if registros is None:
+            cursor.execute(f"ANALYZE {destino}")
+    return total
+
+
+def ca_atual(registro_ca):
+    registro_ca = (registro_ca or "").strip()
+    if not registro_ca:
+        return None
+    with schema_context("public"):
+        return CaEPIAtual.objects.filter(registro_ca=registro_ca).first()
+
+
+def base_ca_disponivel():
+    with schema_context("public"):
+        return CaEPIAtual.objects.exists()
+
+
+def buscar_cas(ca="", descricao="", fabricante="", somente_validos=False, offset=0, limit=20):
+    """
+    Busca na tabela CaEPIAtual. Por numero de CA e uma consulta exata; por
+    descricao/fabricante filtra com LIKE nas colunas normalizadas (indices trigram)
+    e ordena por relevancia (word_similarity). Retorna (itens, has_more).
+    """
+    ca = (ca or "").strip()
+    descricao = normalizar_busca(descricao)
+    fabricante = normalizar_busca(fabricante)
+    with schema_context("public"):
+        queryset = CaEPIAtual.objects.all()
+        if somente_validos:
+            queryset = queryset.filter(data_validade__gte=timezone.localdate())
+        if ca:
+            return list(queryset.filter(registro_ca=ca)[:limit]), False
+        if not descricao and not fabricante:
+            return [], False
+
+        relevancia = Value(0.0)
+        if descricao:
+            queryset = queryset.filter(Q(nome_busca__contains=descricao) | Q(descricao_busca__contains=descricao))
+            relevancia = relevancia + Greatest(
+                TrigramWordSimilarity(descricao, "nome_busca") * 2,
+                TrigramWordSimilarity(descricao, "descricao_busca"),
+            )
+        if fabricante:
+            queryset = queryset.filter(fabricante_busca__contains=fabricante)
+            relevancia = relevancia + TrigramWordSimilarity(fabricante, "fabricante_busca")
+        queryset = queryset.annotate(relevancia=relevancia).order_by("-relevancia", "registro_ca")
+        items = list(queryset[offset : offset + limit + 1])
+    return items[:limit], len(items) > limit
+
+
+def _status_versao():
+    versao = cache.get("caepi:status:versao")
+    if versao is None:
+        versao = 1
+        cache.add("caepi:status:versao", versao, None)
+    return versao
+
+
+def _status_key(versao, registro_ca):
+    return f"caepi:status:{versao}:{registro_ca}"
+
+
+def _status_entrada(data_validade, situacao):
+    return {"found": True, "data_validade": data_validade, "situacao": situacao or ""}
+
+
+def invalidar_status_cas():
+    """
+    Troca a versao do cache de status. Chamado ao fim da importacao da base;
+    so tem efeito nos outros processos com um cache compartilhado.
+    """
+    try:
+        cache.incr("caepi:status:versao")
+    except ValueError:
+        cache.set("caepi:status:versao", 2, None)
+
+
+def status_cas(registros, usar_cache=True):
+    """
+    Status oficial de varios CAs de uma vez: {registro_ca: {"found", "data_validade",
+    "situacao", "status"}}. Le do cache e faz no maximo uma consulta ao schema
+    public para os CAs que faltarem. status e "valid", "expired", "unknown" ou
+    "not_found", calculado na data de hoje. Com usar_cache=False le direto do banco.
+    """
+    registros = {(registro or "").strip() for registro in registros}
+    registros.discard("")
+    if not registros:
+        return {}
+    entradas = {}
+    if usar_cache:
+        versao = _status_versao()
+        chaves = {_status_key(versao, registro): registro for registro in registros}
+        encontrados = cache.get_many(list(chaves))
+        entradas = {chaves[key]: entrada for key, entrada in encontrados.items()}
+    faltando = registros - set(entradas)
+    if faltando:
+        novos = {registro: {"found": False, "data_validade": None, "situacao": ""} for registro in faltando}
+        with schema_context("public"):
+            linhas = CaEPIAtual.objects.filter(registro_ca__in=faltando).values_list(
+                "registro_ca", "data_validade", "situacao"
+            )
+            for registro_ca, data_validade, situacao in linhas:
+                novos[registro_ca] = _status_entrada(data_validade, situacao)
+        if usar_cache:
+            # CAs nao encontrados ficam fora do cache: podem entrar na proxima importacao.
+            cache.set_many(
+                {_status_key(versao, registro): entrada for registro, entrada in novos.items() if entrada["found"]},
+                STATUS_CACHE_TIMEOUT,
+            )
+        entradas.update(novos)
+
+    today = timezone.localdate()
+    resultado = {}
+    for registro, entrada in entradas.items():
+        data_validade = entrada["data_validade"]
+        if not entrada["found"]:
+            status = "not_found"
+        elif not data_validade:
+            status = "unknown"
+        else:
+            status = "expired" if data_validade < today else "valid"
+        resultado[registro] = {**entrada, "status": status}
+    return resultado
+
+
+def anotar_status_ca(produtos):
+    """Preenche produto.ca_oficial (ou None) para uma pagina de produtos, em lote."""
+    produtos = list(produtos)
+    status = status_cas(produto.ca for produto in produtos)
+    for produto in produtos:
+        produto.ca_oficial = status.get((produto.ca or "").strip())
+    return produtos
@@ -5,3 +5,5 @@ class CipaConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "apps.cipa"
 
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django_tenants.utils import schema_context
+
+from apps.cipa.models import CipaApuracao, CipaEleicao
+from apps.cipa.services import divergencias_apuracao, reconstruir_apuracao
+from apps.tenants.models import Company
+
+
+class Command(BaseCommand):
+    help = (
+        "Confere os contadores de votos da CIPA (CipaApuracao) com os votos registrados e "
+        "reconstroi os das eleicoes divergentes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--schema", help="Processa apenas o tenant informado.")
+        parser.add_argument("--eleicao", type=int, help="Confere apenas a eleicao informada (id).")
+        parser.add_argument("--dry-run", action="store_true", help="Apenas relata as divergencias.")
+        parser.add_argument(
+            "--reconstruir",
+            action="store_true",
+            help="Reconstroi os contadores de todas as eleicoes, mesmo sem divergencia.",
+        )
+
+    def handle(self, *args, **options):
+        schema = options.get("schema")
+        if schema and not Company.objects.filter(schema_name=schema).exists():
+            raise CommandError(f"Tenant '{schema}' nao encontrado.")
+
+        tenants = Company.objects.exclude(schema_name="public").order_by("schema_name")
+        if schema:
+            tenants = tenants.filter(schema_name=schema)
+        divergentes = 0
+        for tenant in tenants:
+            with schema_context(tenant.schema_name):
+                divergentes += self._process_tenant(tenant, options)
+
+        if divergentes and options.get("dry_run"):
+            raise CommandError(f"{divergentes} eleicao(oes) com contadores divergentes.")
+        self.stdout.write(self.style.SUCCESS(f"Apuracao conferida. Eleicoes divergentes: {divergentes}."))
+
+    def _process_tenant(self, tenant, options):
+        if CipaApuracao._meta.db_table not in set(connection.introspection.table_names()):
+            return 0
+        eleicoes = CipaEleicao.objects.filter(company=tenant).order_by("pk")
+        if options.get("eleicao"):
+            eleicoes = eleicoes.filter(pk=options["eleicao"])
+        divergentes = 0
+        for eleicao in eleicoes:
+            diferencas = divergencias_apuracao(eleicao)
+            if diferencas:
+                divergentes += 1
+                for (tipo, candidato_id), (contador, votos) in sorted(
+                    diferencas.items(), key=lambda item: (item[0][0], item[0][1] or 0)
+                ):
+                    alvo = f"candidato #{candidato_id}" if candidato_id else tipo
+                    self.stdout.write(
+                        self.style.WARNING(
+                            f"[{tenant.schema_name}] eleicao #{eleicao.pk} {alvo}: contador={contador} votos={votos}"
+                        )
+                    )
+            if options.get("dry_run") or not (diferencas or options.get("reconstruir")):
+                continue
+            linhas = reconstruir_apuracao(eleicao)
+            self.stdout.write(f"[{tenant.schema_name}] eleicao #{eleicao.pk} reconstruida ({linhas} contadores).")
+        return divergentes
@@ -0,0 +1,121 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def preencher_apuracao(apps, schema_editor):
+    CipaVoto = apps.get_model("cipa", "CipaVoto")
+    CipaApuracao = apps.get_model("cipa", "CipaApuracao")
+    contagem = {}
+    linhas = (
+        CipaVoto.objects.values_list("company_id", "eleicao_id", "tipo", "candidato_id")
+        .annotate(total=Count("id"))
+        .order_by()
+    )
+    for company_id, eleicao_id, tipo, candidato_id, total in linhas:
+        chave = (company_id, eleicao_id, tipo, candidato_id if tipo == "candidato" else None)
+        contagem[chave] = contagem.get(chave, 0) + total
+    CipaApuracao.objects.bulk_create(
+        [
+            CipaApuracao(
+                company_id=company_id,
+                eleicao_id=eleicao_id,
+                tipo=tipo,
+                candidato_id=candidato_id,
+                votos=votos,
+            )
+            for (company_id, eleicao_id, tipo, candidato_id), votos in contagem.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("tenants", "0002_company_estoque_enabled"),
+        ("cipa", "0006_cipaeleicao_unique_company_nome_ci"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CipaApuracao",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "tipo",
+                    models.CharField(
+                        choices=[("candidato", "Candidato"), ("branco", "Branco"), ("nulo", "Nulo")],
+                        max_length=20,
+                    ),
+                ),
+                ("votos", models.PositiveIntegerField(default=0)),
+                (
+                    "candidato",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="apuracao",
+                        to="cipa.cipacandidato",
+                    ),
+                ),
+                (
+                    "company",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="%(class)s_set",
+                        to="tenants.company",
+                    ),
+                ),
+                (
+                    "created_by",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="%(class)s_created",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "eleicao",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="apuracao",
+                        to="cipa.cipaeleicao",
+                    ),
+                ),
+                (
+                    "updated_by",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="%(class)s_updated",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        condition=models.Q(("candidato__isnull", False)),
+                        fields=("eleicao", "tipo", "candidato"),
+                        name="cipa_apuracao_candidato_uniq",
+                    ),
+                    models.UniqueConstraint(
+                        condition=models.Q(("candidato__isnull", True)),
+                        fields=("eleicao", "tipo"),
+                        name="cipa_apuracao_tipo_uniq",
+                    ),
+                ],
+            },
+        ),
+        migrations.RunPython(preencher_apuracao, migrations.RunPython.noop),
+    ]
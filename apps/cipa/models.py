@@ -153,3 +153,39 @@ class CipaVoto(TenantModel):
 
     def __str__(self):
         return f"Voto {self.eleicao} - {self.eleitor}"
+
+
+class CipaApuracao(TenantModel):
+    """
+    Contador de votos por (eleicao, tipo, candidato), atualizado na mesma
+    transacao do voto (apps.cipa.signals). Brancos e nulos ficam com candidato
+    vazio. Reconstruido a partir de CipaVoto por cipa_apuracao_verificar.
+    """
+
+    eleicao = models.ForeignKey(CipaEleicao, on_delete=models.CASCADE, related_name="apuracao")
+    tipo = models.CharField(max_length=20, choices=CipaVoto.TIPO_CHOICES)
+    candidato = models.ForeignKey(
+        CipaCandidato,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="apuracao",
+    )
+    votos = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["eleicao", "tipo", "candidato"],
+                condition=models.Q(candidato__isnull=False),
+                name="cipa_apuracao_candidato_uniq",
+            ),
+            models.UniqueConstraint(
+                fields=["eleicao", "tipo"],
+                condition=models.Q(candidato__isnull=True),
+                name="cipa_apuracao_tipo_uniq",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.eleicao} - {self.candidato or self.get_tipo_display()}: {self.votos}"
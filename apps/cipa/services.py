@@ -0,0 +1,137 @@
+import hashlib
+
+from django.db import connection, transaction
+from django.db.models import Count
+
+from .models import CipaApuracao, CipaCandidato, CipaVoto
+
+
+def _lock_apuracao(eleicao_id, compartilhado=True):
+    # Votos seguram o lock compartilhado; a reconstrucao, o exclusivo. Assim um
+    # voto nao cai entre o DELETE e o INSERT da reconstrucao.
+    chave = f"{getattr(connection, 'schema_name', 'public')}:cipa-apuracao:{eleicao_id}"
+    numero = int(hashlib.md5(chave.encode("utf-8")).hexdigest()[:15], 16)
+    funcao = "pg_advisory_xact_lock_shared" if compartilhado else "pg_advisory_xact_lock"
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {funcao}(%s)", [numero])
+
+
+def contabilizar_voto(company_id, eleicao_id, tipo, candidato_id, delta):
+    """
+    Soma delta (+1/-1) ao contador (eleicao, tipo, candidato): INSERT ... ON
+    CONFLICT para somar, UPDATE para subtrair. Deve rodar na transacao que
+    gravou o voto.
+    """
+    if tipo != "candidato":
+        candidato_id = None
+    apuracao = CipaApuracao._meta.db_table
+    _lock_apuracao(eleicao_id)
+    with connection.cursor() as cursor:
+        if delta < 0:
+            cursor.execute(
+                f"""
+                UPDATE {apuracao}
+                SET votos = GREATEST(votos + %s, 0), updated_at = now()
+                WHERE eleicao_id = %s AND tipo = %s AND candidato_id IS NOT DISTINCT FROM %s
+                """,
+                [delta, eleicao_id, tipo, candidato_id],
+            )
+            return
+        conflito = (
+            "(eleicao_id, tipo, candidato_id) WHERE candidato_id IS NOT NULL"
+            if candidato_id
+            else "(eleicao_id, tipo) WHERE candidato_id IS NULL"
+        )
+        cursor.execute(
+            f"""
+            INSERT INTO {apuracao} (company_id, eleicao_id, tipo, candidato_id, votos, created_at, updated_at)
+            VALUES (%s, %s, %s, %s, %s, now(), now())
+            ON CONFLICT {conflito}
+            DO UPDATE SET votos = {apuracao}.votos + EXCLUDED.votos, updated_at = now()
+            """,
+            [company_id, eleicao_id, tipo, candidato_id, delta],
+        )
+
+
+def _contagem_votos(eleicao_id):
+    # {(tipo, candidato_id): votos}; brancos e nulos sempre sem candidato.
+    contagem = {}
+    linhas = (
+        CipaVoto.objects.filter(eleicao_id=eleicao_id)
+        .values_list("tipo", "candidato_id")
+        .annotate(total=Count("id"))
+        .order_by()
+    )
+    for tipo, candidato_id, total in linhas:
+        chave = (tipo, candidato_id if tipo == "candidato" else None)
+        contagem[chave] = contagem.get(chave, 0) + total
+    return contagem
+
+
+def reconstruir_apuracao(eleicao):
+    """Recria os contadores da eleicao a partir de CipaVoto. Retorna as linhas gravadas."""
+    with transaction.atomic():
+        _lock_apuracao(eleicao.pk, compartilhado=False)
+        CipaApuracao.objects.filter(eleicao=eleicao).delete()
+        linhas = CipaApuracao.objects.bulk_create(
+            [
+                CipaApuracao(
+                    company_id=eleicao.company_id,
+                    eleicao=eleicao,
+                    tipo=tipo,
+                    candidato_id=candidato_id,
+                    votos=votos,
+                )
+                for (tipo, candidato_id), votos in _contagem_votos(eleicao.pk).items()
+            ]
+        )
+    return len(linhas)
+
+
+def divergencias_apuracao(eleicao):
+    """
+    Compara os contadores da eleicao com a contagem dos votos. Retorna
+    {(tipo, candidato_id): (contador, votos)} so das chaves que diferem.
+    """
+    esperado = _contagem_votos(eleicao.pk)
+    atual = {
+        (tipo, candidato_id): votos
+        for tipo, candidato_id, votos in CipaApuracao.objects.filter(eleicao=eleicao).values_list(
+            "tipo", "candidato_id", "votos"
+        )
+    }
+    return {
+        chave: (atual.get(chave, 0), esperado.get(chave, 0))
+        for chave in set(esperado) | set(atual)
+        if atual.get(chave, 0) != esperado.get(chave, 0)
+    }
+
+
+def resultado_eleicao(company, eleicao):
+    """
+    Resultado a partir dos contadores: uma consulta de candidatos aprovados e
+    uma de CipaApuracao, sem percorrer os votos.
+    """
+    candidatos_qs = (
+        CipaCandidato.objects.filter(company=company, eleicao=eleicao, status="aprovado")
+        .select_related("funcionario")
+        .order_by("numero", "id")
+    )
+    counts = {}
+    totals = {}
+    for tipo, candidato_id, votos in CipaApuracao.objects.filter(company=company, eleicao=eleicao).values_list(
+        "tipo", "candidato_id", "votos"
+    ):
+        totals[tipo] = totals.get(tipo, 0) + votos
+        if tipo == "candidato" and candidato_id:
+            counts[candidato_id] = votos
+
+    rows = [{"candidato": cand, "votos": int(counts.get(cand.id, 0))} for cand in candidatos_qs]
+    rows.sort(key=lambda r: (-r["votos"], r["candidato"].numero or 999999, r["candidato"].id))
+    return {
+        "rows": rows,
+        "total": int(sum(totals.values()) if totals else 0),
+        "branco": int(totals.get("branco", 0)),
+        "nulo": int(totals.get("nulo", 0)),
+        "candidato": int(totals.get("candidato", 0)),
+    }
@@ -0,0 +1,60 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import CipaCandidato, CipaEleicao, CipaVoto
+from .services import contabilizar_voto, reconstruir_apuracao
+
+# Campos de CipaVoto que mudam a apuracao.
+CAMPOS_APURACAO = {"tipo", "candidato"}
+
+
+def _chave_voto(tipo, candidato_id):
+    return tipo, candidato_id if tipo == "candidato" else None
+
+
+def _exclusao_da_eleicao(origin):
+    # Eleicao excluida: votos, candidatos e contadores saem juntos em cascata.
+    modelo = getattr(origin, "model", None) or type(origin)
+    return isinstance(modelo, type) and issubclass(modelo, CipaEleicao)
+
+
+@receiver(pre_save, sender=CipaVoto)
+def guardar_voto_anterior(sender, instance, update_fields=None, **kwargs):
+    instance._voto_anterior = None
+    if instance.pk is None or (update_fields is not None and not CAMPOS_APURACAO.intersection(update_fields)):
+        return
+    # update_or_create ja travou a linha (select_for_update): o valor lido e o atual.
+    anterior = CipaVoto.objects.filter(pk=instance.pk).values_list("tipo", "candidato_id").first()
+    instance._voto_anterior = _chave_voto(*anterior) if anterior else None
+
+
+@receiver(post_save, sender=CipaVoto)
+def apurar_voto(sender, instance, created=False, update_fields=None, **kwargs):
+    if not created and update_fields is not None and not CAMPOS_APURACAO.intersection(update_fields):
+        return
+    atual = _chave_voto(instance.tipo, instance.candidato_id)
+    anterior = None if created else getattr(instance, "_voto_anterior", None)
+    if anterior == atual:
+        return
+    if anterior is not None:
+        contabilizar_voto(instance.company_id, instance.eleicao_id, *anterior, delta=-1)
+    contabilizar_voto(instance.company_id, instance.eleicao_id, *atual, delta=1)
+
+
+@receiver(post_delete, sender=CipaVoto)
+def desapurar_voto(sender, instance, origin=None, **kwargs):
+    if _exclusao_da_eleicao(origin):
+        return
+    tipo, candidato_id = _chave_voto(instance.tipo, instance.candidato_id)
+    contabilizar_voto(instance.company_id, instance.eleicao_id, tipo, candidato_id, delta=-1)
+
+
+@receiver(post_delete, sender=CipaCandidato)
+def reapurar_candidato_removido(sender, instance, origin=None, **kwargs):
+    # Os votos do candidato ficam sem candidato (SET_NULL, sem post_save) e o
+    # contador dele sai em cascata: a eleicao e recontada.
+    if _exclusao_da_eleicao(origin):
+        return
+    eleicao = CipaEleicao.objects.filter(pk=instance.eleicao_id).first()
+    if eleicao is not None:
+        reconstruir_apuracao(eleicao)
@@ -3,7 +3,7 @@ import uuid
 from django import forms
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Count, Q
+from django.db.models import Q
 from django.http import Http404
 from django.shortcuts import redirect, render
 from django.urls import reverse
@@ -21,7 +21,8 @@ from .forms import (
     CipaVotacaoPublicaForm,
     compute_default_dates,
 )
-from .models import CipaCandidato, CipaEleicao, CipaVoto
+from .models import CipaEleicao, CipaVoto
+from .services import resultado_eleicao
 
 
 WIZARD_STEPS = {
@@ -61,41 +62,6 @@ def _get_eleicao_or_404(request, pk: int) -> CipaEleicao:
         raise Http404
 
 
-def _compute_result(company, eleicao: CipaEleicao):
-    candidatos_qs = (
-        CipaCandidato.objects.filter(company=company, eleicao=eleicao, status="aprovado")
-        .select_related("funcionario")
-        .order_by("numero", "id")
-    )
-    counts = {
-        row["candidato_id"]: row["c"]
-        for row in (
-            CipaVoto.objects.filter(company=company, eleicao=eleicao, tipo="candidato", candidato__isnull=False)
-            .values("candidato_id")
-            .annotate(c=Count("id"))
-        )
-    }
-
-    rows = [{"candidato": cand, "votos": int(counts.get(cand.id, 0))} for cand in candidatos_qs]
-    rows.sort(key=lambda r: (-r["votos"], r["candidato"].numero or 999999, r["candidato"].id))
-
-    totals = {
-        row["tipo"]: row["c"]
-        for row in (
-            CipaVoto.objects.filter(company=company, eleicao=eleicao)
-            .values("tipo")
-            .annotate(c=Count("id"))
-        )
-    }
-    return {
-        "rows": rows,
-        "total": int(sum(totals.values()) if totals else 0),
-        "branco": int(totals.get("branco", 0)),
-        "nulo": int(totals.get("nulo", 0)),
-        "candidato": int(totals.get("candidato", 0)),
-    }
-
-
 def cipa_wizard_start(request):
     if not request.user.is_authenticated:
         return redirect("login")
@@ -253,7 +219,7 @@ class CipaEleicaoWizardView(LoginRequiredMixin, View):
             "steps": steps,
             "form": form,
             "locked_step": locked,
-            "result": _compute_result(self.request.tenant, eleicao) if eleicao.status == "encerrada" else None,
+            "result": resultado_eleicao(self.request.tenant, eleicao) if eleicao.status == "encerrada" else None,
         }
 
 
@@ -293,7 +259,7 @@ def cipa_votacao_publica(request, token):
         raise Http404
 
     if eleicao.status == "encerrada":
-        result = _compute_result(request.tenant, eleicao)
+        result = resultado_eleicao(request.tenant, eleicao)
         return render(request, "cipa/votacao_publica.html", {"eleicao": eleicao, "closed": True, "result": result})
 
     if not eleicao.votacao_publica_ativa or eleicao.status != "votacao":
@@ -1,4 +1,11 @@
+from contextvars import ContextVar
+
 from django import forms
+from django.forms.models import ModelChoiceIterator
+
+from .lookups import chave_queryset, objetos_tabela
+
+_choices_cache_atual = ContextVar("choices_cache_atual", default=None)
 
 
 class BootstrapModelForm(forms.ModelForm):
@@ -14,4 +21,92 @@ class BootstrapModelForm(forms.ModelForm):
             else:
                 css_class = "form-control"
             existing = widget.attrs.get("class", "")
-            widget.attrs["class"] = f"{existing} {css_class}".strip()
\ No newline at end of file
+            widget.attrs["class"] = f"{existing} {css_class}".strip()
+        instalar_opcoes_em_cache(self)
+
+
+class CachedModelChoiceIterator(ModelChoiceIterator):
+    """
+    Opcoes de ModelChoiceField lidas do ChoicesCache da requisicao (e, para tabelas
+    auxiliares com CACHES compartilhado, do cache entre requisicoes). O queryset e
+    consultado no momento da renderizacao, entao filtros aplicados depois do
+    __init__ do form valem.
+    """
+
+    def _objetos(self):
+        choices_cache = getattr(self.field, "choices_cache", None) or ChoicesCache.current()
+        if choices_cache is None:
+            return objetos_tabela(self.queryset)
+        return choices_cache.objetos(self.queryset)
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for obj in self._objetos():
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(self._objetos()) + (1 if self.field.empty_label is not None else 0)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self._objetos())
+
+
+def instalar_opcoes_em_cache(form, choices_cache=None):
+    for field in form.fields.values():
+        if not isinstance(field, forms.ModelChoiceField):
+            continue
+        if choices_cache is not None:
+            field.choices_cache = choices_cache
+        if field.iterator is not CachedModelChoiceIterator:
+            field.iterator = CachedModelChoiceIterator
+            if field.queryset is not None:
+                field.widget.choices = field.choices
+    return form
+
+
+class ChoicesCache:
+    """
+    Objetos das opcoes de ModelChoiceField avaliados uma unica vez por requisicao:
+    formularios montados na mesma requisicao com o mesmo queryset reaproveitam a
+    lista. O ChoicesCacheMiddleware deixa o cache da requisicao ativo para todo
+    BootstrapModelForm; outros formularios podem usar apply().
+    """
+
+    request_attr = "_clarus_choices_cache"
+
+    def __init__(self):
+        self._objetos = {}
+
+    @classmethod
+    def for_request(cls, request):
+        cache = getattr(request, cls.request_attr, None)
+        if cache is None:
+            cache = cls()
+            setattr(request, cls.request_attr, cache)
+        return cache
+
+    @classmethod
+    def current(cls):
+        return _choices_cache_atual.get()
+
+    @classmethod
+    def activate(cls, choices_cache):
+        return _choices_cache_atual.set(choices_cache)
+
+    @classmethod
+    def deactivate(cls, token):
+        _choices_cache_atual.reset(token)
+
+    def objetos(self, queryset):
+        chave = chave_queryset(queryset)
+        if chave is None:
+            return []
+        objetos = self._objetos.get(chave)
+        if objetos is None:
+            objetos = objetos_tabela(queryset, chave)
+            self._objetos[chave] = objetos
+        return objetos
+
+    def apply(self, form):
+        return instalar_opcoes_em_cache(form, self)
@@ -0,0 +1,138 @@
+import hashlib
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+
+LOOKUP_CACHE_TIMEOUT = 600
+
+# Backends cujo conteudo fica no proprio processo: a troca de versao feita no
+# save/delete nao chega aos outros workers.
+CACHES_LOCAIS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+# Tabelas pequenas de referencia usadas nos ModelChoiceFields. Com um cache
+# compartilhado (CACHES) as opcoes delas ficam no cache entre requisicoes;
+# save/delete troca a versao da tabela.
+TABELAS_AUXILIARES = (
+    "acidentes.AgenteCausador",
+    "acidentes.EmitenteAtestado",
+    "acidentes.NaturezaLesao",
+    "acidentes.ParteAtingida",
+    "cargos.Cargo",
+    "depositos.Deposito",
+    "fornecedores.Fornecedor",
+    "funcionarios.CentroCusto",
+    "funcionarios.GHE",
+    "funcionarios.MotivoAfastamento",
+    "funcionarios.Planta",
+    "funcionarios.Risco",
+    "funcionarios.Turno",
+    "produtos.Fabricante",
+    "produtos.FamiliaProduto",
+    "produtos.GradeProduto",
+    "produtos.LocalizacaoProduto",
+    "produtos.LocalRetirada",
+    "produtos.MarcaProduto",
+    "produtos.Periodicidade",
+    "produtos.SubfamiliaProduto",
+    "produtos.TipoProduto",
+    "produtos.UnidadeProduto",
+    "setores.Setor",
+    "tipos_funcionario.TipoFuncionario",
+)
+
+_tabelas_registradas = set()
+
+
+def _schema_name():
+    return getattr(connection, "schema_name", "public")
+
+
+def _tabela_prefix(model, schema_name=None):
+    return f"core:lookup:{schema_name or _schema_name()}:{model._meta.label_lower}"
+
+
+def tabela_versao(model):
+    key = f"{_tabela_prefix(model)}:versao"
+    versao = cache.get(key)
+    if versao is None:
+        versao = 1
+        cache.add(key, versao, None)
+    return versao
+
+
+def invalidar_tabela(model, schema_name=None):
+    """
+    Troca a versao da tabela auxiliar no schema (atual, se nao informado): as
+    listas de opcoes guardadas para a versao anterior deixam de ser lidas.
+    """
+    key = f"{_tabela_prefix(model, schema_name)}:versao"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+
+
+def chave_queryset(queryset):
+    """
+    Identifica o queryset pelo schema, modelo e SQL. None quando o queryset e
+    vazio por construcao (ex.: .none()).
+    """
+    try:
+        sql = str(queryset.query)
+    except EmptyResultSet:
+        return None
+    return (_schema_name(), queryset.model._meta.label_lower, sql)
+
+
+def cache_compartilhado():
+    backend = settings.CACHES.get("default", {}).get("BACKEND", CACHES_LOCAIS[0])
+    return backend not in CACHES_LOCAIS
+
+
+def tabela_registrada(model):
+    return model._meta.label_lower in _tabelas_registradas
+
+
+def objetos_tabela(queryset, chave=None):
+    """
+    Lista os objetos do queryset. Para tabelas auxiliares registradas, com cache
+    compartilhado, a lista vem do cache, chaveada por (schema, modelo, versao, SQL).
+    """
+    model = queryset.model
+    chave = chave or chave_queryset(queryset)
+    if chave is None:
+        return []
+    if not tabela_registrada(model) or not cache_compartilhado():
+        return list(queryset)
+    digest = hashlib.md5(chave[2].encode("utf-8")).hexdigest()
+    key = f"{_tabela_prefix(model)}:{tabela_versao(model)}:{digest}"
+    objetos = cache.get(key)
+    if objetos is None:
+        objetos = list(queryset)
+        cache.set(key, objetos, LOOKUP_CACHE_TIMEOUT)
+    return objetos
+
+
+def _invalidar_tabela_sinal(sender, **kwargs):
+    # Invalida ja e de novo no commit, para nao deixar no cache uma leitura feita
+    # por outra requisicao antes do commit.
+    schema_name = _schema_name()
+    invalidar_tabela(sender, schema_name)
+    transaction.on_commit(lambda: invalidar_tabela(sender, schema_name))
+
+
+def registrar_tabelas_auxiliares(labels=TABELAS_AUXILIARES):
+    for label in labels:
+        model = apps.get_model(label)
+        if tabela_registrada(model):
+            continue
+        _tabelas_registradas.add(model._meta.label_lower)
+        post_save.connect(_invalidar_tabela_sinal, sender=model, dispatch_uid=f"core.lookup.save.{label}")
+        post_delete.connect(_invalidar_tabela_sinal, sender=model, dispatch_uid=f"core.lookup.delete.{label}")
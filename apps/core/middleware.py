@@ -0,0 +1,15 @@
+from .forms import ChoicesCache
+
+
+class ChoicesCacheMiddleware:
+    """Deixa o ChoicesCache da requisicao ativo enquanto ela e processada."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = ChoicesCache.activate(ChoicesCache.for_request(request))
+        try:
+            return self.get_response(request)
+        finally:
+            ChoicesCache.deactivate(token)
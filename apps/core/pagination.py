@@ -0,0 +1,325 @@
+import base64
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+
+CONTAGEM_EXATA_LIMITE = 5000
+CONTAGEM_CACHE_TIMEOUT = 60
+
+
+def contagem_estimada(queryset, limite=CONTAGEM_EXATA_LIMITE, timeout=CONTAGEM_CACHE_TIMEOUT):
+    """
+    Total de registros para o indicador do paginador, sem COUNT(*) a cada requisicao.
+    Usa a estimativa do planejador do Postgres; abaixo de `limite` faz o COUNT exato.
+    O resultado fica em cache por `timeout` segundos, por schema e SQL.
+    Retorna (total, estimado).
+    """
+    queryset = queryset.order_by()
+    connection = connections[queryset.db]
+    sql, params = queryset.query.sql_with_params()
+    schema = getattr(connection, "schema_name", "")
+    digest = hashlib.md5(f"{schema}:{sql}:{params!r}".encode()).hexdigest()
+    key = f"core:contagem:{digest}"
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    estimativa = None
+    if connection.vendor == "postgresql":
+        try:
+            plano = json.loads(queryset.explain(format="json"))
+            estimativa = int(plano[0]["Plan"]["Plan Rows"])
+        except (ValueError, KeyError, IndexError, TypeError):
+            estimativa = None
+    if estimativa is None or estimativa <= limite:
+        resultado = (queryset.count(), False)
+    else:
+        resultado = (estimativa, True)
+    cache.set(key, resultado, timeout)
+    return resultado
+
+
+class KeysetPage:
+    """
+    Pagina de uma paginacao por chave (keyset). Expoe a mesma interface usada pelos
+    templates para Page (has_next, has_previous, has_other_pages, object_list),
+    com next_cursor/previous_cursor no lugar dos numeros de pagina.
+    """
+
+    is_keyset = True
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self._contagem = None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def _resolver_contagem(self):
+        if self._contagem is None:
+            self._contagem = self.paginator.contagem()
+        return self._contagem
+
+    @property
+    def count(self):
+        """Total (possivelmente estimado); calculado apenas se o template usar."""
+        return self._resolver_contagem()[0]
+
+    @property
+    def count_estimado(self):
+        return self._resolver_contagem()[1]
+
+
+class KeysetPaginator:
+    """
+    Paginacao por chave sobre uma ordenacao total (ex.: ("-criado_em", "-id")).
+    Cada pagina custa um unico SELECT ... WHERE (chave) < (ultima chave) LIMIT n+1,
+    independente da profundidade, e nao faz COUNT.
+
+    Os campos podem atravessar relacoes ("entrega__entregue_em") ou ser anotacoes do
+    queryset. NULL e tratado como maior que qualquer valor, como no Postgres.
+
+    O cursor e opaco: "n.<token>" busca a pagina seguinte ao registro do token e
+    "p.<token>" a pagina anterior a ele.
+    """
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self.fields = [name.lstrip("-") for name in self.ordering]
+        self.descending = [name.startswith("-") for name in self.ordering]
+        self._model_fields = {}
+        self._nullable = {}
+        for name in self.fields:
+            self._model_fields[name], self._nullable[name] = self._resolve_field(name)
+
+    def _resolve_field(self, name):
+        annotation = self.queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field, True
+        model = self.queryset.model
+        field = None
+        nullable = False
+        for part in name.split("__"):
+            field = model._meta.pk if part == "pk" else model._meta.get_field(part)
+            nullable = nullable or field.null
+            if field.is_relation and field.related_model is not None:
+                model = field.related_model
+        if field.is_relation:
+            field = field.target_field
+        return field, nullable
+
+    def contagem(self):
+        return contagem_estimada(self.queryset)
+
+    def page(self, cursor=None):
+        direcao, valores = self.decode(cursor)
+        queryset = self.queryset
+        if valores is None:
+            rows = list(queryset.order_by(*self.ordering)[: self.per_page + 1])
+            anterior = False
+            seguinte = len(rows) > self.per_page
+            rows = rows[: self.per_page]
+        elif direcao == "n":
+            rows = list(
+                queryset.filter(self._after(valores, reverse=False)).order_by(*self.ordering)[: self.per_page + 1]
+            )
+            anterior = True
+            seguinte = len(rows) > self.per_page
+            rows = rows[: self.per_page]
+        else:
+            invertida = [name[1:] if name.startswith("-") else f"-{name}" for name in self.ordering]
+            rows = list(
+                queryset.filter(self._after(valores, reverse=True)).order_by(*invertida)[: self.per_page + 1]
+            )
+            anterior = len(rows) > self.per_page
+            seguinte = True
+            rows = list(reversed(rows[: self.per_page]))
+        next_cursor = self.encode("n", rows[-1]) if rows and seguinte else None
+        previous_cursor = self.encode("p", rows[0]) if rows and anterior else None
+        return KeysetPage(rows, self, next_cursor=next_cursor, previous_cursor=previous_cursor)
+
+    def _after(self, valores, reverse):
+        condicao = Q(pk__in=[])
+        for idx, name in enumerate(self.fields):
+            descending = self.descending[idx] != reverse
+            value = valores[idx]
+            if value is None:
+                # NULL e o maior valor: em ordem decrescente vem antes de todos os nao nulos.
+                termo = Q(**{f"{name}__isnull": False}) if descending else None
+            elif descending:
+                termo = Q(**{f"{name}__lt": value})
+            else:
+                termo = Q(**{f"{name}__gt": value})
+                if self._nullable[name]:
+                    termo |= Q(**{f"{name}__isnull": True})
+            if termo is None:
+                continue
+            for anterior in range(idx):
+                anterior_value = valores[anterior]
+                if anterior_value is None:
+                    termo &= Q(**{f"{self.fields[anterior]}__isnull": True})
+                else:
+                    termo &= Q(**{self.fields[anterior]: anterior_value})
+            condicao |= termo
+        return condicao
+
+    def _value(self, obj, name):
+        value = obj
+        for part in name.split("__"):
+            if value is None:
+                return None
+            value = getattr(value, part)
+        return value
+
+    def encode(self, direcao, obj):
+        valores = []
+        for name in self.fields:
+            value = self._value(obj, name)
+            if hasattr(value, "pk"):
+                value = value.pk
+            valores.append(value.isoformat() if hasattr(value, "isoformat") else value)
+        token = base64.urlsafe_b64encode(json.dumps(valores, default=str).encode()).decode().rstrip("=")
+        return f"{direcao}.{token}"
+
+    def decode(self, cursor):
+        if not cursor or "." not in cursor:
+            return "n", None
+        direcao, token = cursor.split(".", 1)
+        if direcao not in ("n", "p"):
+            return "n", None
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+            valores = json.loads(raw)
+        except (ValueError, TypeError):
+            return "n", None
+        if not isinstance(valores, list) or len(valores) != len(self.fields):
+            return "n", None
+        try:
+            valores = [
+                None if value is None else self._model_fields[name].to_python(value)
+                for name, value in zip(self.fields, valores)
+            ]
+        except (ValidationError, TypeError, ValueError):
+            return "n", None
+        return direcao, valores
+
+
+def ordenacao_com_desempate(ordering, tiebreaker="-pk"):
+    """Acrescenta o campo de desempate (unico) a ordenacao, se ainda nao estiver nela."""
+    ordering = list(ordering or ())
+    nomes = {name.lstrip("-") for name in ordering}
+    desempate = tiebreaker.lstrip("-")
+    if desempate not in nomes and not ({"pk", "id"} & nomes and desempate in {"pk", "id"}):
+        ordering.append(tiebreaker)
+    return ordering
+
+
+def paginar_por_cursor(request, queryset, per_page, ordering, tiebreaker="-pk", cursor_kwarg="cursor"):
+    """Atalho para views que nao herdam de BaseTenantListView (historicos em modal, JSON)."""
+    paginator = KeysetPaginator(queryset, per_page, ordenacao_com_desempate(ordering, tiebreaker))
+    return paginator.page(request.GET.get(cursor_kwarg))
+
+
+class KeysetUnionPaginator(KeysetPaginator):
+    """
+    Paginacao por chave sobre varias fontes (querysets de modelos diferentes) exibidas
+    como uma unica lista em ordem decrescente de data. A chave e (data, fonte, pk):
+    cada pagina faz um SELECT ... LIMIT n+1 por fonte e intercala os resultados.
+
+    fontes: lista de (queryset, campo_data); campo_data nao pode ser nulo.
+    """
+
+    def __init__(self, fontes, per_page):
+        self.fontes = [(queryset, campo) for queryset, campo in fontes]
+        self.per_page = per_page
+        self._data_fields = [queryset.model._meta.get_field(campo) for queryset, campo in self.fontes]
+        self.fields = ["data", "fonte", "pk"]
+
+    def contagem(self):
+        total = 0
+        estimado = False
+        for queryset, _campo in self.fontes:
+            parcial, parcial_estimado = contagem_estimada(queryset)
+            total += parcial
+            estimado = estimado or parcial_estimado
+        return total, estimado
+
+    def page(self, cursor=None):
+        direcao, valores = self.decode(cursor)
+        reverse = valores is not None and direcao == "p"
+        linhas = []
+        for idx, (queryset, campo) in enumerate(self.fontes):
+            if valores is not None:
+                queryset = queryset.filter(self._after_fonte(idx, campo, valores, reverse))
+            prefixo = "" if reverse else "-"
+            for obj in queryset.order_by(f"{prefixo}{campo}", f"{prefixo}pk")[: self.per_page + 1]:
+                linhas.append(((getattr(obj, campo), idx, obj.pk), obj))
+        linhas.sort(key=lambda linha: linha[0], reverse=not reverse)
+        mais = len(linhas) > self.per_page
+        linhas = linhas[: self.per_page]
+        if reverse:
+            linhas.reverse()
+            anterior, seguinte = mais, True
+        else:
+            anterior, seguinte = valores is not None, mais
+        next_cursor = self._encode_chave("n", linhas[-1][0]) if linhas and seguinte else None
+        previous_cursor = self._encode_chave("p", linhas[0][0]) if linhas and anterior else None
+        return KeysetPage(
+            [obj for _chave, obj in linhas],
+            self,
+            next_cursor=next_cursor,
+            previous_cursor=previous_cursor,
+        )
+
+    def _after_fonte(self, idx, campo, valores, reverse):
+        data, fonte, pk = valores
+        lookup = "gt" if reverse else "lt"
+        estrito = Q(**{f"{campo}__{lookup}": data})
+        if idx == fonte:
+            return estrito | Q(**{campo: data, f"pk__{lookup}": pk})
+        fonte_vem_depois = idx > fonte if reverse else idx < fonte
+        if fonte_vem_depois:
+            return estrito | Q(**{campo: data})
+        return estrito
+
+    def _encode_chave(self, direcao, chave):
+        data, fonte, pk = chave
+        token = base64.urlsafe_b64encode(json.dumps([data.isoformat(), fonte, pk]).encode()).decode().rstrip("=")
+        return f"{direcao}.{token}"
+
+    def decode(self, cursor):
+        if not cursor or "." not in cursor:
+            return "n", None
+        direcao, token = cursor.split(".", 1)
+        if direcao not in ("n", "p"):
+            return "n", None
+        try:
+            data, fonte, pk = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+            fonte = int(fonte)
+            data = self._data_fields[fonte].to_python(data)
+            pk = int(pk)
+        except (ValueError, TypeError, IndexError, ValidationError):
+            return "n", None
+        if data is None:
+            return "n", None
+        return direcao, (data, fonte, pk)
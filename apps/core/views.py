@@ -1,9 +1,12 @@
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
+from django.template.loader import render_to_string
 from django.urls import reverse_lazy
 from django.views.generic import CreateView, DetailView, ListView, UpdateView
 
+from .forms import ChoicesCache
 from .mixins import TenantFormMixin, TenantQuerysetMixin
+from .pagination import KeysetPaginator, ordenacao_com_desempate
 
 
 def home(request):
@@ -21,6 +24,15 @@ class BaseTenantListView(PermissionRequiredMixin, LoginRequiredMixin, TenantQuer
     filter_definitions = []
     create_url_name = ""
     update_url_name = ""
+    # Paginacao por cursor (opt-in): pagination_mode = "cursor" com uma ordenacao declarada;
+    # o desempate (unico) e acrescentado ao final para a ordem ser total.
+    pagination_mode = "offset"
+    cursor_ordering = ()
+    cursor_tiebreaker = "-pk"
+    cursor_kwarg = "cursor"
+    # Com lazy_edit_forms o formulario de edicao nao e montado por linha: o modal e
+    # buscado sob demanda (ver BaseTenantEditModalView).
+    lazy_edit_forms = False
 
     def _get_model_permission(self, action):
         if not self.model:
@@ -47,6 +59,19 @@ class BaseTenantListView(PermissionRequiredMixin, LoginRequiredMixin, TenantQuer
             queryset = queryset.filter(**{f"{name}__{lookup}": value})
         return queryset
 
+    def get_cursor_ordering(self):
+        ordering = self.cursor_ordering or self.get_ordering() or self.model._meta.ordering
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        return ordenacao_com_desempate(ordering, self.cursor_tiebreaker)
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.pagination_mode != "cursor":
+            return super().paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(queryset, page_size, self.get_cursor_ordering())
+        page_obj = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        return paginator, page_obj, page_obj.object_list, page_obj.has_other_pages()
+
     def get_filters_context(self):
         filters = []
         for definition in self.filter_definitions:
@@ -78,6 +103,9 @@ class BaseTenantListView(PermissionRequiredMixin, LoginRequiredMixin, TenantQuer
         perm = self._get_model_permission("change")
         return True if not perm else self.request.user.has_perm(perm)
 
+    def get_list_form_kwargs(self):
+        return {}
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["can_add"] = self._can_add()
@@ -89,15 +117,17 @@ class BaseTenantListView(PermissionRequiredMixin, LoginRequiredMixin, TenantQuer
         context["filters"] = self.get_filters_context()
         context["create_url"] = self.get_create_url()
         if self.form_class:
+            choices_cache = ChoicesCache.for_request(self.request)
+            form_kwargs = self.get_list_form_kwargs()
             if context["can_add"]:
-                context["create_form"] = self.form_class()
+                context["create_form"] = choices_cache.apply(self.form_class(**form_kwargs))
             else:
                 context["create_form"] = None
-            if context["can_change"]:
+            if context["can_change"] and not self.lazy_edit_forms:
                 context["edit_rows"] = [
                     {
                         "object": obj,
-                        "form": self.form_class(instance=obj),
+                        "form": choices_cache.apply(self.form_class(instance=obj, **form_kwargs)),
                         "update_url": reverse_lazy(self.update_url_name, args=[obj.pk]),
                     }
                     for obj in context["object_list"]
@@ -144,3 +174,40 @@ class BaseTenantDetailView(PermissionRequiredMixin, LoginRequiredMixin, TenantQu
         app_label = self.model._meta.app_label
         model_name = self.model._meta.model_name
         return (f"{app_label}.view_{model_name}",)
+
+
+class BaseTenantEditModalView(PermissionRequiredMixin, LoginRequiredMixin, TenantQuerysetMixin, DetailView):
+    """
+    Devolve em JSON o modal de edicao de um unico registro, para listas com
+    lazy_edit_forms. Resposta: {"ok", "row_id", "modal_html"}.
+    """
+
+    form_class = None
+    update_url_name = ""
+    permission_action = "change"
+
+    def get_permission_required(self):
+        if not self.model:
+            return ()
+        app_label = self.model._meta.app_label
+        model_name = self.model._meta.model_name
+        return (f"{app_label}.{self.permission_action}_{model_name}",)
+
+    def get_form_kwargs(self):
+        return {"instance": self.object}
+
+    def get_form(self):
+        form = self.form_class(**self.get_form_kwargs())
+        return ChoicesCache.for_request(self.request).apply(form)
+
+    def get_modal_context(self):
+        return {
+            "object": self.object,
+            "form": self.get_form(),
+            "update_url": reverse_lazy(self.update_url_name, args=[self.object.pk]),
+        }
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        modal_html = render_to_string(self.template_name, self.get_modal_context(), request=request)
+        return JsonResponse({"ok": True, "row_id": self.object.pk, "modal_html": modal_html})
@@ -0,0 +1,74 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django_tenants.utils import schema_context
+
+from apps.entregas.services import validar_itens_entrega
+from apps.estoque.models import Estoque
+from apps.funcionarios.models import Funcionario
+from apps.produtos.models import ProdutoFornecedor
+from apps.tenants.models import Company
+
+
+class Command(BaseCommand):
+    help = "Mede consultas e tempo da validacao de itens de entrega para varios tamanhos de lote."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--schema", required=True, help="Schema do tenant usado na medicao.")
+        parser.add_argument("--sizes", default="1,5,15,30", help="Quantidades de itens (separadas por virgula).")
+
+    def handle(self, *args, **options):
+        sizes = [int(value) for value in options["sizes"].split(",") if value.strip()]
+        tenant = Company.objects.filter(schema_name=options["schema"]).first()
+        if not tenant:
+            raise CommandError(f"Tenant '{options['schema']}' nao encontrado.")
+
+        with schema_context(tenant.schema_name):
+            funcionario = Funcionario.objects.filter(company=tenant, ativo=True).order_by("pk").first()
+            if not funcionario:
+                raise CommandError("Nenhum funcionario ativo no tenant.")
+            base_items = self._build_items(tenant, funcionario)
+            if not base_items:
+                raise CommandError("Nenhum estoque com ProdutoFornecedor no tenant.")
+
+            counts = []
+            for size in sizes:
+                items = [base_items[i % len(base_items)] for i in range(size)]
+                with transaction.atomic():
+                    with CaptureQueriesContext(connection) as ctx:
+                        started = time.perf_counter()
+                        result = validar_itens_entrega(tenant=tenant, items=items, allow_negative=True)
+                        elapsed = (time.perf_counter() - started) * 1000
+                    transaction.set_rollback(True)
+                counts.append(len(ctx.captured_queries))
+                self.stdout.write(
+                    f"itens={size:>4} consultas={len(ctx.captured_queries):>3} "
+                    f"tempo={elapsed:.1f}ms erros={len(result['errors'])}"
+                )
+
+        if len(set(counts)) > 1:
+            self.stdout.write(self.style.WARNING("Quantidade de consultas variou com o numero de itens."))
+        else:
+            self.stdout.write(self.style.SUCCESS("Quantidade de consultas constante."))
+
+    def _build_items(self, tenant, funcionario):
+        items = []
+        estoques = Estoque.objects.filter(company=tenant).order_by("pk")[:50]
+        for estoque in estoques:
+            produto_fornecedor = (
+                ProdutoFornecedor.objects.filter(company=tenant, produto_id=estoque.produto_id).order_by("pk").first()
+            )
+            if not produto_fornecedor:
+                continue
+            items.append(
+                {
+                    "funcionario_id": funcionario.pk,
+                    "deposito_id": estoque.deposito_id,
+                    "produto_fornecedor_id": produto_fornecedor.pk,
+                    "quantidade": "1",
+                    "grade": estoque.grade,
+                }
+            )
+        return items
@@ -0,0 +1,102 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def preencher_posse(apps, schema_editor):
+    # Ultimo recebimento de cada funcionario/produto/grade, menos o devolvido.
+    posse = apps.get_model("entregas", "PosseAtual")._meta.db_table
+    entrega = apps.get_model("entregas", "Entrega")._meta.db_table
+    entrega_item = apps.get_model("entregas", "EntregaItem")._meta.db_table
+    devolucao_item = apps.get_model("entregas", "DevolucaoItem")._meta.db_table
+    schema_editor.execute(
+        f"""
+        WITH ultimos AS (
+            SELECT DISTINCT ON (e.funcionario_id, i.produto_id, lower(btrim(i.grade)))
+                i.company_id, e.funcionario_id, i.produto_id, lower(btrim(i.grade)) AS grade,
+                i.id AS entrega_item_id, e.entregue_em, i.quantidade
+            FROM {entrega_item} AS i
+            JOIN {entrega} AS e ON e.id = i.entrega_id
+            WHERE e.status <> 'cancelada' AND e.entregue_em IS NOT NULL
+            ORDER BY e.funcionario_id, i.produto_id, lower(btrim(i.grade)),
+                     e.entregue_em DESC, e.id DESC, i.id DESC
+        ),
+        devolvidos AS (
+            SELECT d.entrega_item_id, sum(d.quantidade) AS total
+            FROM {devolucao_item} AS d
+            WHERE d.entrega_item_id IN (SELECT entrega_item_id FROM ultimos)
+            GROUP BY d.entrega_item_id
+        )
+        INSERT INTO {posse} (
+            company_id, funcionario_id, produto_id, grade, entrega_item_id,
+            entregue_em, quantidade, devolvido, saldo, atualizado_em
+        )
+        SELECT
+            u.company_id, u.funcionario_id, u.produto_id, u.grade, u.entrega_item_id,
+            u.entregue_em, u.quantidade, coalesce(d.total, 0), u.quantidade - coalesce(d.total, 0), now()
+        FROM ultimos AS u
+        LEFT JOIN devolvidos AS d ON d.entrega_item_id = u.entrega_item_id
+        """
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tenants", "0002_company_estoque_enabled"),
+        ("produtos", "0040_produto_situacao_ca"),
+        ("funcionarios", "0026_fichas_pdf_exportacao"),
+        ("entregas", "0012_devolucaoitem_volta_para_estoque"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PosseAtual",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("grade", models.CharField(blank=True, max_length=50)),
+                ("entregue_em", models.DateTimeField()),
+                ("quantidade", models.DecimalField(decimal_places=2, max_digits=12)),
+                ("devolvido", models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ("saldo", models.DecimalField(decimal_places=2, max_digits=12)),
+                ("atualizado_em", models.DateTimeField(auto_now=True)),
+                (
+                    "company",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="+", to="tenants.company"
+                    ),
+                ),
+                (
+                    "entrega_item",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="posse_atual",
+                        to="entregas.entregaitem",
+                    ),
+                ),
+                (
+                    "funcionario",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="posses",
+                        to="funcionarios.funcionario",
+                    ),
+                ),
+                (
+                    "produto",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="+", to="produtos.produto"
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [models.Index(fields=["company", "produto"], name="posse_atual_company_produto")],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="posseatual",
+            constraint=models.UniqueConstraint(
+                fields=("funcionario", "produto", "grade"), name="entregas_posse_atual_uniq"
+            ),
+        ),
+        migrations.RunPython(preencher_posse, migrations.RunPython.noop),
+    ]
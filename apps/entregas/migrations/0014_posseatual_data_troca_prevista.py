@@ -0,0 +1,42 @@
+from django.db import migrations, models
+
+
+def preencher_troca_prevista(apps, schema_editor):
+    # entregue_em + quantidade x fator_dias da periodicidade do produto.
+    posse = apps.get_model("entregas", "PosseAtual")._meta.db_table
+    produto = apps.get_model("produtos", "Produto")._meta.db_table
+    periodicidade = apps.get_model("produtos", "Periodicidade")._meta.db_table
+    dias = "coalesce(p.periodicidade_quantidade, 0) * coalesce(per.fator_dias, 0)"
+    schema_editor.execute(
+        f"""
+        UPDATE {posse} AS pa
+        SET data_troca_prevista = CASE WHEN {dias} > 0 THEN pa.entregue_em + make_interval(days => {dias}) END
+        FROM {produto} AS p
+        LEFT JOIN {periodicidade} AS per ON per.id = p.periodicidade_id
+        WHERE p.id = pa.produto_id
+        """
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("entregas", "0013_posseatual"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="posseatual",
+            name="data_troca_prevista",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="posseatual",
+            index=models.Index(
+                condition=models.Q(("saldo__gt", 0)),
+                fields=["company", "data_troca_prevista"],
+                name="posse_atual_troca",
+            ),
+        ),
+        migrations.RunPython(preencher_troca_prevista, migrations.RunPython.noop),
+    ]
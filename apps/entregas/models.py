@@ -116,3 +116,49 @@ class DevolucaoItem(TenantModel):
             raise ValidationError({"quantidade": "Quantidade deve ser maior que zero."})
         if self.condicao == self.CONDICAO_OUTRA and not (self.motivo or "").strip():
             raise ValidationError({"motivo": "Informe o motivo para a condicao 'Outra'."})
+
+
+class PosseAtual(models.Model):
+    """
+    Item em posse do funcionario por (produto, grade): o ultimo recebimento nao
+    cancelado, com o total ja devolvido. Projecao mantida por
+    services.atualizar_posse na mesma transacao de entregas, devolucoes e
+    cancelamentos; nao editar direto.
+    """
+
+    company = models.ForeignKey("tenants.Company", on_delete=models.CASCADE, related_name="+")
+    funcionario = models.ForeignKey(
+        "funcionarios.Funcionario",
+        on_delete=models.CASCADE,
+        related_name="posses",
+    )
+    produto = models.ForeignKey("produtos.Produto", on_delete=models.CASCADE, related_name="+")
+    # Grade normalizada (minusculas, sem espacos nas pontas); o rotulo original fica no item.
+    grade = models.CharField(max_length=50, blank=True)
+    entrega_item = models.OneToOneField(EntregaItem, on_delete=models.CASCADE, related_name="posse_atual")
+    entregue_em = models.DateTimeField()
+    quantidade = models.DecimalField(max_digits=12, decimal_places=2)
+    devolvido = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    saldo = models.DecimalField(max_digits=12, decimal_places=2)
+    # entregue_em + periodicidade do produto; nulo quando o produto nao tem periodicidade.
+    data_troca_prevista = models.DateTimeField(null=True, blank=True)
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["funcionario", "produto", "grade"],
+                name="entregas_posse_atual_uniq",
+            )
+        ]
+        indexes = [
+            models.Index(fields=["company", "produto"], name="posse_atual_company_produto"),
+            models.Index(
+                fields=["company", "data_troca_prevista"],
+                name="posse_atual_troca",
+                condition=models.Q(saldo__gt=0),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.funcionario_id} - {self.produto_id} ({self.saldo})"
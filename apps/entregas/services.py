@@ -0,0 +1,480 @@
+import hashlib
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+
+from apps.estoque.models import MODO_LOCK, Estoque, modo_atualizacao
+from apps.funcionarios.models import Funcionario, FuncionarioProduto
+from apps.produtos.models import Periodicidade, Produto, ProdutoFornecedor
+from apps.produtos.services import grade_opcoes_por_produto
+from apps.tipos_funcionario.models import TipoFuncionarioProduto
+from .models import DevolucaoItem, Entrega, EntregaItem, PosseAtual
+
+LIBERACAO_CACHE_TIMEOUT = 300
+
+
+def _to_int(value):
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _liberacao_prefix(company_id):
+    return f"entregas:liberacao:{company_id}"
+
+
+def _liberacao_versao(company_id):
+    key = f"{_liberacao_prefix(company_id)}:versao"
+    versao = cache.get(key)
+    if versao is None:
+        versao = 1
+        cache.add(key, versao, None)
+    return versao
+
+
+def _liberacao_key(company_id, funcionario_id):
+    return f"{_liberacao_prefix(company_id)}:{_liberacao_versao(company_id)}:{funcionario_id}"
+
+
+def invalidar_liberacoes(company_id, funcionario_id=None):
+    """
+    Invalida o indice de produtos liberados. Com funcionario_id remove apenas a
+    entrada do funcionario; sem ele troca a versao do tenant (todas as entradas).
+    """
+    if not company_id:
+        return
+    if funcionario_id is not None:
+        cache.delete(_liberacao_key(company_id, funcionario_id))
+        return
+    key = f"{_liberacao_prefix(company_id)}:versao"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+
+
+def produtos_liberados(tenant, funcionario_id, usar_cache=True):
+    """
+    Indice de disponibilizacao por funcionario: quais ProdutoFornecedor ele pode receber.
+    Resolvido uma vez (FuncionarioProduto + TipoFuncionarioProduto) e mantido em cache
+    ate um dos sinais de apps/entregas/signals.py invalidar. Sem CACHES compartilhado
+    a invalidacao so alcanca o processo que gravou: quem valida uma gravacao passa
+    usar_cache=False e le direto do banco.
+
+    Retorna {"restrito", "funcionario", "tipo_id", "ids"}; restrito=False significa
+    que o tenant ainda nao configurou regras e todos os produtos estao liberados.
+    """
+    funcionario_pk = _to_int(funcionario_id)
+    key = _liberacao_key(tenant.pk, funcionario_pk)
+    if usar_cache:
+        entrada = cache.get(key)
+        if entrada is not None:
+            return entrada
+
+    # Se nenhuma regra de disponibilizacao foi configurada ainda,
+    # permite todos os produtos (evita tela vazia para empresas novas).
+    restrictions_exist = (
+        FuncionarioProduto.objects.filter(company=tenant).exists()
+        or TipoFuncionarioProduto.objects.filter(company=tenant).exists()
+    )
+    funcionario = None
+    if funcionario_pk is not None:
+        funcionario = Funcionario.objects.filter(company=tenant, pk=funcionario_pk).only("id", "tipo_id").first()
+    ids = set()
+    if restrictions_exist and funcionario:
+        ids = set(
+            FuncionarioProduto.objects.filter(
+                company=tenant,
+                funcionario_id=funcionario.pk,
+                ativo=True,
+            ).values_list("produto_fornecedor_id", flat=True)
+        )
+        if funcionario.tipo_id:
+            ids |= set(
+                TipoFuncionarioProduto.objects.filter(
+                    company=tenant,
+                    tipo_funcionario_id=funcionario.tipo_id,
+                ).values_list("produto_fornecedor_id", flat=True)
+            )
+    entrada = {
+        "restrito": restrictions_exist,
+        "funcionario": funcionario is not None,
+        "tipo_id": funcionario.tipo_id if funcionario else None,
+        "ids": frozenset(ids),
+    }
+    if usar_cache:
+        cache.set(key, entrada, LIBERACAO_CACHE_TIMEOUT)
+    return entrada
+
+
+def produtos_permitidos(tenant, funcionario_id, produto_fornecedor_ids, usar_cache=True):
+    """
+    Resolve a disponibilizacao de varios ProdutoFornecedor para um funcionario
+    a partir do indice produtos_liberados. Retorna {produto_fornecedor_id: (permitido, motivo)}.
+    """
+    produto_fornecedor_ids = set(produto_fornecedor_ids)
+    if not produto_fornecedor_ids:
+        return {}
+    liberacao = produtos_liberados(tenant, funcionario_id, usar_cache=usar_cache)
+    if not liberacao["restrito"]:
+        return {pk: (True, None) for pk in produto_fornecedor_ids}
+    if not liberacao["funcionario"]:
+        return {pk: (False, "Funcionario invalido.") for pk in produto_fornecedor_ids}
+    if liberacao["tipo_id"]:
+        negado = "Produto nao liberado para o tipo ou para o funcionario."
+    else:
+        negado = "Funcionario sem tipo definido."
+    return {
+        pk: (True, None) if pk in liberacao["ids"] else (False, negado)
+        for pk in produto_fornecedor_ids
+    }
+
+
+def _parse_itens(items):
+    """
+    Primeira passada (sem banco): valida campos obrigatorios, funcionario unico e quantidade.
+    """
+    parsed = []
+    funcionario_ref = None
+    for idx, item in enumerate(items, start=1):
+        funcionario_id = item.get("funcionario_id")
+        deposito_id = item.get("deposito_id")
+        produto_fornecedor_id = item.get("produto_fornecedor_id")
+        quantidade_raw = item.get("quantidade")
+        grade = (item.get("grade") or "").strip()
+        if not funcionario_id or not deposito_id or not produto_fornecedor_id or not quantidade_raw:
+            parsed.append({"idx": idx, "error": f"Item {idx}: preencha funcionario, produto, deposito e quantidade."})
+            continue
+        if funcionario_ref is None:
+            funcionario_ref = funcionario_id
+        elif str(funcionario_ref) != str(funcionario_id):
+            parsed.append({"idx": idx, "error": "Todos os itens devem pertencer ao mesmo funcionario."})
+            continue
+        try:
+            quantidade = Decimal(str(quantidade_raw))
+        except (InvalidOperation, ValueError):
+            parsed.append({"idx": idx, "error": f"Item {idx}: quantidade invalida."})
+            continue
+        if quantidade <= 0:
+            parsed.append({"idx": idx, "error": f"Item {idx}: quantidade deve ser maior que zero."})
+            continue
+        parsed.append(
+            {
+                "idx": idx,
+                "error": None,
+                "funcionario_id": funcionario_id,
+                "deposito_id": deposito_id,
+                "deposito_pk": _to_int(deposito_id),
+                "produto_fornecedor_pk": _to_int(produto_fornecedor_id),
+                "quantidade": quantidade,
+                "grade": grade,
+                "observacao": item.get("observacao") or "",
+            }
+        )
+    return parsed, funcionario_ref
+
+
+def _carregar_estoques(tenant, chaves, planta_id=None):
+    """
+    Busca de uma vez os Estoques de todas as chaves (produto_id, deposito_id, grade).
+    Em caso de duplicidade mantem o menor pk, como o antigo .first().
+    """
+    if not chaves:
+        return {}
+    filters = {
+        "company": tenant,
+        "produto_id__in": {chave[0] for chave in chaves},
+        "deposito_id__in": {chave[1] for chave in chaves},
+        "grade__in": {chave[2] for chave in chaves},
+    }
+    if planta_id:
+        filters["deposito__planta_id"] = planta_id
+    estoques = {}
+    for estoque in Estoque.objects.filter(**filters).select_related("deposito").order_by("pk"):
+        key = (estoque.produto_id, estoque.deposito_id, estoque.grade)
+        if key in chaves:
+            estoques.setdefault(key, estoque)
+    return estoques
+
+
+def validar_itens_entrega(*, tenant, items, planta_id=None, allow_negative=False):
+    """
+    Valida os itens de uma entrega com um numero fixo de consultas, independente
+    da quantidade de itens, e (no modo lock) trava todos os Estoques envolvidos em
+    um unico SELECT ... FOR UPDATE ordenado por pk (evita deadlock entre entregas simultaneas).
+
+    Deve ser chamada dentro de transaction.atomic().
+    Retorna {"errors", "confirm_items", "created", "required_map"}.
+    """
+    result = {"errors": [], "confirm_items": [], "created": [], "required_map": {}}
+    parsed, funcionario_ref = _parse_itens(items)
+    validos = [row for row in parsed if not row["error"]]
+
+    produto_fornecedor_ids = {row["produto_fornecedor_pk"] for row in validos if row["produto_fornecedor_pk"]}
+    produtos_fornecedor = {}
+    if produto_fornecedor_ids:
+        produtos_fornecedor = ProdutoFornecedor.objects.filter(
+            company=tenant,
+            pk__in=produto_fornecedor_ids,
+        ).select_related("produto").in_bulk()
+    grades_map = grade_opcoes_por_produto(pf.produto for pf in produtos_fornecedor.values())
+    permissoes = produtos_permitidos(tenant, funcionario_ref, produtos_fornecedor.keys(), usar_cache=False)
+    chaves = {
+        (produtos_fornecedor[row["produto_fornecedor_pk"]].produto_id, row["deposito_pk"], row["grade"])
+        for row in validos
+        if row["produto_fornecedor_pk"] in produtos_fornecedor and row["deposito_pk"] is not None
+    }
+    estoques = _carregar_estoques(tenant, chaves, planta_id=planta_id)
+
+    errors = result["errors"]
+    required_map = result["required_map"]
+    for row in parsed:
+        idx = row["idx"]
+        if row["error"]:
+            errors.append(row["error"])
+            continue
+        produto_fornecedor = produtos_fornecedor.get(row["produto_fornecedor_pk"])
+        if not produto_fornecedor:
+            errors.append(f"Item {idx}: produto/CA invalido.")
+            continue
+        grade = row["grade"]
+        grades = grades_map.get(produto_fornecedor.produto_id, []) if produto_fornecedor.produto else []
+        if grades and not grade:
+            errors.append(f"Item {idx}: selecione a grade do produto.")
+            continue
+        if grade and grade not in grades:
+            errors.append(f"Item {idx}: grade invalida para o produto selecionado.")
+            continue
+        permitido, motivo = permissoes.get(produto_fornecedor.pk, (False, "Funcionario invalido."))
+        if not permitido:
+            errors.append(f"Item {idx}: {motivo}")
+            continue
+        key = (produto_fornecedor.produto_id, row["deposito_pk"], grade)
+        estoque = estoques.get(key)
+        if not estoque:
+            errors.append(f"Item {idx}: nao existe estoque para este produto no deposito informado.")
+            continue
+        produto_ca = (produto_fornecedor.produto.ca or "").strip()
+        required_map[key] = {
+            "estoque": estoque,
+            "quantidade": required_map.get(key, {}).get("quantidade", Decimal("0")) + row["quantidade"],
+            "produto_label": f"{produto_fornecedor.produto} | CA {produto_ca or '-'}",
+            "deposito_label": estoque.deposito.nome if estoque.deposito_id else "-",
+            "grade": grade,
+        }
+        result["created"].append(
+            {
+                "funcionario_id": row["funcionario_id"],
+                "deposito_id": row["deposito_id"],
+                "produto": produto_fornecedor.produto,
+                "quantidade": row["quantidade"],
+                "ca": produto_ca,
+                "grade": grade,
+                "observacao": row["observacao"],
+            }
+        )
+
+    if errors:
+        return result
+
+    queryset = Estoque.objects.filter(pk__in=[payload["estoque"].pk for payload in required_map.values()])
+    if modo_atualizacao() == MODO_LOCK:
+        queryset = queryset.select_for_update(of=("self",))
+    # Nos modos atomico/otimista nao ha lock: o bloqueio de negativo e garantido
+    # de novo pelo UPDATE condicional de MovimentacaoEstoque.objects.bulk_apply.
+    locked = {estoque.pk: estoque for estoque in queryset.select_related("deposito").order_by("pk")}
+    for payload in required_map.values():
+        estoque = locked.get(payload["estoque"].pk)
+        if not estoque:
+            errors.append("Nao existe estoque para um dos itens.")
+            return result
+        if estoque.deposito and estoque.deposito.bloquear_movimento_negativo:
+            if payload["quantidade"] > estoque.quantidade:
+                deposito_label = payload.get("deposito_label") or "deposito informado"
+                errors.append(f"Movimento negativo bloqueado para o deposito {deposito_label}.")
+                return result
+        if not allow_negative and payload["quantidade"] > estoque.quantidade:
+            result["confirm_items"].append(
+                {
+                    "produto": payload.get("produto_label", "-"),
+                    "deposito": payload.get("deposito_label", "-"),
+                    "quantidade": str(payload["quantidade"]),
+                    "estoque": str(estoque.quantidade),
+                }
+            )
+        payload["estoque"] = estoque
+    return result
+
+
+def _lock_posse(funcionario_id):
+    # Serializa recalculos da posse do mesmo funcionario ate o commit (o DELETE +
+    # INSERT concorrente esbarraria na unique de PosseAtual).
+    chave = f"{getattr(connection, 'schema_name', 'public')}:posse:{funcionario_id}"
+    numero = int(hashlib.md5(chave.encode("utf-8")).hexdigest()[:15], 16)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", [numero])
+
+
+def _troca_prevista_sql(entregue_em):
+    # Mesma regra de EntregaDetailView: entregue_em + quantidade x fator_dias da periodicidade.
+    dias = "coalesce(p.periodicidade_quantidade, 0) * coalesce(per.fator_dias, 0)"
+    return f"CASE WHEN {dias} > 0 THEN {entregue_em} + make_interval(days => {dias}) END"
+
+
+def _recalcular_posse(funcionario_id=None, produto_ids=None):
+    posse = PosseAtual._meta.db_table
+    filtros_posse = ["TRUE"]
+    filtros_itens = ["e.status <> 'cancelada'", "e.entregue_em IS NOT NULL"]
+    params = []
+    if funcionario_id is not None:
+        filtros_posse.append("funcionario_id = %s")
+        filtros_itens.append("e.funcionario_id = %s")
+        params.append(funcionario_id)
+    if produto_ids is not None:
+        filtros_posse.append("produto_id = ANY(%s)")
+        filtros_itens.append("i.produto_id = ANY(%s)")
+        params.append(list(produto_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {posse} WHERE {' AND '.join(filtros_posse)}", params)
+        cursor.execute(
+            f"""
+            WITH ultimos AS (
+                SELECT DISTINCT ON (e.funcionario_id, i.produto_id, lower(btrim(i.grade)))
+                    i.company_id, e.funcionario_id, i.produto_id, lower(btrim(i.grade)) AS grade,
+                    i.id AS entrega_item_id, e.entregue_em, i.quantidade,
+                    {_troca_prevista_sql("e.entregue_em")} AS data_troca_prevista
+                FROM {EntregaItem._meta.db_table} AS i
+                JOIN {Entrega._meta.db_table} AS e ON e.id = i.entrega_id
+                JOIN {Produto._meta.db_table} AS p ON p.id = i.produto_id
+                LEFT JOIN {Periodicidade._meta.db_table} AS per ON per.id = p.periodicidade_id
+                WHERE {' AND '.join(filtros_itens)}
+                ORDER BY e.funcionario_id, i.produto_id, lower(btrim(i.grade)),
+                         e.entregue_em DESC, e.id DESC, i.id DESC
+            ),
+            devolvidos AS (
+                SELECT d.entrega_item_id, sum(d.quantidade) AS total
+                FROM {DevolucaoItem._meta.db_table} AS d
+                WHERE d.entrega_item_id IN (SELECT entrega_item_id FROM ultimos)
+                GROUP BY d.entrega_item_id
+            )
+            INSERT INTO {posse} (
+                company_id, funcionario_id, produto_id, grade, entrega_item_id,
+                entregue_em, quantidade, devolvido, saldo, data_troca_prevista, atualizado_em
+            )
+            SELECT
+                u.company_id, u.funcionario_id, u.produto_id, u.grade, u.entrega_item_id,
+                u.entregue_em, u.quantidade, coalesce(d.total, 0), u.quantidade - coalesce(d.total, 0),
+                u.data_troca_prevista, now()
+            FROM ultimos AS u
+            LEFT JOIN devolvidos AS d ON d.entrega_item_id = u.entrega_item_id
+            """,
+            params,
+        )
+
+
+def atualizar_posse(funcionario_id, produto_ids=None):
+    """
+    Recalcula PosseAtual do funcionario (so dos produtos informados, se houver)
+    a partir das entregas e devolucoes. Roda na transacao corrente: quem grava
+    entrega, devolucao ou cancelamento ve a posse ja atualizada antes do commit.
+    """
+    if not funcionario_id:
+        return
+    with transaction.atomic():
+        _lock_posse(funcionario_id)
+        _recalcular_posse(funcionario_id, produto_ids)
+
+
+def reconstruir_posse():
+    """Recria PosseAtual do schema atual inteiro."""
+    with transaction.atomic():
+        _recalcular_posse()
+
+
+def atualizar_troca_prevista(produto_ids=None, periodicidade_ids=None):
+    """
+    Recalcula data_troca_prevista de PosseAtual dos produtos (ou periodicidades)
+    informados, com um UPDATE. Chamado quando muda a periodicidade do produto.
+    """
+    posse = PosseAtual._meta.db_table
+    filtros = ["p.id = pa.produto_id"]
+    params = []
+    if produto_ids is not None:
+        filtros.append("p.id = ANY(%s)")
+        params.append(list(produto_ids))
+    if periodicidade_ids is not None:
+        filtros.append("p.periodicidade_id = ANY(%s)")
+        params.append(list(periodicidade_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {posse} AS pa
+            SET data_troca_prevista = {_troca_prevista_sql("pa.entregue_em")}
+            FROM {Produto._meta.db_table} AS p
+            LEFT JOIN {Periodicidade._meta.db_table} AS per ON per.id = p.periodicidade_id
+            WHERE {" AND ".join(filtros)}
+            """,
+            params,
+        )
+
+
+def trocas_previstas(tenant, ate, desde=None, planta_id=None, setor_id=None):
+    """
+    Itens em posse (saldo > 0) de funcionarios ativos com troca prevista ate `ate`
+    (e a partir de `desde`, se informado; sem ele entram as trocas ja vencidas).
+    Usa o indice parcial (company, data_troca_prevista) de PosseAtual.
+    """
+    queryset = PosseAtual.objects.filter(
+        company=tenant,
+        saldo__gt=0,
+        data_troca_prevista__lte=ate,
+        funcionario__ativo=True,
+    )
+    if desde:
+        queryset = queryset.filter(data_troca_prevista__gte=desde)
+    if planta_id:
+        queryset = queryset.filter(funcionario__planta_id=planta_id)
+    if setor_id:
+        queryset = queryset.filter(funcionario__setor_id=setor_id)
+    return queryset.select_related("funcionario__setor", "funcionario__planta", "produto", "entrega_item")
+
+
+def projecao_compras(tenant, ate, desde=None, planta_id=None, setor_id=None):
+    """
+    Necessidade de compra por produto para as trocas previstas no periodo: total a
+    repor (saldo em posse), funcionarios afetados, estoque atual (da planta, se
+    informada) e a diferenca que falta comprar.
+    """
+    linhas = list(
+        trocas_previstas(tenant, ate, desde=desde, planta_id=planta_id, setor_id=setor_id)
+        .values("produto_id", "produto__nome")
+        .annotate(funcionarios=Count("funcionario_id", distinct=True), quantidade=Sum("saldo"))
+        .order_by("produto__nome")
+    )
+    if not linhas:
+        return []
+    estoques = Estoque.objects.filter(company=tenant, produto_id__in=[linha["produto_id"] for linha in linhas])
+    if planta_id:
+        estoques = estoques.filter(deposito__planta_id=planta_id)
+    saldo_estoque = {
+        row["produto_id"]: row["total"] or Decimal("0")
+        for row in estoques.values("produto_id").annotate(total=Sum("quantidade")).order_by()
+    }
+    projecao = []
+    for linha in linhas:
+        estoque = saldo_estoque.get(linha["produto_id"], Decimal("0"))
+        quantidade = linha["quantidade"] or Decimal("0")
+        projecao.append(
+            {
+                "produto_id": linha["produto_id"],
+                "produto": linha["produto__nome"],
+                "funcionarios": linha["funcionarios"],
+                "quantidade": quantidade,
+                "estoque": estoque,
+                "comprar": max(Decimal("0"), quantidade - estoque),
+            }
+        )
+    return projecao
@@ -0,0 +1,99 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from apps.funcionarios.models import Funcionario, FuncionarioProduto
+from apps.produtos.models import Periodicidade, Produto
+from apps.tipos_funcionario.models import TipoFuncionarioProduto
+from .models import DevolucaoItem, Entrega, EntregaItem
+from .services import atualizar_posse, atualizar_troca_prevista, invalidar_liberacoes
+
+# Campos de Entrega que decidem se os itens contam como posse.
+CAMPOS_POSSE_ENTREGA = {"status", "entregue_em", "funcionario"}
+# Campos de Produto que mudam a data de troca prevista.
+CAMPOS_TROCA_PRODUTO = {"periodicidade", "periodicidade_quantidade"}
+
+
+def _invalidar(company_id, funcionario_id=None):
+    # Invalida ja (mesma transacao) e de novo no commit, para nao deixar no cache
+    # uma leitura feita por outra requisicao antes do commit.
+    invalidar_liberacoes(company_id, funcionario_id)
+    transaction.on_commit(lambda: invalidar_liberacoes(company_id, funcionario_id))
+
+
+@receiver(post_save, sender=FuncionarioProduto)
+@receiver(post_delete, sender=FuncionarioProduto)
+@receiver(post_save, sender=TipoFuncionarioProduto)
+@receiver(post_delete, sender=TipoFuncionarioProduto)
+def invalidar_liberacoes_regra(sender, instance, **kwargs):
+    if not instance or not instance.company_id:
+        return
+    _invalidar(instance.company_id)
+
+
+@receiver(post_save, sender=Funcionario)
+@receiver(post_delete, sender=Funcionario)
+def invalidar_liberacoes_funcionario(sender, instance, **kwargs):
+    # O tipo do funcionario define parte dos produtos liberados.
+    if not instance or not instance.company_id or not instance.pk:
+        return
+    _invalidar(instance.company_id, instance.pk)
+
+
+def _altera_posse(update_fields):
+    return update_fields is None or bool(CAMPOS_POSSE_ENTREGA & set(update_fields))
+
+
+def _funcionario_do_item(entrega_item):
+    if EntregaItem._meta.get_field("entrega").is_cached(entrega_item):
+        return entrega_item.entrega.funcionario_id
+    return Entrega.objects.filter(pk=entrega_item.entrega_id).values_list("funcionario_id", flat=True).first()
+
+
+@receiver(pre_save, sender=Entrega)
+def guardar_funcionario_posse(sender, instance, update_fields=None, **kwargs):
+    instance._funcionario_posse_anterior = None
+    if instance.pk is None or (update_fields is not None and "funcionario" not in update_fields):
+        return
+    instance._funcionario_posse_anterior = (
+        Entrega.objects.filter(pk=instance.pk).values_list("funcionario_id", flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Entrega)
+def atualizar_posse_entrega(sender, instance, created=False, update_fields=None, **kwargs):
+    # Entrega nova ainda nao tem itens; os itens atualizam a posse ao serem gravados.
+    if created or not _altera_posse(update_fields):
+        return
+    atualizar_posse(instance.funcionario_id)
+    anterior = getattr(instance, "_funcionario_posse_anterior", None)
+    if anterior and anterior != instance.funcionario_id:
+        atualizar_posse(anterior)
+
+
+# bulk_create de itens nao dispara post_save: quem usa chama atualizar_posse direto.
+@receiver(post_save, sender=EntregaItem)
+@receiver(post_delete, sender=EntregaItem)
+def atualizar_posse_item(sender, instance, **kwargs):
+    atualizar_posse(_funcionario_do_item(instance), [instance.produto_id])
+
+
+@receiver(post_save, sender=DevolucaoItem)
+@receiver(post_delete, sender=DevolucaoItem)
+def atualizar_posse_devolucao(sender, instance, **kwargs):
+    entrega_item = instance.entrega_item
+    atualizar_posse(_funcionario_do_item(entrega_item), [entrega_item.produto_id])
+
+
+@receiver(post_save, sender=Produto)
+def atualizar_troca_produto(sender, instance, created=False, update_fields=None, **kwargs):
+    if created or (update_fields is not None and not CAMPOS_TROCA_PRODUTO & set(update_fields)):
+        return
+    atualizar_troca_prevista(produto_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Periodicidade)
+def atualizar_troca_periodicidade(sender, instance, created=False, update_fields=None, **kwargs):
+    if created or (update_fields is not None and "fator_dias" not in update_fields):
+        return
+    atualizar_troca_prevista(periodicidade_ids=[instance.pk])
@@ -9,6 +9,7 @@ urlpatterns = [
     path("entregas/novo/", views.EntregaCreateView.as_view(), name="create"),
     path("entregas/solicitar/", views.EntregaSolicitacaoCreateView.as_view(), name="solicitar"),
     path("entregas/depositos/", views.EntregaDepositosView.as_view(), name="depositos"),
+    path("entregas/trocas/", views.EntregaTrocasView.as_view(), name="trocas"),
     path("entregas/produtos/", views.EntregaProdutosView.as_view(), name="produtos"),
     path("entregas/devolucoes/itens/", views.DevolucaoFuncionarioItensView.as_view(), name="devolucao_itens"),
     path(
@@ -3,8 +3,10 @@ import json
 import logging
 import uuid
 import binascii
+from datetime import timedelta
 from decimal import Decimal, InvalidOperation
 
+from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
 from django.contrib.auth.hashers import check_password
 from django.contrib.auth.mixins import PermissionRequiredMixin
@@ -12,6 +14,7 @@ from django.db import transaction
 from django.db.models import Max, Sum
 from django.utils import timezone
 from django.http import JsonResponse, HttpResponseRedirect
+from django.shortcuts import render
 from django.views import View
 from django.template.loader import render_to_string
 from django.urls import reverse
@@ -20,13 +23,23 @@ logger = logging.getLogger(__name__)
 
 MAX_ASSINATURA_SIZE = 3 * 1024 * 1024  # 3MB
 
+from apps.caepi.services import status_cas
+from apps.core.pagination import paginar_por_cursor
 from apps.core.views import BaseTenantCreateView, BaseTenantListView
 from apps.estoque.models import Estoque, MovimentacaoEstoque
-from apps.funcionarios.models import Funcionario, FuncionarioHistorico, FuncionarioProduto
+from apps.funcionarios.models import Funcionario, FuncionarioHistorico
 from apps.produtos.models import ProdutoFornecedor
-from apps.tipos_funcionario.models import TipoFuncionarioProduto
+from apps.setores.models import Setor
 from .forms import EntregaForm
-from .models import Devolucao, DevolucaoItem, Entrega, EntregaItem
+from .models import Devolucao, DevolucaoItem, Entrega, EntregaItem, PosseAtual
+from .services import (
+    atualizar_posse,
+    produtos_liberados,
+    produtos_permitidos,
+    projecao_compras,
+    trocas_previstas,
+    validar_itens_entrega,
+)
 
 
 def _get_or_create_estoque_for_update(*, request, produto, deposito, grade):
@@ -70,6 +83,8 @@ class EntregaListView(BaseTenantListView):
     form_class = None
     create_form_class = EntregaForm
     paginate_by = 10
+    pagination_mode = "cursor"
+    cursor_ordering = ("-entregue_em",)
     title = "Entregas"
     headers = [
         "Entrega",
@@ -355,39 +370,10 @@ class EntregaCreateView(BaseTenantCreateView):
         return items, None
 
     def _is_produto_permitido(self, funcionario_id, produto_fornecedor):
-        # Se nenhuma regra de disponibilizacao foi configurada ainda,
-        # permite todos os produtos (evita tela vazia para empresas novas).
-        restrictions_exist = (
-            FuncionarioProduto.objects.filter(company=self.request.tenant).exists()
-            or TipoFuncionarioProduto.objects.filter(company=self.request.tenant).exists()
+        permissoes = produtos_permitidos(
+            self.request.tenant, funcionario_id, [produto_fornecedor.pk], usar_cache=False
         )
-        if not restrictions_exist:
-            return True, None
-
-        funcionario = Funcionario.objects.filter(
-            company=self.request.tenant,
-            pk=funcionario_id,
-        ).select_related("tipo").first()
-        if not funcionario:
-            return False, "Funcionario invalido."
-        permitido_funcionario = FuncionarioProduto.objects.filter(
-            company=self.request.tenant,
-            funcionario_id=funcionario_id,
-            produto_fornecedor_id=produto_fornecedor.pk,
-            ativo=True,
-        ).exists()
-        permitido_tipo = False
-        if funcionario.tipo_id:
-            permitido_tipo = TipoFuncionarioProduto.objects.filter(
-                company=self.request.tenant,
-                tipo_funcionario_id=funcionario.tipo_id,
-                produto_fornecedor_id=produto_fornecedor.pk,
-            ).exists()
-        if permitido_funcionario or permitido_tipo:
-            return True, None
-        if not funcionario.tipo_id:
-            return False, "Funcionario sem tipo definido."
-        return False, "Produto nao liberado para o tipo ou para o funcionario."
+        return permissoes[produto_fornecedor.pk]
 
     def _validate_and_create_items(self, items, form, allow_negative=False):
         result = self._validate_items(items, form, allow_negative=allow_negative)
@@ -412,7 +398,13 @@ class EntregaCreateView(BaseTenantCreateView):
             validacao_recebimento=validacao_entrega,
         )
         self._apply_assinatura(entrega)
+        self._create_itens_and_movimentos(entrega, created, required_map)
+        return entrega
+
+    def _create_itens_and_movimentos(self, entrega, created, required_map):
         itens = []
+        movimentos = []
+        historicos = []
         for item in created:
             grade = (item.get("grade") or "").strip()
             itens.append(
@@ -430,149 +422,52 @@ class EntregaCreateView(BaseTenantCreateView):
                 )
             )
             estoque_key = (item["produto"].pk, int(item["deposito_id"]), grade)
-            MovimentacaoEstoque.objects.create(
-                company=self.request.tenant,
-                estoque=required_map[estoque_key]["estoque"],
-                tipo=MovimentacaoEstoque.SAIDA,
-                quantidade=item["quantidade"],
-                observacao=f"Entrega #{entrega.pk} para {entrega.funcionario}",
-                created_by=self.request.user,
-                updated_by=self.request.user,
+            movimentos.append(
+                MovimentacaoEstoque(
+                    company=self.request.tenant,
+                    estoque=required_map[estoque_key]["estoque"],
+                    tipo=MovimentacaoEstoque.SAIDA,
+                    quantidade=item["quantidade"],
+                    observacao=f"Entrega #{entrega.pk} para {entrega.funcionario}",
+                    created_by=self.request.user,
+                    updated_by=self.request.user,
+                )
             )
-            FuncionarioHistorico.objects.create(
-                company=self.request.tenant,
-                funcionario=entrega.funcionario,
-                descricao=(
-                    f"Entrega: {item['produto']} (Qtd {item['quantidade']}) "
-                    f"no deposito {required_map[estoque_key]['estoque'].deposito}."
-                ),
-                created_by=self.request.user,
-                updated_by=self.request.user,
+            historicos.append(
+                FuncionarioHistorico(
+                    company=self.request.tenant,
+                    funcionario=entrega.funcionario,
+                    descricao=(
+                        f"Entrega: {item['produto']} (Qtd {item['quantidade']}) "
+                        f"no deposito {required_map[estoque_key]['estoque'].deposito}."
+                    ),
+                    created_by=self.request.user,
+                    updated_by=self.request.user,
+                )
             )
+        MovimentacaoEstoque.objects.bulk_apply(movimentos)
+        FuncionarioHistorico.objects.bulk_create(historicos)
         EntregaItem.objects.bulk_create(itens)
-        return entrega
+        atualizar_posse(entrega.funcionario_id, {item.produto_id for item in itens})
+        return itens
 
     def _validate_items(self, items, form, allow_negative=False):
-        errors = []
-        created = []
-        required_map = {}
-        confirm_items = []
-        funcionario_ref = None
-
-        for idx, item in enumerate(items, start=1):
-            funcionario_id = item.get("funcionario_id")
-            deposito_id = item.get("deposito_id")
-            produto_fornecedor_id = item.get("produto_fornecedor_id")
-            quantidade_raw = item.get("quantidade")
-            grade = (item.get("grade") or "").strip()
-            if not funcionario_id or not deposito_id or not produto_fornecedor_id or not quantidade_raw:
-                errors.append(f"Item {idx}: preencha funcionario, produto, deposito e quantidade.")
-                continue
-            if funcionario_ref is None:
-                funcionario_ref = funcionario_id
-            elif str(funcionario_ref) != str(funcionario_id):
-                errors.append("Todos os itens devem pertencer ao mesmo funcionario.")
-                continue
-            try:
-                quantidade = Decimal(str(quantidade_raw))
-            except (InvalidOperation, ValueError):
-                errors.append(f"Item {idx}: quantidade invalida.")
-                continue
-            if quantidade <= 0:
-                errors.append(f"Item {idx}: quantidade deve ser maior que zero.")
-                continue
-            produto_fornecedor = (
-                ProdutoFornecedor.objects.filter(company=self.request.tenant, pk=produto_fornecedor_id)
-                .select_related("produto")
-                .first()
-            )
-            if not produto_fornecedor:
-                errors.append(f"Item {idx}: produto/CA invalido.")
-                continue
-            grades = produto_fornecedor.produto.grade_opcoes() if produto_fornecedor.produto else []
-            if grades and not grade:
-                errors.append(f"Item {idx}: selecione a grade do produto.")
-                continue
-            if grade and grade not in grades:
-                errors.append(f"Item {idx}: grade invalida para o produto selecionado.")
-                continue
-            permitido, motivo = self._is_produto_permitido(funcionario_id, produto_fornecedor)
-            if not permitido:
-                errors.append(f"Item {idx}: {motivo}")
-                continue
-            grade_value = (grade or "").strip()
-            estoque_filters = {
-                "company": self.request.tenant,
-                "produto": produto_fornecedor.produto,
-                "deposito_id": deposito_id,
-                "grade": grade_value,
-            }
-            planta_id = self.request.session.get("planta_id")
-            if planta_id:
-                estoque_filters["deposito__planta_id"] = planta_id
-            estoque = Estoque.objects.filter(**estoque_filters).select_related("deposito").first()
-            if not estoque:
-                errors.append(f"Item {idx}: nao existe estoque para este produto no deposito informado.")
-                continue
-            key = (produto_fornecedor.produto_id, int(deposito_id), grade_value)
-            produto_ca = (produto_fornecedor.produto.ca or "").strip()
-            required_map[key] = {
-                "estoque": estoque,
-                "quantidade": required_map.get(key, {}).get("quantidade", Decimal("0")) + quantidade,
-                "produto_label": f"{produto_fornecedor.produto} | CA {produto_ca or '-'}",
-                "deposito_label": estoque.deposito.nome if estoque.deposito_id else "-",
-                "grade": grade_value,
-            }
-            created.append(
-                {
-                    "funcionario_id": funcionario_id,
-                    "deposito_id": deposito_id,
-                    "produto": produto_fornecedor.produto,
-                    "quantidade": quantidade,
-                    "ca": produto_ca,
-                    "grade": grade_value,
-                    "observacao": item.get("observacao") or "",
-                }
-            )
-
-        if errors:
-            for error in errors:
+        result = validar_itens_entrega(
+            tenant=self.request.tenant,
+            items=items,
+            planta_id=self.request.session.get("planta_id"),
+            allow_negative=allow_negative,
+        )
+        if result["errors"]:
+            for error in result["errors"]:
                 form.add_error(None, error)
             return None
 
-        for key, payload in required_map.items():
-            estoque = (
-                Estoque.objects.select_for_update()
-                .filter(pk=payload["estoque"].pk)
-                .first()
-            )
-            if not estoque:
-                form.add_error(None, "Nao existe estoque para um dos itens.")
-                return None
-            if estoque.deposito and estoque.deposito.bloquear_movimento_negativo:
-                if payload["quantidade"] > estoque.quantidade:
-                    deposito_label = payload.get("deposito_label") or "deposito informado"
-                    form.add_error(
-                        None,
-                        f"Movimento negativo bloqueado para o deposito {deposito_label}.",
-                    )
-                    return None
-            if not allow_negative and payload["quantidade"] > estoque.quantidade:
-                confirm_items.append(
-                    {
-                        "produto": payload.get("produto_label", "-"),
-                        "deposito": payload.get("deposito_label", "-"),
-                        "quantidade": str(payload["quantidade"]),
-                        "estoque": str(estoque.quantidade),
-                    }
-                )
-            payload["estoque"] = estoque
-
-        if confirm_items and not allow_negative:
-            self._confirm_items = confirm_items
+        if result["confirm_items"] and not allow_negative:
+            self._confirm_items = result["confirm_items"]
             return "confirm"
 
-        return created, required_map
+        return result["created"], result["required_map"]
 
     def post(self, request, *args, **kwargs):
         payload = request.POST.get("itens_payload")
@@ -610,24 +505,28 @@ class EntregaCreateView(BaseTenantCreateView):
                         )
                     form.add_error(None, message)
                     return self.form_invalid(form)
-            with transaction.atomic():
-                self._confirm_items = []
-                entrega = self._validate_and_create_items(items, form, allow_negative=allow_negative)
-                if entrega == "confirm":
-                    message = "Item com estoque zero, deseja continuar?"
-                    if request.headers.get("X-Requested-With") == "XMLHttpRequest":
-                        return JsonResponse(
-                            {
-                                "ok": False,
-                                "confirm": True,
-                                "message": message,
-                                "confirm_items": self._confirm_items,
-                            },
-                        )
-                    form.add_error(None, message)
-                    return self.form_invalid(form)
-                if not entrega:
-                    return self.form_invalid(form)
+            try:
+                with transaction.atomic():
+                    self._confirm_items = []
+                    entrega = self._validate_and_create_items(items, form, allow_negative=allow_negative)
+                    if entrega == "confirm":
+                        message = "Item com estoque zero, deseja continuar?"
+                        if request.headers.get("X-Requested-With") == "XMLHttpRequest":
+                            return JsonResponse(
+                                {
+                                    "ok": False,
+                                    "confirm": True,
+                                    "message": message,
+                                    "confirm_items": self._confirm_items,
+                                },
+                            )
+                        form.add_error(None, message)
+                        return self.form_invalid(form)
+                    if not entrega:
+                        return self.form_invalid(form)
+            except ValidationError as exc:
+                form.add_error(None, "; ".join(exc.messages))
+                return self.form_invalid(form)
             if request.headers.get("X-Requested-With") == "XMLHttpRequest":
                 row_html = render_to_string(
                     "entregas/_entrega_row.html",
@@ -742,40 +641,44 @@ class EntregaCreateView(BaseTenantCreateView):
                 )
             form.add_error(None, message)
             return self.form_invalid(form)
-        with transaction.atomic():
-            response = super().form_valid(form)
-            self._apply_assinatura(self.object)
-            EntregaItem.objects.create(
-                company=self.request.tenant,
-                entrega=self.object,
-                produto=produto,
-                deposito=deposito,
-                quantidade=quantidade,
-                ca=self.object.ca or "",
-                grade=grade,
-                observacao=self.object.observacao or "",
-                created_by=self.request.user,
-                updated_by=self.request.user,
-            )
-            MovimentacaoEstoque.objects.create(
-                company=self.request.tenant,
-                estoque=estoque,
-                tipo=MovimentacaoEstoque.SAIDA,
-                quantidade=quantidade,
-                observacao=f"Entrega #{self.object.pk} para {self.object.funcionario}",
-                created_by=self.request.user,
-                updated_by=self.request.user,
-            )
-            FuncionarioHistorico.objects.create(
-                company=self.request.tenant,
-                funcionario=self.object.funcionario,
-                descricao=(
-                    f"Entrega: {self.object.produto} (Qtd {self.object.quantidade}) "
-                    f"no deposito {self.object.deposito}."
-                ),
-                created_by=self.request.user,
-                updated_by=self.request.user,
-            )
+        try:
+            with transaction.atomic():
+                response = super().form_valid(form)
+                self._apply_assinatura(self.object)
+                EntregaItem.objects.create(
+                    company=self.request.tenant,
+                    entrega=self.object,
+                    produto=produto,
+                    deposito=deposito,
+                    quantidade=quantidade,
+                    ca=self.object.ca or "",
+                    grade=grade,
+                    observacao=self.object.observacao or "",
+                    created_by=self.request.user,
+                    updated_by=self.request.user,
+                )
+                MovimentacaoEstoque.objects.create(
+                    company=self.request.tenant,
+                    estoque=estoque,
+                    tipo=MovimentacaoEstoque.SAIDA,
+                    quantidade=quantidade,
+                    observacao=f"Entrega #{self.object.pk} para {self.object.funcionario}",
+                    created_by=self.request.user,
+                    updated_by=self.request.user,
+                )
+                FuncionarioHistorico.objects.create(
+                    company=self.request.tenant,
+                    funcionario=self.object.funcionario,
+                    descricao=(
+                        f"Entrega: {self.object.produto} (Qtd {self.object.quantidade}) "
+                        f"no deposito {self.object.deposito}."
+                    ),
+                    created_by=self.request.user,
+                    updated_by=self.request.user,
+                )
+        except ValidationError as exc:
+            form.add_error(None, "; ".join(exc.messages))
+            return self.form_invalid(form)
         if self.request.headers.get("X-Requested-With") == "XMLHttpRequest":
             row_html = render_to_string(
                 "entregas/_entrega_row.html",
@@ -860,60 +763,36 @@ class EntregaProdutosView(PermissionRequiredMixin, View):
         funcionario_id = request.GET.get("funcionario_id")
         if not funcionario_id:
             return JsonResponse({"ok": False, "produtos": []})
-        funcionario = Funcionario.objects.filter(
-            company=request.tenant,
-            pk=funcionario_id,
-        ).select_related("tipo").first()
-        if not funcionario:
+        liberacao = produtos_liberados(request.tenant, funcionario_id)
+        if not liberacao["funcionario"]:
             return JsonResponse({"ok": False, "produtos": []})
 
-        restrictions_exist = (
-            FuncionarioProduto.objects.filter(company=request.tenant).exists()
-            or TipoFuncionarioProduto.objects.filter(company=request.tenant).exists()
+        produtos = (
+            ProdutoFornecedor.objects.filter(company=request.tenant, produto__ativo=True)
+            .select_related("produto", "fornecedor")
+            .order_by("produto__nome")
         )
-        if not restrictions_exist:
-            produtos = (
-                ProdutoFornecedor.objects.filter(company=request.tenant, produto__ativo=True)
-                .select_related("produto", "fornecedor")
-                .order_by("produto__nome")
-            )
-            items = [
+        if liberacao["restrito"]:
+            if not liberacao["ids"]:
+                return JsonResponse({"ok": False, "produtos": []})
+            produtos = produtos.filter(pk__in=liberacao["ids"])
+        produtos = list(produtos)
+        status_ca = status_cas(item.produto.ca for item in produtos)
+        items = []
+        for item in produtos:
+            oficial = status_ca.get((item.produto.ca or "").strip())
+            data_validade = oficial["data_validade"] if oficial else None
+            items.append(
                 {
                     "id": item.pk,
                     "label": f"{item.produto} | CA {item.produto.ca or '-'} | {item.fornecedor}",
+                    "ca_status": oficial["status"] if oficial else "",
+                    "ca_situacao": oficial["situacao"] if oficial else "",
+                    "ca_validade": data_validade.strftime("%Y-%m-%d") if data_validade else "",
                 }
-                for item in produtos
-            ]
-            return JsonResponse({"ok": True, "produtos": items})
-
-        funcionario_ids = FuncionarioProduto.objects.filter(
-            company=request.tenant,
-            funcionario_id=funcionario.pk,
-            produto_fornecedor__produto__ativo=True,
-            ativo=True,
-        ).values_list("produto_fornecedor_id", flat=True)
-        tipo_ids = []
-        if funcionario.tipo_id:
-            tipo_ids = TipoFuncionarioProduto.objects.filter(
-                company=request.tenant,
-                tipo_funcionario_id=funcionario.tipo_id,
-                produto_fornecedor__produto__ativo=True,
-            ).values_list("produto_fornecedor_id", flat=True)
-        produto_ids = set(funcionario_ids) | set(tipo_ids)
-        if not produto_ids:
+            )
+        if liberacao["restrito"] and not items:
             return JsonResponse({"ok": False, "produtos": []})
-        produtos = (
-            ProdutoFornecedor.objects.filter(company=request.tenant, pk__in=produto_ids, produto__ativo=True)
-            .select_related("produto", "fornecedor")
-            .order_by("produto__nome")
-        )
-        items = [
-            {
-                "id": item.pk,
-                "label": f"{item.produto} | CA {item.produto.ca or '-'} | {item.fornecedor}",
-            }
-            for item in produtos
-        ]
         return JsonResponse({"ok": True, "produtos": items})
 
 
@@ -1228,43 +1107,18 @@ class DevolucaoFuncionarioItensView(PermissionRequiredMixin, View):
         if not funcionario:
             return JsonResponse({"ok": False, "items": []}, status=404)
 
-        # Regra: apenas o ultimo recebimento de cada item (produto+grade) fica "ativo" para devolucao.
-        # (Parcial depende da quantidade do ultimo recebimento.)
-        itens_qs = (
-            EntregaItem.objects.filter(company=request.tenant, entrega__funcionario_id=funcionario_id)
-            .exclude(entrega__status="cancelada")
-            .exclude(entrega__entregue_em__isnull=True)
-            .select_related("produto", "deposito", "entrega")
-            .order_by("-entrega__entregue_em", "-entrega_id", "-id")
-        )
-
-        latest_by_key = {}
-        latest_items = []
-        for item in itens_qs:
-            produto_id = item.produto_id
-            grade_key = ((item.grade or "").strip() or "").lower()
-            key = (produto_id, grade_key)
-            if key in latest_by_key:
-                continue
-            latest_by_key[key] = item
-            latest_items.append(item)
-
-        devolvido_map_rows = (
-            DevolucaoItem.objects.filter(
-                company=request.tenant,
-                entrega_item_id__in=[item.pk for item in latest_items],
-            )
-            .values("entrega_item_id")
-            .annotate(total=Sum("quantidade"))
+        # Regra: apenas o ultimo recebimento de cada item (produto+grade) fica "ativo" para devolucao;
+        # PosseAtual ja guarda esse item e o saldo a devolver.
+        posses = (
+            PosseAtual.objects.filter(company=request.tenant, funcionario_id=funcionario_id, saldo__gt=0)
+            .select_related("entrega_item__produto", "entrega_item__deposito", "entrega_item__entrega")
+            .order_by("-entregue_em", "-entrega_item_id")
         )
-        devolvido_map = {row["entrega_item_id"]: row.get("total") or Decimal("0") for row in devolvido_map_rows}
 
         items = []
-        for item in latest_items:
-            devolvido = devolvido_map.get(item.pk) or Decimal("0")
-            saldo = item.quantidade - devolvido
-            if saldo <= 0:
-                continue
+        for posse in posses:
+            item = posse.entrega_item
+            saldo = posse.saldo
             produto_label = str(item.produto) if item.produto_id else "-"
             deposito_label = str(item.deposito) if item.deposito_id else "-"
             grade_label = (item.grade or "").strip() or "Sem Grade"
@@ -1413,34 +1267,14 @@ class DevolucaoFuncionarioConfirmView(PermissionRequiredMixin, View):
             return False
         return default
 
-    def _latest_entrega_item_ids(self, request, funcionario_id, entrega_items):
-        keys = set()
-        for item in entrega_items:
-            produto_id = item.produto_id
-            grade_key = ((item.grade or "").strip() or "").lower()
-            keys.add((produto_id, grade_key))
-        if not keys:
-            return {}
-
-        # Busca entregas do funcionario (entregues e nao canceladas), ordenadas do mais recente.
-        qs = (
-            EntregaItem.objects.filter(company=request.tenant, entrega__funcionario_id=funcionario_id)
-            .exclude(entrega__status="cancelada")
-            .exclude(entrega__entregue_em__isnull=True)
-            .select_related("entrega")
-            .order_by("-entrega__entregue_em", "-entrega_id", "-id")
+    def _posses_por_item(self, request, funcionario_id, entrega_items):
+        # So o ultimo recebimento de cada produto/grade esta em PosseAtual.
+        posses = PosseAtual.objects.filter(
+            company=request.tenant,
+            funcionario_id=funcionario_id,
+            entrega_item_id__in=[item.pk for item in entrega_items],
         )
-        latest = {}
-        for row in qs:
-            produto_id = row.produto_id
-            grade_key = ((row.grade or "").strip() or "").lower()
-            key = (produto_id, grade_key)
-            if key not in keys or key in latest:
-                continue
-            latest[key] = row.pk
-            if len(latest) == len(keys):
-                break
-        return latest
+        return {posse.entrega_item_id: posse for posse in posses}
 
     def post(self, request):
         payload = request.POST.get("itens_payload")
@@ -1486,28 +1320,12 @@ class DevolucaoFuncionarioConfirmView(PermissionRequiredMixin, View):
                 if len(entrega_item_map) != len(set(str(x) for x in entrega_item_ids)):
                     return JsonResponse({"ok": False, "message": "Um ou mais itens sao invalidos."}, status=400)
 
-                latest_ids = self._latest_entrega_item_ids(request, funcionario_id, entrega_items)
-                for entrega_item in entrega_items:
-                    produto_id = entrega_item.produto_id
-                    grade_key = ((entrega_item.grade or "").strip() or "").lower()
-                    key = (produto_id, grade_key)
-                    if latest_ids.get(key) != entrega_item.pk:
-                        return JsonResponse(
-                            {"ok": False, "message": "Um ou mais itens nao sao o ultimo recebimento (inativo)."},
-                            status=400,
-                        )
-
-                devolvido_rows = (
-                    DevolucaoItem.objects.filter(
-                        company=request.tenant,
-                        entrega_item_id__in=[item.pk for item in entrega_items],
+                posses = self._posses_por_item(request, funcionario_id, entrega_items)
+                if any(item.pk not in posses for item in entrega_items):
+                    return JsonResponse(
+                        {"ok": False, "message": "Um ou mais itens nao sao o ultimo recebimento (inativo)."},
+                        status=400,
                     )
-                    .values("entrega_item_id")
-                    .annotate(total=Sum("quantidade"))
-                )
-                devolvido_map = {
-                    str(row["entrega_item_id"]): row.get("total") or Decimal("0") for row in devolvido_rows
-                }
 
                 condicoes_validas = {value for value, _ in DevolucaoItem.CONDICAO_CHOICES}
                 grouped = {}
@@ -1530,8 +1348,7 @@ class DevolucaoFuncionarioConfirmView(PermissionRequiredMixin, View):
                     if condicao == DevolucaoItem.CONDICAO_OUTRA and not motivo:
                         return JsonResponse({"ok": False, "message": "Informe o motivo para a condicao 'Outra'."}, status=400)
 
-                    devolvido_total = devolvido_map.get(entrega_item_id) or Decimal("0")
-                    saldo = entrega_item.quantidade - devolvido_total
+                    saldo = posses[entrega_item.pk].saldo
                     if saldo <= 0:
                         return JsonResponse({"ok": False, "message": "Um item ja foi devolvido completamente."}, status=400)
                     if quantidade > saldo:
@@ -1547,6 +1364,8 @@ class DevolucaoFuncionarioConfirmView(PermissionRequiredMixin, View):
                         }
                     )
 
+                movimentos = []
+                historicos = []
                 for entrega_id, group_items in grouped.items():
                     entrega = group_items[0]["entrega_item"].entrega
                     devolucao = Devolucao.objects.create(
@@ -1592,26 +1411,32 @@ class DevolucaoFuncionarioConfirmView(PermissionRequiredMixin, View):
                         if motivo:
                             observacao = f"{observacao} - {motivo}"
                         if volta_para_estoque and estoque:
-                            MovimentacaoEstoque.objects.create(
+                            movimentos.append(
+                                MovimentacaoEstoque(
+                                    company=request.tenant,
+                                    estoque=estoque,
+                                    tipo=MovimentacaoEstoque.ENTRADA,
+                                    quantidade=quantidade,
+                                    observacao=observacao,
+                                    created_by=request.user,
+                                    updated_by=request.user,
+                                )
+                            )
+                        historicos.append(
+                            FuncionarioHistorico(
                                 company=request.tenant,
-                                estoque=estoque,
-                                tipo=MovimentacaoEstoque.ENTRADA,
-                                quantidade=quantidade,
-                                observacao=observacao,
+                                funcionario=entrega.funcionario,
+                                descricao=(
+                                    f"Devolucao: {entrega_item.produto} (Qtd {quantidade}) "
+                                    f"no deposito {entrega_item.deposito}. Condicao: {condicao_label}. Destino: {destino_label}."
+                                    + (f" Motivo: {motivo}." if motivo else "")
+                                ),
                                 created_by=request.user,
                                 updated_by=request.user,
                             )
-                        FuncionarioHistorico.objects.create(
-                            company=request.tenant,
-                            funcionario=entrega.funcionario,
-                            descricao=(
-                                f"Devolucao: {entrega_item.produto} (Qtd {quantidade}) "
-                                f"no deposito {entrega_item.deposito}. Condicao: {condicao_label}. Destino: {destino_label}."
-                                + (f" Motivo: {motivo}." if motivo else "")
-                            ),
-                            created_by=request.user,
-                            updated_by=request.user,
                         )
+                MovimentacaoEstoque.objects.bulk_apply(movimentos)
+                FuncionarioHistorico.objects.bulk_create(historicos)
         except ValidationError as exc:
             return JsonResponse({"ok": False, "message": str(exc)}, status=400)
 
@@ -1886,88 +1711,55 @@ class EntregaAtenderView(EntregaCreateView):
                     )
                 form.add_error(None, message)
                 return self.form_invalid(form)
-        with transaction.atomic():
-            self._confirm_items = []
-            result = self._validate_items(items, form, allow_negative=allow_negative)
-            if result == "confirm":
-                message = "Item com estoque zero, deseja continuar?"
-                if request.headers.get("X-Requested-With") == "XMLHttpRequest":
-                    return JsonResponse(
-                        {
-                            "ok": False,
-                            "confirm": True,
-                            "message": message,
-                            "confirm_items": self._confirm_items,
-                        },
-                    )
-                form.add_error(None, message)
-                return self.form_invalid(form)
-            if not result:
-                return self.form_invalid(form)
-            created, required_map = result
-            EntregaItem.objects.filter(entrega=entrega).delete()
-            itens = []
-            for item in created:
-                grade = (item.get("grade") or "").strip()
-                itens.append(
-                    EntregaItem(
-                        company=request.tenant,
-                        entrega=entrega,
-                        produto=item["produto"],
-                        deposito_id=item["deposito_id"],
-                        quantidade=item["quantidade"],
-                        ca=item["ca"],
-                        grade=grade,
-                        observacao=item["observacao"],
-                        created_by=request.user,
-                        updated_by=request.user,
-                    )
-                )
-                estoque_key = (item["produto"].pk, int(item["deposito_id"]), grade)
-                MovimentacaoEstoque.objects.create(
-                    company=request.tenant,
-                    estoque=required_map[estoque_key]["estoque"],
-                    tipo=MovimentacaoEstoque.SAIDA,
-                    quantidade=item["quantidade"],
-                    observacao=f"Entrega #{entrega.pk} para {entrega.funcionario}",
-                    created_by=request.user,
-                    updated_by=request.user,
-                )
-                FuncionarioHistorico.objects.create(
-                    company=request.tenant,
-                    funcionario=entrega.funcionario,
-                    descricao=(
-                        f"Entrega: {item['produto']} (Qtd {item['quantidade']}) "
-                        f"no deposito {required_map[estoque_key]['estoque'].deposito}."
-                    ),
-                    created_by=request.user,
-                    updated_by=request.user,
+        try:
+            with transaction.atomic():
+                self._confirm_items = []
+                result = self._validate_items(items, form, allow_negative=allow_negative)
+                if result == "confirm":
+                    message = "Item com estoque zero, deseja continuar?"
+                    if request.headers.get("X-Requested-With") == "XMLHttpRequest":
+                        return JsonResponse(
+                            {
+                                "ok": False,
+                                "confirm": True,
+                                "message": message,
+                                "confirm_items": self._confirm_items,
+                            },
+                        )
+                    form.add_error(None, message)
+                    return self.form_invalid(form)
+                if not result:
+                    return self.form_invalid(form)
+                created, required_map = result
+                EntregaItem.objects.filter(entrega=entrega).delete()
+                self._create_itens_and_movimentos(entrega, created, required_map)
+                primeiro = created[0]
+                entrega.produto = primeiro["produto"]
+                entrega.deposito_id = primeiro["deposito_id"]
+                entrega.quantidade = primeiro["quantidade"]
+                entrega.ca = primeiro["ca"]
+                entrega.observacao = primeiro["observacao"]
+                entrega.status = "entregue"
+                entrega.entregue_em = timezone.now()
+                entrega.updated_by = request.user
+                entrega.validacao_recebimento = self._get_validacao_funcionario(entrega.funcionario_id)
+                entrega.save(
+                    update_fields=[
+                        "produto",
+                        "deposito",
+                        "quantidade",
+                        "ca",
+                        "observacao",
+                        "status",
+                        "entregue_em",
+                        "validacao_recebimento",
+                        "updated_by",
+                    ]
                 )
-            EntregaItem.objects.bulk_create(itens)
-            primeiro = created[0]
-            entrega.produto = primeiro["produto"]
-            entrega.deposito_id = primeiro["deposito_id"]
-            entrega.quantidade = primeiro["quantidade"]
-            entrega.ca = primeiro["ca"]
-            entrega.observacao = primeiro["observacao"]
-            entrega.status = "entregue"
-            entrega.entregue_em = timezone.now()
-            entrega.updated_by = request.user
-            entrega.validacao_recebimento = self._get_validacao_funcionario(entrega.funcionario_id)
-            entrega.save(
-                update_fields=[
-                    "produto",
-                    "deposito",
-                    "quantidade",
-                    "ca",
-                    "observacao",
-                    "status",
-                    "entregue_em",
-                    "validacao_recebimento",
-                    "updated_by",
-                ]
-            )
-            self._apply_assinatura(entrega)
+                self._apply_assinatura(entrega)
+        except ValidationError as exc:
+            form.add_error(None, "; ".join(exc.messages))
+            return self.form_invalid(form)
         if request.headers.get("X-Requested-With") == "XMLHttpRequest":
             row_html = render_to_string(
                 "entregas/_entrega_row.html",
@@ -2027,6 +1819,8 @@ class EntregaCancelView(PermissionRequiredMixin, View):
                         observacao=entrega.observacao or "",
                     )
                 ]
+            movimentos = []
+            historicos = []
             for item in itens_qs:
                 estoque, estoque_error = _get_or_create_estoque_for_update(
                     request=request,
@@ -2038,25 +1832,31 @@ class EntregaCancelView(PermissionRequiredMixin, View):
                     if request.headers.get("X-Requested-With") == "XMLHttpRequest":
                         return JsonResponse({"ok": False, "message": estoque_error}, status=400)
                     return HttpResponseRedirect(reverse("entregas:list"))
-                MovimentacaoEstoque.objects.create(
-                    company=request.tenant,
-                    estoque=estoque,
-                    tipo=MovimentacaoEstoque.ENTRADA,
-                    quantidade=item.quantidade,
-                    observacao=f"Cancelamento da entrega #{entrega.pk}",
-                    created_by=request.user,
-                    updated_by=request.user,
+                movimentos.append(
+                    MovimentacaoEstoque(
+                        company=request.tenant,
+                        estoque=estoque,
+                        tipo=MovimentacaoEstoque.ENTRADA,
+                        quantidade=item.quantidade,
+                        observacao=f"Cancelamento da entrega #{entrega.pk}",
+                        created_by=request.user,
+                        updated_by=request.user,
+                    )
                 )
-                FuncionarioHistorico.objects.create(
-                    company=request.tenant,
-                    funcionario=entrega.funcionario,
-                    descricao=(
-                        f"Entrega cancelada: {item.produto} (Qtd {item.quantidade}) "
-                        f"no deposito {item.deposito}."
-                    ),
-                    created_by=request.user,
-                    updated_by=request.user,
+                historicos.append(
+                    FuncionarioHistorico(
+                        company=request.tenant,
+                        funcionario=entrega.funcionario,
+                        descricao=(
+                            f"Entrega cancelada: {item.produto} (Qtd {item.quantidade}) "
+                            f"no deposito {item.deposito}."
+                        ),
+                        created_by=request.user,
+                        updated_by=request.user,
+                    )
                 )
+            MovimentacaoEstoque.objects.bulk_apply(movimentos)
+            FuncionarioHistorico.objects.bulk_create(historicos)
             entrega.status = "cancelada"
             entrega.motivo_cancelamento = motivo
             entrega.updated_by = request.user
@@ -2076,3 +1876,38 @@ class EntregaCancelView(PermissionRequiredMixin, View):
                 }
             )
         return HttpResponseRedirect(reverse("entregas:list"))
+
+
+class EntregaTrocasView(PermissionRequiredMixin, View):
+    permission_required = "entregas.view_entrega"
+    janelas = (7, 15, 30, 60, 90)
+
+    def get(self, request):
+        dias = request.GET.get("dias") or ""
+        dias = int(dias) if dias.isdigit() and int(dias) in self.janelas else 30
+        setor_id = request.GET.get("setor") or ""
+        setor_id = int(setor_id) if setor_id.isdigit() else None
+        incluir_vencidas = (request.GET.get("vencidas") or "1") not in ("0", "false", "off")
+        planta_id = request.session.get("planta_id")
+
+        agora = timezone.now()
+        filtros = {
+            "ate": agora + timedelta(days=dias),
+            "desde": None if incluir_vencidas else agora,
+            "planta_id": planta_id,
+            "setor_id": setor_id,
+        }
+        trocas = trocas_previstas(request.tenant, **filtros)
+        page_obj = paginar_por_cursor(request, trocas, 50, ("data_troca_prevista",), tiebreaker="pk")
+        context = {
+            "page_obj": page_obj,
+            "trocas": page_obj.object_list,
+            "projecao": projecao_compras(request.tenant, **filtros),
+            "agora": agora,
+            "dias": dias,
+            "janelas": self.janelas,
+            "setor_id": setor_id,
+            "setores": Setor.objects.filter(company=request.tenant, ativo=True).order_by("nome"),
+            "incluir_vencidas": incluir_vencidas,
+        }
+        return render(request, "entregas/trocas.html", context)
@@ -0,0 +1,150 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django_tenants.utils import schema_context
+
+from apps.depositos.models import Deposito
+from apps.estoque.models import (
+    MODO_LOCK,
+    MODOS_ATUALIZACAO,
+    ActionLog,
+    Estoque,
+    MovimentacaoEstoque,
+)
+from apps.funcionarios.models import Planta
+from apps.produtos.models import Produto
+from apps.tenants.models import Company
+
+
+class Command(BaseCommand):
+    help = "Compara vazao e consistencia dos modos de atualizacao de estoque com N threads concorrentes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--schema", required=True, help="Schema do tenant usado na medicao.")
+        parser.add_argument("--threads", type=int, default=8, help="Quantidade de threads concorrentes.")
+        parser.add_argument("--movimentos", type=int, default=25, help="Saidas por thread.")
+        parser.add_argument(
+            "--trabalho-ms",
+            type=float,
+            default=2.0,
+            help="Tempo simulado entre a leitura do saldo e a gravacao (validacoes da view).",
+        )
+        parser.add_argument(
+            "--modo",
+            default="todos",
+            choices=[*MODOS_ATUALIZACAO, "todos"],
+            help="Modo de atualizacao a medir.",
+        )
+
+    def handle(self, *args, **options):
+        tenant = Company.objects.filter(schema_name=options["schema"]).first()
+        if not tenant:
+            raise CommandError(f"Tenant '{options['schema']}' nao encontrado.")
+        modos = MODOS_ATUALIZACAO if options["modo"] == "todos" else (options["modo"],)
+        threads = max(options["threads"], 1)
+        movimentos = max(options["movimentos"], 1)
+        trabalho = max(options["trabalho_ms"], 0) / 1000
+
+        with schema_context(tenant.schema_name):
+            planta = Planta.objects.filter(company=tenant).order_by("pk").first()
+            produto = Produto.objects.filter(company=tenant).order_by("pk").first()
+            if not planta or not produto:
+                raise CommandError("O tenant precisa ter ao menos uma planta e um produto.")
+            deposito = Deposito.objects.create(
+                company=tenant,
+                nome="Benchmark concorrencia",
+                planta=planta,
+                bloquear_movimento_negativo=True,
+                ativo=False,
+            )
+            try:
+                falhou = False
+                for modo in modos:
+                    ok = self._medir(tenant, produto, deposito, modo, threads, movimentos, trabalho)
+                    falhou = falhou or not ok
+            finally:
+                estoque_ids = list(Estoque.objects.filter(deposito=deposito).values_list("pk", flat=True))
+                mov_ids = list(
+                    MovimentacaoEstoque.objects.filter(estoque_id__in=estoque_ids).values_list("pk", flat=True)
+                )
+                ActionLog.objects.filter(reference__in=[f"MovimentacaoEstoque:{pk}" for pk in mov_ids]).delete()
+                MovimentacaoEstoque.objects.filter(pk__in=mov_ids).delete()
+                Estoque.objects.filter(pk__in=estoque_ids).delete()
+                deposito.delete()
+
+        if falhou:
+            self.stdout.write(self.style.WARNING("Saldo final divergente em algum modo."))
+        else:
+            self.stdout.write(self.style.SUCCESS("Saldos finais consistentes em todos os modos."))
+
+    def _medir(self, tenant, produto, deposito, modo, threads, movimentos, trabalho):
+        inicial = Decimal(threads * movimentos)
+        estoque = Estoque.objects.create(
+            company=tenant,
+            produto=produto,
+            grade=f"bench-{modo}",
+            deposito=deposito,
+            quantidade=inicial,
+        )
+        resultados = {"ok": 0, "erros": 0}
+        trava = threading.Lock()
+
+        def worker():
+            with schema_context(tenant.schema_name):
+                try:
+                    for _ in range(movimentos):
+                        try:
+                            self._saida(tenant, estoque.pk, modo, trabalho)
+                        except ValidationError:
+                            with trava:
+                                resultados["erros"] += 1
+                        else:
+                            with trava:
+                                resultados["ok"] += 1
+                finally:
+                    connection.close()
+
+        pool = [threading.Thread(target=worker) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        estoque.refresh_from_db()
+        esperado = inicial - resultados["ok"]
+        consistente = estoque.quantidade == esperado and estoque.quantidade >= 0
+        vazao = resultados["ok"] / elapsed if elapsed else 0
+        linha = (
+            f"modo={modo:<9} threads={threads} movimentos={resultados['ok']:>5} erros={resultados['erros']:>4} "
+            f"tempo={elapsed:.2f}s vazao={vazao:.1f}/s saldo={estoque.quantidade} esperado={esperado}"
+        )
+        self.stdout.write(linha if consistente else self.style.ERROR(linha))
+        return consistente
+
+    def _saida(self, tenant, estoque_id, modo, trabalho):
+        with transaction.atomic():
+            if modo == MODO_LOCK:
+                estoque = Estoque.objects.select_for_update().get(pk=estoque_id)
+            else:
+                estoque = Estoque.objects.get(pk=estoque_id)
+            # Simula o tempo gasto pela view entre ler o saldo e gravar a movimentacao.
+            if trabalho:
+                time.sleep(trabalho)
+            MovimentacaoEstoque.objects.bulk_apply(
+                [
+                    MovimentacaoEstoque(
+                        company=tenant,
+                        estoque=estoque,
+                        tipo=MovimentacaoEstoque.SAIDA,
+                        quantidade=Decimal("1"),
+                        observacao="Benchmark concorrencia",
+                    )
+                ],
+                modo=modo,
+            )
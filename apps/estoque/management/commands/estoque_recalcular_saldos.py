@@ -0,0 +1,128 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django_tenants.utils import schema_context
+
+from apps.estoque.models import Estoque, MovimentacaoEstoque
+from apps.tenants.models import Company
+
+
+class Command(BaseCommand):
+    help = "Preenche saldo_anterior/saldo_posterior das movimentacoes de estoque a partir do saldo atual."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--schema", help="Processa apenas o tenant informado.")
+        parser.add_argument(
+            "--todos",
+            action="store_true",
+            help="Recalcula todas as movimentacoes, nao apenas as que estao sem saldo.",
+        )
+        parser.add_argument("--lote", type=int, default=200, help="Estoques processados por transacao.")
+        parser.add_argument("--dry-run", action="store_true", help="Simula sem gravar no banco.")
+
+    def handle(self, *args, **options):
+        tenants = Company.objects.exclude(schema_name="public")
+        if options.get("schema"):
+            tenants = tenants.filter(schema_name=options["schema"])
+            if not tenants.exists():
+                raise CommandError(f"Tenant '{options['schema']}' nao encontrado.")
+
+        for tenant in tenants:
+            with schema_context(tenant.schema_name):
+                self._process_tenant(tenant, options)
+
+        self.stdout.write(self.style.SUCCESS("Recalculo de saldos concluido."))
+
+    def _process_tenant(self, tenant, options):
+        if "estoque_movimentacaoestoque" not in set(connection.introspection.table_names()):
+            self.stdout.write(
+                self.style.WARNING(f"[{tenant.schema_name}] tabelas de estoque ausentes, pulei.")
+            )
+            return
+        movimentos = MovimentacaoEstoque.objects.filter(company=tenant)
+        if not options.get("todos"):
+            movimentos = movimentos.filter(saldo_posterior__isnull=True)
+        estoque_ids = sorted(set(movimentos.values_list("estoque_id", flat=True).distinct()))
+        lote = max(options.get("lote") or 200, 1)
+        total = 0
+        for inicio in range(0, len(estoque_ids), lote):
+            with transaction.atomic():
+                total += self._process_estoques(estoque_ids[inicio : inicio + lote], options.get("dry_run"))
+        self.stdout.write(
+            f"[{tenant.schema_name}] estoques={len(estoque_ids)} movimentacoes={total}"
+        )
+
+    def _process_estoques(self, estoque_ids, dry_run):
+        # Trava os estoques do lote para que o saldo atual nao mude durante o calculo.
+        atuais = dict(
+            Estoque.objects.select_for_update()
+            .filter(pk__in=estoque_ids)
+            .order_by("pk")
+            .values_list("pk", "quantidade")
+        )
+        estoque = Estoque._meta.db_table
+        movimentacao = MovimentacaoEstoque._meta.db_table
+        # Soma acumulada da mais recente para a mais antiga: saldo_posterior de cada
+        # movimentacao = saldo atual - soma das variacoes posteriores a ela. Entram
+        # tambem as transferencias recebidas, gravadas na movimentacao de origem
+        # (mesmo produto/grade, deposito_destino = deposito do estoque), como em
+        # _registrar_saldos e reconstruir_fatos_estoque.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH variacoes AS (
+                    SELECT m.id AS movimentacao_id, m.estoque_id, m.criado_em, m.id AS ordem,
+                           CASE WHEN m.tipo = %s THEN m.quantidade ELSE -m.quantidade END AS delta
+                    FROM {movimentacao} AS m
+                    WHERE m.estoque_id = ANY(%s)
+                    UNION ALL
+                    SELECT NULL, destino.id, m.criado_em, m.id, m.quantidade
+                    FROM {movimentacao} AS m
+                    JOIN {estoque} AS origem ON origem.id = m.estoque_id
+                    JOIN {estoque} AS destino
+                      ON destino.produto_id = origem.produto_id
+                     AND destino.grade = origem.grade
+                     AND destino.deposito_id = m.deposito_destino_id
+                    WHERE m.tipo = %s AND destino.id = ANY(%s)
+                ),
+                acumulados AS (
+                    SELECT movimentacao_id, estoque_id, delta,
+                           sum(delta) OVER (
+                               PARTITION BY estoque_id
+                               ORDER BY criado_em DESC, ordem DESC, movimentacao_id IS NULL
+                               ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+                           ) AS acumulado
+                    FROM variacoes
+                )
+                SELECT movimentacao_id, estoque_id, delta, acumulado
+                FROM acumulados
+                WHERE movimentacao_id IS NOT NULL
+                """,
+                [
+                    MovimentacaoEstoque.ENTRADA,
+                    list(estoque_ids),
+                    MovimentacaoEstoque.TRANSFERENCIA,
+                    list(estoque_ids),
+                ],
+            )
+            linhas = cursor.fetchall()
+        pendentes = []
+        total = 0
+        for pk, estoque_id, variacao, acumulado in linhas:
+            saldo_posterior = atuais[estoque_id] - acumulado + variacao
+            pendentes.append(
+                MovimentacaoEstoque(
+                    pk=pk,
+                    saldo_anterior=saldo_posterior - variacao,
+                    saldo_posterior=saldo_posterior,
+                )
+            )
+            if len(pendentes) >= 2000:
+                total += self._gravar(pendentes, dry_run)
+                pendentes = []
+        total += self._gravar(pendentes, dry_run)
+        return total
+
+    def _gravar(self, movimentos, dry_run):
+        if movimentos and not dry_run:
+            MovimentacaoEstoque.objects.bulk_update(movimentos, ["saldo_anterior", "saldo_posterior"])
+        return len(movimentos)
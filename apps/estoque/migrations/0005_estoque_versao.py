@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-16 20:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0004_alter_estoque_unique_together_estoque_grade_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estoque',
+            name='versao',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
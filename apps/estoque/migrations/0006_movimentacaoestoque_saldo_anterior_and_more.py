@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-16 20:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0005_estoque_versao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movimentacaoestoque',
+            name='saldo_anterior',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='movimentacaoestoque',
+            name='saldo_posterior',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=12, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='movimentacaoestoque',
+            index=models.Index(fields=['company', '-criado_em', '-id'], name='estoque_mov_company_5c260e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimentacaoestoque',
+            index=models.Index(fields=['estoque', '-criado_em', '-id'], name='estoque_mov_estoque_2749a6_idx'),
+        ),
+    ]
@@ -1,8 +1,91 @@
+from decimal import Decimal
+
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import models, transaction
+from django.db.models import Case, F, Q, Value, When
 
 from apps.core.models import TenantModel
+from .signals import saldos_alterados
+
+
+MODO_LOCK = "lock"
+MODO_ATOMICO = "atomico"
+MODO_OTIMISTA = "otimista"
+MODOS_ATUALIZACAO = (MODO_LOCK, MODO_ATOMICO, MODO_OTIMISTA)
+MOVIMENTO_NEGATIVO_MSG = "Movimento negativo bloqueado para o deposito informado."
+
+
+def modo_atualizacao():
+    """
+    Modo de atualizacao de Estoque.quantidade (settings.ESTOQUE_MODO_ATUALIZACAO):
+    - lock: SELECT ... FOR UPDATE antes de validar (padrao, comportamento original);
+    - atomico: sem lock previo, UPDATE com F() e WHERE quantidade >= minimo;
+    - otimista: le quantidade/versao sem lock e grava com WHERE versao = lida, com retentativas.
+    """
+    modo = getattr(settings, "ESTOQUE_MODO_ATUALIZACAO", MODO_LOCK)
+    return modo if modo in MODOS_ATUALIZACAO else MODO_LOCK
+
+
+class EstoqueManager(models.Manager):
+    def aplicar_deltas(self, deltas, minimos=None):
+        """
+        Soma deltas {estoque_id: delta} com UPDATE ... SET quantidade = quantidade + CASE.
+        Para os estoques em minimos {estoque_id: minimo} o UPDATE so altera a linha se
+        quantidade >= minimo; se alguma nao for alterada levanta ValidationError.
+        """
+        minimos = minimos or {}
+        deltas = {pk: delta for pk, delta in deltas.items() if delta or pk in minimos}
+        livres = [pk for pk in deltas if pk not in minimos]
+        restritos = [pk for pk in deltas if pk in minimos]
+        decimal_field = models.DecimalField(max_digits=12, decimal_places=2)
+
+        def _case(values, pks):
+            return Case(
+                *[When(pk=pk, then=Value(values[pk])) for pk in pks],
+                default=Value(Decimal("0")),
+                output_field=decimal_field,
+            )
+
+        if restritos:
+            updated = (
+                self.filter(pk__in=restritos)
+                .filter(quantidade__gte=_case(minimos, restritos))
+                .update(quantidade=F("quantidade") + _case(deltas, restritos), versao=F("versao") + 1)
+            )
+            if updated != len(restritos):
+                raise ValidationError({"quantidade": MOVIMENTO_NEGATIVO_MSG})
+        if livres:
+            self.filter(pk__in=livres).update(
+                quantidade=F("quantidade") + _case(deltas, livres),
+                versao=F("versao") + 1,
+            )
+
+    def aplicar_deltas_otimista(self, deltas, minimos=None, tentativas=5):
+        """
+        Le quantidade/versao sem lock, valida os minimos e grava cada linha com
+        WHERE versao = versao lida. Em conflito (outra transacao gravou antes),
+        rele apenas as linhas em conflito e tenta de novo.
+        """
+        minimos = minimos or {}
+        pendentes = {pk: delta for pk, delta in deltas.items() if delta or pk in minimos}
+        for _ in range(tentativas):
+            if not pendentes:
+                return
+            atuais = self.filter(pk__in=pendentes).values_list("pk", "quantidade", "versao")
+            conflitos = {}
+            for pk, quantidade, versao in atuais:
+                if pk in minimos and quantidade < minimos[pk]:
+                    raise ValidationError({"quantidade": MOVIMENTO_NEGATIVO_MSG})
+                updated = self.filter(pk=pk, versao=versao).update(
+                    quantidade=quantidade + pendentes[pk],
+                    versao=versao + 1,
+                )
+                if not updated:
+                    conflitos[pk] = pendentes[pk]
+            pendentes = conflitos
+        if pendentes:
+            raise ValidationError("Estoque alterado por outra operacao. Tente novamente.")
 
 
 class Estoque(TenantModel):
@@ -10,8 +93,11 @@ class Estoque(TenantModel):
     grade = models.CharField(max_length=50, blank=True)
     deposito = models.ForeignKey("depositos.Deposito", on_delete=models.CASCADE)
     quantidade = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    versao = models.PositiveIntegerField(default=0, editable=False)
     atualizado_em = models.DateTimeField(auto_now=True)
 
+    objects = EstoqueManager()
+
     class Meta:
         unique_together = ("produto", "grade", "deposito")
 
@@ -19,6 +105,149 @@ class Estoque(TenantModel):
         return f"{self.produto} - {self.deposito}"
 
 
+class MovimentacaoEstoqueManager(models.Manager):
+    # FKs sao validadas pelo banco; full_clean() faria uma consulta por FK e por item.
+    CLEAN_EXCLUDE = ("company", "estoque", "deposito_destino", "created_by", "updated_by")
+
+    def bulk_apply(self, movements, modo=None):
+        """
+        Grava varias movimentacoes novas de uma vez.
+
+        Aplica a regra de bloquear_movimento_negativo na ordem das movimentacoes
+        (igual ao save() item a item), atualiza os saldos com um unico
+        UPDATE ... CASE e insere movimentacoes e ActionLogs com bulk_create.
+        No modo lock os Estoques sao travados antes, em ordem de pk; nos modos
+        atomico/otimista a regra e garantida pelo proprio UPDATE (ver modo_atualizacao).
+        """
+        modo = modo or modo_atualizacao()
+        movements = list(movements)
+        if not movements:
+            return []
+        for mov in movements:
+            if mov.pk is not None:
+                raise ValueError("bulk_apply aceita apenas movimentacoes novas.")
+            mov.clean_fields(exclude=self.CLEAN_EXCLUDE)
+            mov.clean()
+
+        with transaction.atomic(using=self.db):
+            estoques, destinos = self._load_estoques(movements, lock=modo == MODO_LOCK)
+            deltas = dict.fromkeys(estoques, Decimal("0"))
+            minimos = {}
+            for mov in movements:
+                origem = estoques[mov.estoque_id]
+                if mov.tipo == mov.ENTRADA:
+                    deltas[origem.pk] += mov.quantidade
+                    continue
+                deltas[origem.pk] -= mov.quantidade
+                if origem.deposito.bloquear_movimento_negativo:
+                    # Saldo inicial minimo para que nenhum passo fique negativo.
+                    minimos[origem.pk] = max(minimos.get(origem.pk, Decimal("0")), -deltas[origem.pk])
+                if mov.tipo == mov.TRANSFERENCIA:
+                    destino = destinos[(origem.produto_id, origem.grade, mov.deposito_destino_id)]
+                    deltas[destino.pk] += mov.quantidade
+
+            estoque_manager = Estoque.objects.db_manager(self.db)
+            if modo == MODO_LOCK:
+                for pk, minimo in minimos.items():
+                    if estoques[pk].quantidade < minimo:
+                        raise ValidationError({"quantidade": MOVIMENTO_NEGATIVO_MSG})
+                estoque_manager.aplicar_deltas(deltas)
+                for pk, delta in deltas.items():
+                    estoques[pk].quantidade += delta
+                finais = {pk: estoques[pk].quantidade for pk in deltas}
+            else:
+                if modo == MODO_OTIMISTA:
+                    estoque_manager.aplicar_deltas_otimista(deltas, minimos)
+                else:
+                    estoque_manager.aplicar_deltas(deltas, minimos)
+                # As linhas ja estao travadas pelo UPDATE desta transacao: o saldo lido e o final.
+                finais = dict(estoque_manager.filter(pk__in=list(deltas)).values_list("pk", "quantidade"))
+            self._registrar_saldos(movements, estoques, destinos, deltas, finais)
+
+            self.bulk_create(movements)
+            ActionLog.objects.using(self.db).bulk_create(
+                [ActionLog.for_instance(mov.company_id, mov, mov.tipo, mov.log_payload()) for mov in movements]
+            )
+            saldos_alterados.send(
+                sender=Estoque,
+                company_ids={estoque.company_id for estoque in estoques.values()},
+                saldos=finais,
+            )
+        return movements
+
+    def _registrar_saldos(self, movements, estoques, destinos, deltas, finais):
+        """
+        Preenche saldo_anterior/saldo_posterior de cada movimentacao, na ordem do lote,
+        partindo do saldo final de cada estoque menos a variacao total do lote.
+        """
+        saldos = {pk: finais[pk] - delta for pk, delta in deltas.items()}
+        for mov in movements:
+            origem = estoques[mov.estoque_id]
+            mov.saldo_anterior = saldos[origem.pk]
+            saldos[origem.pk] += mov.delta()
+            mov.saldo_posterior = saldos[origem.pk]
+            if mov.tipo == mov.TRANSFERENCIA:
+                destino = destinos[(origem.produto_id, origem.grade, mov.deposito_destino_id)]
+                saldos[destino.pk] += mov.quantidade
+
+    def _load_estoques(self, movements, lock=True):
+        origem_ids = {mov.estoque_id for mov in movements}
+        origens = {
+            row["pk"]: row
+            for row in Estoque.objects.using(self.db)
+            .filter(pk__in=origem_ids)
+            .values("pk", "company_id", "produto_id", "grade")
+        }
+        missing = origem_ids - set(origens)
+        if missing:
+            raise Estoque.DoesNotExist(f"Estoque inexistente: {sorted(missing)}")
+
+        destino_keys = {}
+        for mov in movements:
+            if mov.tipo != mov.TRANSFERENCIA:
+                continue
+            origem = origens[mov.estoque_id]
+            key = (origem["produto_id"], origem["grade"], mov.deposito_destino_id)
+            destino_keys.setdefault(key, origem["company_id"])
+        destino_filter = Q(pk__in=[])
+        if destino_keys:
+            Estoque.objects.using(self.db).bulk_create(
+                [
+                    Estoque(
+                        company_id=company_id,
+                        produto_id=produto_id,
+                        grade=grade,
+                        deposito_id=deposito_id,
+                        quantidade=Decimal("0"),
+                    )
+                    for (produto_id, grade, deposito_id), company_id in destino_keys.items()
+                ],
+                ignore_conflicts=True,
+            )
+            for (produto_id, grade, deposito_id), company_id in destino_keys.items():
+                destino_filter |= Q(
+                    company_id=company_id,
+                    produto_id=produto_id,
+                    grade=grade,
+                    deposito_id=deposito_id,
+                )
+
+        queryset = Estoque.objects.using(self.db).filter(Q(pk__in=origem_ids) | destino_filter)
+        if lock:
+            # Um unico SELECT ... FOR UPDATE em ordem de pk evita deadlock entre lotes concorrentes.
+            queryset = queryset.select_for_update(of=("self",))
+        estoques = {
+            estoque.pk: estoque
+            for estoque in queryset.select_related("deposito").order_by("pk")
+        }
+        destinos = {
+            (estoque.produto_id, estoque.grade, estoque.deposito_id): estoque
+            for estoque in estoques.values()
+            if (estoque.produto_id, estoque.grade, estoque.deposito_id) in destino_keys
+        }
+        return estoques, destinos
+
+
 class MovimentacaoEstoque(TenantModel):
     ENTRADA = "entrada"
     SAIDA = "saida"
@@ -36,62 +265,42 @@ class MovimentacaoEstoque(TenantModel):
         "depositos.Deposito", on_delete=models.SET_NULL, null=True, blank=True
     )
     observacao = models.TextField(blank=True)
+    saldo_anterior = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, editable=False)
+    saldo_posterior = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, editable=False)
     criado_em = models.DateTimeField(auto_now_add=True)
 
+    objects = MovimentacaoEstoqueManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["company", "-criado_em", "-id"]),
+            models.Index(fields=["estoque", "-criado_em", "-id"]),
+        ]
+
     def __str__(self):
         return f"{self.get_tipo_display()} - {self.estoque}"
 
+    def delta(self):
+        """Variacao causada no estoque de origem."""
+        return self.quantidade if self.tipo == self.ENTRADA else -self.quantidade
+
     def clean(self):
         super().clean()
-        if self.tipo == self.TRANSFERENCIA and not self.deposito_destino:
+        if self.tipo == self.TRANSFERENCIA and not self.deposito_destino_id:
             raise ValidationError({"deposito_destino": "Informe o deposito de destino."})
 
+    def log_payload(self):
+        payload = {"quantidade": str(self.quantidade)}
+        if self.tipo == self.TRANSFERENCIA:
+            payload["deposito_destino_id"] = self.deposito_destino_id
+        return payload
+
     def save(self, *args, **kwargs):
-        is_new = self.pk is None
         self.full_clean()
-        with transaction.atomic():
+        if self.pk is not None:
             super().save(*args, **kwargs)
-            if not is_new:
-                return
-            origem = Estoque.objects.select_for_update().get(pk=self.estoque_id)
-            if self.tipo == self.ENTRADA:
-                origem.quantidade += self.quantidade
-                origem.save(update_fields=["quantidade"])
-                ActionLog.log(self.company, self, "entrada", {"quantidade": str(self.quantidade)})
-                return
-            if self.tipo == self.SAIDA:
-                if origem.deposito.bloquear_movimento_negativo:
-                    if origem.quantidade - self.quantidade < 0:
-                        raise ValidationError(
-                            {"quantidade": "Movimento negativo bloqueado para o deposito informado."}
-                        )
-                origem.quantidade -= self.quantidade
-                origem.save(update_fields=["quantidade"])
-                ActionLog.log(self.company, self, "saida", {"quantidade": str(self.quantidade)})
-                return
-            if self.tipo == self.TRANSFERENCIA:
-                destino, _ = Estoque.objects.select_for_update().get_or_create(
-                    company=self.company,
-                    produto=origem.produto,
-                    grade=origem.grade,
-                    deposito=self.deposito_destino,
-                    defaults={"quantidade": 0},
-                )
-                if origem.deposito.bloquear_movimento_negativo:
-                    if origem.quantidade - self.quantidade < 0:
-                        raise ValidationError(
-                            {"quantidade": "Movimento negativo bloqueado para o deposito informado."}
-                        )
-                origem.quantidade -= self.quantidade
-                destino.quantidade += self.quantidade
-                origem.save(update_fields=["quantidade"])
-                destino.save(update_fields=["quantidade"])
-                ActionLog.log(
-                    self.company,
-                    self,
-                    "transferencia",
-                    {"quantidade": str(self.quantidade), "deposito_destino_id": self.deposito_destino_id},
-                )
+            return
+        type(self).objects.bulk_apply([self])
 
 
 class ActionLog(TenantModel):
@@ -104,6 +313,12 @@ class ActionLog(TenantModel):
     created_at = models.DateTimeField(auto_now_add=True)
 
     @classmethod
-    def log(cls, company, instance, action, payload=None):
+    def for_instance(cls, company_id, instance, action, payload=None):
         reference = f"{instance.__class__.__name__}:{instance.pk}"
-        cls.objects.create(company=company, action=action, reference=reference, payload=payload or {})
+        return cls(company_id=company_id, action=action, reference=reference, payload=payload or {})
+
+    @classmethod
+    def log(cls, company, instance, action, payload=None):
+        log = cls.for_instance(company.pk, instance, action, payload)
+        log.save()
+        return log
@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+# Enviado por MovimentacaoEstoque.objects.bulk_apply, ainda dentro da transacao,
+# depois de alterar saldos com UPDATE/bulk_create (que nao disparam post_save).
+# Argumentos: company_ids e saldos ({estoque_id: quantidade final}).
+saldos_alterados = Signal()
@@ -1,6 +1,5 @@
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.core.exceptions import PermissionDenied
-from django.core.paginator import EmptyPage, InvalidPage, Paginator
 from django.http import JsonResponse
 from django.template.loader import render_to_string
 from django.urls import reverse_lazy
@@ -168,26 +167,9 @@ class ProdutoExtratoView(EstoqueModuleRequiredMixin, BaseTenantListView):
     template_name = "estoque/extrato.html"
     title = "Extrato de produto"
     paginate_by = 10
-    page_kwarg = "page"
-
-    def get(self, request, *args, **kwargs):
-        page = request.GET.get(self.page_kwarg)
-        if page:
-            try:
-                page_number = int(page)
-            except (TypeError, ValueError):
-                page_number = 1
-            if page_number < 1:
-                query = request.GET.copy()
-                query[self.page_kwarg] = "1"
-                request.GET = query
-        try:
-            return super().get(request, *args, **kwargs)
-        except EmptyPage:
-            query = request.GET.copy()
-            query[self.page_kwarg] = "1"
-            request.GET = query
-            return super().get(request, *args, **kwargs)
+    pagination_mode = "cursor"
+    cursor_ordering = ("-criado_em",)
+    cursor_tiebreaker = "-id"
 
     def get_queryset(self):
         tenant = self.request.tenant
@@ -265,31 +247,16 @@ class ProdutoExtratoView(EstoqueModuleRequiredMixin, BaseTenantListView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        movimentos = list(context["object_list"])
-        estoque_ids = {mov.estoque_id for mov in movimentos}
-        saldos = {
-            estoque.pk: estoque.quantidade
-            for estoque in Estoque.objects.filter(company=self.request.tenant, pk__in=estoque_ids)
-        }
         extrato_items = []
-        for mov in movimentos:
-            saldo_atual = saldos.get(mov.estoque_id, 0)
-            if mov.tipo == MovimentacaoEstoque.ENTRADA:
-                delta = mov.quantidade
-            elif mov.tipo == MovimentacaoEstoque.SAIDA:
-                delta = -mov.quantidade
-            else:
-                delta = -mov.quantidade
-            saldo_anterior = saldo_atual - delta
-            saldos[mov.estoque_id] = saldo_anterior
+        for mov in context["object_list"]:
             extrato_items.append(
                 {
                     "mov": mov,
                     "produto": mov.estoque.produto if mov.estoque_id else None,
                     "grade": (mov.estoque.grade or "").strip() if mov.estoque_id else "",
                     "deposito": mov.estoque.deposito if mov.estoque_id else None,
-                    "saldo_anterior": saldo_anterior,
-                    "saldo_atual": saldo_atual,
+                    "saldo_anterior": mov.saldo_anterior,
+                    "saldo_atual": mov.saldo_posterior,
                     "tipo": mov.get_tipo_display(),
                     "data": mov.criado_em,
                     "usuario": mov.created_by,
@@ -302,19 +269,3 @@ class ProdutoExtratoView(EstoqueModuleRequiredMixin, BaseTenantListView):
         context["subtitle"] = "Movimentacoes detalhadas do estoque"
         context["now"] = timezone.now()
         return context
-    
-    def paginate_queryset(self, queryset, page_size):
-        paginator = Paginator(queryset, page_size)
-        page_kwarg = self.page_kwarg
-        page = self.request.GET.get(page_kwarg) or 1
-        try:
-            page_number = int(page)
-        except (TypeError, ValueError):
-            page_number = 1
-        if page_number < 1:
-            page_number = 1
-        try:
-            page_obj = paginator.page(page_number)
-        except InvalidPage:
-            page_obj = paginator.page(1)
-        return paginator, page_obj, page_obj.object_list, page_obj.has_other_pages()
@@ -0,0 +1,250 @@
+import base64
+import hashlib
+import mimetypes
+import tempfile
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .fichas import montar_fichas
+from .models import FichaEPIPdf, FichaExportacao, FichaExportacaoArquivo, Funcionario
+from .pdf import renderizar_pdf
+
+# Exportacao em "processando" sem atualizacao por este tempo (worker caiu) volta para a fila.
+EXPORTACAO_TIMEOUT = timedelta(minutes=30)
+PROGRESSO_INTERVALO = 25
+
+
+def enfileirar_exportacao(tenant, user, funcionario_ids, agrupamento="planta", only_active=True):
+    ids = list(
+        Funcionario.objects.filter(company=tenant, pk__in=funcionario_ids).values_list("pk", flat=True)
+    )
+    return FichaExportacao.objects.create(
+        company=tenant,
+        created_by=user,
+        updated_by=user,
+        agrupamento=agrupamento,
+        only_active=only_active,
+        funcionario_ids=ids,
+        total=len(ids),
+    )
+
+
+def proxima_exportacao():
+    """
+    Reserva a exportacao mais antiga da fila do schema atual. SKIP LOCKED deixa
+    varios workers consumirem a mesma fila sem pegar o mesmo pedido.
+    """
+    limite = timezone.now() - EXPORTACAO_TIMEOUT
+    with transaction.atomic():
+        exportacao = (
+            FichaExportacao.objects.select_for_update(skip_locked=True)
+            .filter(Q(status="pendente") | Q(status="processando", updated_at__lt=limite))
+            .order_by("created_at")
+            .first()
+        )
+        if exportacao is None:
+            return None
+        exportacao.status = "processando"
+        exportacao.iniciado_em = timezone.now()
+        exportacao.processadas = 0
+        exportacao.reaproveitadas = 0
+        exportacao.erro = ""
+        exportacao.save(
+            update_fields=["status", "iniciado_em", "processadas", "reaproveitadas", "erro", "updated_at"]
+        )
+    return exportacao
+
+
+def _assinaturas_embutidas():
+    # Imagem lida e codificada uma vez por entrega; os itens da mesma entrega
+    # reaproveitam o data URI. O cache e limpo a cada ficha.
+    cache = {}
+
+    def assinatura(entrega):
+        if entrega.pk not in cache:
+            cache[entrega.pk] = _data_uri(entrega.assinatura)
+        return cache[entrega.pk]
+
+    return assinatura, cache
+
+
+def _data_uri(arquivo):
+    if not arquivo or not arquivo.name:
+        return None
+    try:
+        with arquivo.storage.open(arquivo.name, "rb") as handle:
+            conteudo = handle.read()
+    except (OSError, ValueError):
+        return None
+    mime = mimetypes.guess_type(arquivo.name)[0] or "image/png"
+    return f"data:{mime};base64,{base64.b64encode(conteudo).decode('ascii')}"
+
+
+def _ler_pdf(arquivo):
+    try:
+        with arquivo.storage.open(arquivo.name, "rb") as handle:
+            return handle.read()
+    except (OSError, ValueError):
+        return None
+
+
+def _grupo(funcionario, agrupamento):
+    if agrupamento == "setor":
+        return str(funcionario.setor) if funcionario.setor_id else "Sem setor"
+    return funcionario.planta.nome if funcionario.planta_id else "Sem planta"
+
+
+def _nome_pdf(funcionario):
+    return f"{slugify(funcionario.nome) or 'funcionario'}-{funcionario.pk}.pdf"
+
+
+class _Pacotes:
+    """Um zip temporario por grupo (planta ou setor), gravado na storage no final."""
+
+    def __init__(self):
+        self.arquivos = {}
+
+    def adicionar(self, grupo, nome, conteudo):
+        if grupo not in self.arquivos:
+            handle = tempfile.TemporaryFile()
+            self.arquivos[grupo] = [handle, zipfile.ZipFile(handle, "w", zipfile.ZIP_DEFLATED), 0]
+        pacote = self.arquivos[grupo]
+        pacote[1].writestr(nome, conteudo)
+        pacote[2] += 1
+
+    def gravar(self, exportacao):
+        for grupo in sorted(self.arquivos):
+            handle, arquivo_zip, fichas = self.arquivos[grupo]
+            arquivo_zip.close()
+            handle.seek(0)
+            registro = FichaExportacaoArquivo(
+                company_id=exportacao.company_id,
+                exportacao=exportacao,
+                grupo=grupo[:200],
+                fichas=fichas,
+            )
+            nome = f"fichas-epi-{exportacao.pk}-{slugify(grupo) or 'grupo'}.zip"
+            registro.arquivo.save(nome, File(handle), save=True)
+
+    def fechar(self):
+        for handle, arquivo_zip, _fichas in self.arquivos.values():
+            arquivo_zip.close()
+            handle.close()
+
+
+def _salvar_pdf(exportacao, funcionario, conteudo_hash, conteudo, existente):
+    campo = FichaEPIPdf._meta.get_field("arquivo")
+    nome = campo.storage.save(campo.generate_filename(None, _nome_pdf(funcionario)), ContentFile(conteudo))
+    FichaEPIPdf.objects.update_or_create(
+        company_id=exportacao.company_id,
+        funcionario=funcionario,
+        only_active=exportacao.only_active,
+        defaults={"conteudo_hash": conteudo_hash, "arquivo": nome},
+    )
+    if existente and existente.arquivo.name and existente.arquivo.name != nome:
+        existente.arquivo.storage.delete(existente.arquivo.name)
+
+
+def processar_exportacao(exportacao, workers=None):
+    """
+    Gera os PDFs das fichas da exportacao e um zip por grupo. O HTML de cada
+    ficha (com as assinaturas embutidas) e montado aqui; a conversao para PDF
+    roda num pool de processos. Fichas cujo HTML tem o mesmo hash do ultimo PDF
+    gerado reaproveitam o arquivo em vez de renderizar de novo.
+    """
+    workers = max(1, workers or settings.FICHAS_PDF_WORKERS)
+    tenant = exportacao.company
+    ids = exportacao.funcionario_ids or []
+    existentes = {
+        pdf.funcionario_id: pdf
+        for pdf in FichaEPIPdf.objects.filter(
+            company=tenant, only_active=exportacao.only_active, funcionario_id__in=ids
+        )
+    }
+    context = {"empresa_nome": getattr(tenant, "name", "-")}
+    assinatura, assinaturas = _assinaturas_embutidas()
+    pacotes = _Pacotes()
+    pendentes = {}
+    contagem = {"processadas": 0, "reaproveitadas": 0}
+    pool_iniciado = False
+
+    def progresso(forcar=False):
+        if forcar or contagem["processadas"] % PROGRESSO_INTERVALO == 0:
+            FichaExportacao.objects.filter(pk=exportacao.pk).update(
+                processadas=contagem["processadas"],
+                reaproveitadas=contagem["reaproveitadas"],
+                updated_at=timezone.now(),
+            )
+
+    def concluir(futuros):
+        for futuro in list(futuros):
+            funcionario, grupo, conteudo_hash = pendentes.pop(futuro)
+            conteudo = futuro.result()
+            _salvar_pdf(exportacao, funcionario, conteudo_hash, conteudo, existentes.get(funcionario.pk))
+            pacotes.adicionar(grupo, _nome_pdf(funcionario), conteudo)
+            contagem["processadas"] += 1
+            progresso()
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for ficha in montar_fichas(
+                tenant, ids, only_active=exportacao.only_active, assinatura=assinatura
+            ):
+                funcionario = ficha["funcionario"]
+                html = render_to_string("funcionarios/ficha_epi_pdf.html", {**context, "ficha": ficha})
+                assinaturas.clear()
+                conteudo_hash = hashlib.sha256(html.encode("utf-8")).hexdigest()
+                grupo = _grupo(funcionario, exportacao.agrupamento)
+
+                existente = existentes.get(funcionario.pk)
+                if existente and existente.conteudo_hash == conteudo_hash:
+                    conteudo = _ler_pdf(existente.arquivo)
+                    if conteudo is not None:
+                        pacotes.adicionar(grupo, _nome_pdf(funcionario), conteudo)
+                        contagem["processadas"] += 1
+                        contagem["reaproveitadas"] += 1
+                        progresso()
+                        continue
+
+                if not pool_iniciado:
+                    # Com fork o pool cria os processos no primeiro submit e eles herdam
+                    # o processo atual. Fechar aqui, e nao antes do pool: montar_fichas
+                    # ja reabriu a conexao.
+                    connections.close_all()
+                    pool_iniciado = True
+                pendentes[pool.submit(renderizar_pdf, html)] = (funcionario, grupo, conteudo_hash)
+                # Limita o HTML/PDF em memoria enquanto os processos trabalham.
+                if len(pendentes) >= workers * 4:
+                    concluir(wait(pendentes, return_when=FIRST_COMPLETED).done)
+            concluir(wait(pendentes).done)
+
+        with transaction.atomic():
+            pacotes.gravar(exportacao)
+            exportacao.status = "concluida"
+            exportacao.total = contagem["processadas"]
+            exportacao.processadas = contagem["processadas"]
+            exportacao.reaproveitadas = contagem["reaproveitadas"]
+            exportacao.concluido_em = timezone.now()
+            exportacao.save(
+                update_fields=["status", "total", "processadas", "reaproveitadas", "concluido_em", "updated_at"]
+            )
+    except Exception as exc:
+        progresso(forcar=True)
+        exportacao.status = "erro"
+        exportacao.erro = str(exc)[:2000] or exc.__class__.__name__
+        exportacao.concluido_em = timezone.now()
+        exportacao.save(update_fields=["status", "erro", "concluido_em", "updated_at"])
+        raise
+    finally:
+        pacotes.fechar()
+    return exportacao
@@ -0,0 +1,144 @@
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from apps.entregas.models import DevolucaoItem, EntregaItem
+from .models import Funcionario
+
+LOTE_FUNCIONARIOS = 200
+# Ponto do template fichas_epi_report.html onde entram as fichas, uma a uma.
+MARCADOR_FICHAS = "<!--fichas-epi-->"
+
+
+def _itens_entrega(tenant, funcionario_ids, only_active):
+    itens = (
+        EntregaItem.objects.filter(company=tenant, entrega__funcionario_id__in=funcionario_ids)
+        .exclude(entrega__status="cancelada")
+        .exclude(entrega__entregue_em__isnull=True)
+        .select_related("produto", "entrega")
+    )
+    if only_active:
+        # Ultimo item por (funcionario, produto, grade), mantido em PosseAtual.
+        itens = itens.filter(posse_atual__isnull=False)
+    return itens.order_by("entrega__funcionario_id", "-entrega__entregue_em", "-entrega_id", "-id")
+
+
+def _ultimas_devolucoes(tenant, entrega_item_ids):
+    if not entrega_item_ids:
+        return {}
+    linhas = (
+        DevolucaoItem.objects.filter(company=tenant, entrega_item_id__in=entrega_item_ids)
+        .annotate(
+            posicao=Window(
+                RowNumber(),
+                partition_by=[F("entrega_item_id")],
+                order_by=[F("devolucao__devolvida_em").desc(), F("devolucao_id").desc(), F("id").desc()],
+            )
+        )
+        .filter(posicao=1)
+        .values_list("entrega_item_id", "devolucao__devolvida_em", "motivo")
+    )
+    return {entrega_item_id: (devolvida_em, motivo) for entrega_item_id, devolvida_em, motivo in linhas}
+
+
+def _assinatura_url(entrega, urls):
+    # Uma resolucao de URL por arquivo de assinatura (a storage pode ser remota).
+    nome = entrega.assinatura.name if entrega.assinatura else ""
+    if not nome:
+        return None
+    if nome not in urls:
+        try:
+            urls[nome] = entrega.assinatura.storage.url(nome)
+        except Exception:
+            urls[nome] = None
+    return urls[nome]
+
+
+def _movimento(entrega_item, devolucao, assinatura):
+    entrega = entrega_item.entrega
+    devolucao_em, motivo_dev = devolucao or (None, "")
+    ca_label = (entrega_item.ca or "").strip() or (getattr(entrega_item.produto, "ca", "") or "-")
+    assinatura_url = assinatura(entrega)
+    validacao_tipo = entrega.validacao_recebimento or "nenhum"
+    return {
+        "entrega_id": entrega_item.entrega_id,
+        "entrega_em": entrega.entregue_em,
+        "devolucao_em": devolucao_em,
+        "quantidade": entrega_item.quantidade,
+        "equipamento": entrega_item.produto,
+        "ca": ca_label,
+        "motivo": (motivo_dev or "").strip(),
+        "assinatura_url": assinatura_url,
+        "validacao_em": entrega.entregue_em if validacao_tipo != "nenhum" else None,
+        "validacao_tipo": validacao_tipo,
+        "validacao_label": (
+            "Assinatura (nao registrada)"
+            if validacao_tipo == "assinatura" and not assinatura_url
+            else entrega.get_validacao_recebimento_display()
+        ),
+    }
+
+
+def montar_fichas(tenant, funcionario_ids, only_active=True, lote=LOTE_FUNCIONARIOS, assinatura=None):
+    """
+    Gera as fichas de EPI ({"funcionario", "movimentos"}) em ordem de nome.
+    Os funcionarios sao processados em lotes: por lote, uma consulta de
+    funcionarios, uma de itens entregues (quando only_active, so os itens em
+    PosseAtual: o mais recente por produto/grade) e uma das ultimas devolucoes. So um lote fica em memoria por vez.
+
+    assinatura(entrega) devolve o src da imagem de assinatura; por padrao, a URL
+    da storage.
+    """
+    ordenados = list(
+        Funcionario.objects.filter(company=tenant, pk__in=funcionario_ids)
+        .order_by("nome", "pk")
+        .values_list("pk", flat=True)
+    )
+    if assinatura is None:
+        urls = {}
+
+        def assinatura(entrega):
+            return _assinatura_url(entrega, urls)
+
+    for inicio in range(0, len(ordenados), lote):
+        ids = ordenados[inicio : inicio + lote]
+        funcionarios = (
+            Funcionario.objects.filter(pk__in=ids)
+            .select_related("setor", "cargo", "planta", "centro_custo", "ghe")
+            .order_by("nome", "pk")
+        )
+        itens_por_funcionario = {}
+        for item in _itens_entrega(tenant, ids, only_active):
+            itens_por_funcionario.setdefault(item.entrega.funcionario_id, []).append(item)
+        devolucoes = _ultimas_devolucoes(
+            tenant, [item.pk for itens in itens_por_funcionario.values() for item in itens]
+        )
+        for funcionario in funcionarios:
+            yield {
+                "funcionario": funcionario,
+                "movimentos": [
+                    _movimento(item, devolucoes.get(item.pk), assinatura)
+                    for item in itens_por_funcionario.get(funcionario.pk, [])
+                ],
+            }
+
+
+def renderizar_fichas(request, context, fichas):
+    """
+    Gera o HTML de fichas_epi_report.html em partes: o inicio da pagina, uma
+    ficha por vez (_ficha_epi.html) e o fim. Para StreamingHttpResponse.
+    """
+    pagina = render_to_string(
+        "funcionarios/fichas_epi_report.html",
+        {**context, "fichas_marcador": mark_safe(MARCADOR_FICHAS)},
+        request=request,
+    )
+    inicio, fim = pagina.split(MARCADOR_FICHAS, 1)
+    yield inicio
+    primeira = True
+    for ficha in fichas:
+        # Sem request: os context processors rodariam de novo a cada ficha.
+        yield render_to_string("funcionarios/_ficha_epi.html", {**context, "ficha": ficha, "primeira": primeira})
+        primeira = False
+    yield fim
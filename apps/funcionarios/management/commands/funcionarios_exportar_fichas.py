@@ -0,0 +1,70 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django_tenants.utils import schema_context
+
+from apps.funcionarios.exportacao import processar_exportacao, proxima_exportacao
+from apps.funcionarios.models import FichaExportacao
+from apps.tenants.models import Company
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker da fila de exportacao de fichas de EPI em PDF (tabela FichaExportacao de cada tenant). "
+        "Processa os pedidos pendentes e, sem --once, continua consultando a fila."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--schema", help="Processa apenas o tenant informado.")
+        parser.add_argument("--once", action="store_true", help="Esvazia a fila uma vez e sai.")
+        parser.add_argument(
+            "--intervalo",
+            type=float,
+            default=5.0,
+            help="Segundos entre consultas a fila quando ela esta vazia (padrao: 5).",
+        )
+        parser.add_argument("--workers", type=int, help="Processos para renderizar PDFs (padrao: FICHAS_PDF_WORKERS).")
+
+    def handle(self, *args, **options):
+        schema = options.get("schema")
+        if schema and not Company.objects.filter(schema_name=schema).exists():
+            raise CommandError(f"Tenant '{schema}' nao encontrado.")
+
+        while True:
+            processadas = 0
+            tenants = Company.objects.exclude(schema_name="public").order_by("schema_name")
+            if schema:
+                tenants = tenants.filter(schema_name=schema)
+            for tenant in tenants:
+                with schema_context(tenant.schema_name):
+                    processadas += self._process_tenant(tenant, options.get("workers"))
+            if options.get("once"):
+                break
+            if not processadas:
+                time.sleep(options["intervalo"])
+
+        self.stdout.write(self.style.SUCCESS("Fila de exportacao de fichas processada."))
+
+    def _process_tenant(self, tenant, workers):
+        if FichaExportacao._meta.db_table not in set(connection.introspection.table_names()):
+            return 0
+        processadas = 0
+        while True:
+            exportacao = proxima_exportacao()
+            if exportacao is None:
+                return processadas
+            started = time.perf_counter()
+            try:
+                processar_exportacao(exportacao, workers)
+            except Exception as exc:
+                self.stdout.write(
+                    self.style.ERROR(f"[{tenant.schema_name}] exportacao #{exportacao.pk} falhou: {exc}")
+                )
+            else:
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f"[{tenant.schema_name}] exportacao #{exportacao.pk} fichas={exportacao.processadas} "
+                    f"reaproveitadas={exportacao.reaproveitadas} tempo={elapsed:.1f}s"
+                )
+            processadas += 1
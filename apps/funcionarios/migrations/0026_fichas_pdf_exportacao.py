@@ -0,0 +1,77 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tenants', '0002_company_estoque_enabled'),
+        ('funcionarios', '0025_alter_funcionario_validacao_recebimento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FichaEPIPdf',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('only_active', models.BooleanField(default=True)),
+                ('conteudo_hash', models.CharField(max_length=64)),
+                ('arquivo', models.FileField(upload_to='funcionarios/fichas/pdf/')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(class)s_set', to='tenants.company')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='%(class)s_created', to=settings.AUTH_USER_MODEL)),
+                ('funcionario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fichas_pdf', to='funcionarios.funcionario')),
+                ('updated_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='%(class)s_updated', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('funcionario', 'only_active'), name='funcionarios_ficha_pdf_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='FichaExportacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('status', models.CharField(choices=[('pendente', 'Pendente'), ('processando', 'Processando'), ('concluida', 'Concluida'), ('erro', 'Erro')], default='pendente', max_length=15)),
+                ('agrupamento', models.CharField(choices=[('planta', 'Planta'), ('setor', 'Setor')], default='planta', max_length=10)),
+                ('only_active', models.BooleanField(default=True)),
+                ('funcionario_ids', models.JSONField(default=list)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('processadas', models.PositiveIntegerField(default=0)),
+                ('reaproveitadas', models.PositiveIntegerField(default=0)),
+                ('erro', models.TextField(blank=True)),
+                ('iniciado_em', models.DateTimeField(blank=True, null=True)),
+                ('concluido_em', models.DateTimeField(blank=True, null=True)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(class)s_set', to='tenants.company')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='%(class)s_created', to=settings.AUTH_USER_MODEL)),
+                ('updated_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='%(class)s_updated', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='func_ficha_export_fila')],
+            },
+        ),
+        migrations.CreateModel(
+            name='FichaExportacaoArquivo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('grupo', models.CharField(max_length=200)),
+                ('fichas', models.PositiveIntegerField(default=0)),
+                ('arquivo', models.FileField(upload_to='funcionarios/fichas/exportacoes/')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(class)s_set', to='tenants.company')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='%(class)s_created', to=settings.AUTH_USER_MODEL)),
+                ('exportacao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='arquivos', to='funcionarios.fichaexportacao')),
+                ('updated_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='%(class)s_updated', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['grupo'],
+            },
+        ),
+    ]
@@ -236,3 +236,74 @@ class FuncionarioProduto(TenantModel):
 
     def __str__(self):
         return f"{self.funcionario} - {self.produto_fornecedor}"
+
+
+class FichaEPIPdf(TenantModel):
+    """Ultimo PDF gerado da ficha de EPI do funcionario, reaproveitado enquanto o hash nao muda."""
+
+    funcionario = models.ForeignKey(Funcionario, on_delete=models.CASCADE, related_name="fichas_pdf")
+    only_active = models.BooleanField(default=True)
+    conteudo_hash = models.CharField(max_length=64)
+    arquivo = models.FileField(upload_to="funcionarios/fichas/pdf/")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["funcionario", "only_active"],
+                name="funcionarios_ficha_pdf_uniq",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.funcionario} - {self.conteudo_hash[:12]}"
+
+
+class FichaExportacao(TenantModel):
+    STATUS_CHOICES = [
+        ("pendente", "Pendente"),
+        ("processando", "Processando"),
+        ("concluida", "Concluida"),
+        ("erro", "Erro"),
+    ]
+    AGRUPAMENTO_CHOICES = [
+        ("planta", "Planta"),
+        ("setor", "Setor"),
+    ]
+    status = models.CharField(max_length=15, choices=STATUS_CHOICES, default="pendente")
+    agrupamento = models.CharField(max_length=10, choices=AGRUPAMENTO_CHOICES, default="planta")
+    only_active = models.BooleanField(default=True)
+    funcionario_ids = models.JSONField(default=list)
+    total = models.PositiveIntegerField(default=0)
+    processadas = models.PositiveIntegerField(default=0)
+    reaproveitadas = models.PositiveIntegerField(default=0)
+    erro = models.TextField(blank=True)
+    iniciado_em = models.DateTimeField(null=True, blank=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["status", "created_at"], name="func_ficha_export_fila"),
+        ]
+
+    def __str__(self):
+        return f"Exportacao de fichas #{self.pk} ({self.get_status_display()})"
+
+    @property
+    def percentual(self):
+        if not self.total:
+            return 100 if self.status == "concluida" else 0
+        return int(self.processadas * 100 / self.total)
+
+
+class FichaExportacaoArquivo(TenantModel):
+    exportacao = models.ForeignKey(FichaExportacao, on_delete=models.CASCADE, related_name="arquivos")
+    grupo = models.CharField(max_length=200)
+    fichas = models.PositiveIntegerField(default=0)
+    arquivo = models.FileField(upload_to="funcionarios/fichas/exportacoes/")
+
+    class Meta:
+        ordering = ["grupo"]
+
+    def __str__(self):
+        return f"{self.exportacao_id} - {self.grupo}"
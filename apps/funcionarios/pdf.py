@@ -0,0 +1,9 @@
+# Executado nos processos do pool de exportacao: nada de Django aqui, so HTML -> PDF.
+
+
+def renderizar_pdf(html):
+    try:
+        from weasyprint import HTML
+    except ImportError as exc:
+        raise RuntimeError("WeasyPrint nao instalado; instale as dependencias de requirements.txt.") from exc
+    return HTML(string=html).write_pdf()
@@ -12,8 +12,19 @@ urlpatterns = [
         views.FichasEPIReportView.as_view(),
         name="fichas_epi_relatorio",
     ),
+    path(
+        "funcionarios/fichas-epi/exportar/",
+        views.FichasEPIExportarView.as_view(),
+        name="fichas_epi_exportar",
+    ),
+    path(
+        "funcionarios/fichas-epi/exportacoes/<int:pk>/",
+        views.FichasEPIExportacaoStatusView.as_view(),
+        name="fichas_epi_exportacao",
+    ),
     path("funcionarios/novo/", views.FuncionarioCreateView.as_view(), name="create"),
     path("funcionarios/<int:pk>/editar/", views.FuncionarioUpdateView.as_view(), name="update"),
+    path("funcionarios/<int:pk>/modal/", views.FuncionarioEditModalView.as_view(), name="edit_modal"),
     path(
         "funcionarios/<int:pk>/toggle/",
         views.FuncionarioToggleActiveView.as_view(),
@@ -89,6 +100,7 @@ urlpatterns = [
         views.FuncionarioHistoricoEntregaListView.as_view(),
         name="historico_entregas_list",
     ),
+    path("funcionarios/<int:pk>/posse/", views.FuncionarioPosseListView.as_view(), name="posse_list"),
     path("funcionarios/produtos/", views.FuncionarioProdutoListView.as_view(), name="produtos_list"),
     path("funcionarios/produtos/novo/", views.FuncionarioProdutoCreateView.as_view(), name="produtos_create"),
     path(
@@ -5,21 +5,27 @@ from django.contrib.auth.hashers import make_password
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.db.models import Sum
 from django.core.paginator import InvalidPage, Paginator
-from django.http import JsonResponse, HttpResponseRedirect
+from django.http import JsonResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render
 from django.template.loader import render_to_string
 from django.urls import reverse, reverse_lazy
 from django.utils import timezone
 from django.views import View
 
-from apps.entregas.models import Devolucao, DevolucaoItem, Entrega, EntregaItem
+from apps.entregas.models import Devolucao, Entrega, EntregaItem, PosseAtual
+from apps.entregas.services import invalidar_liberacoes
+from apps.core.pagination import paginar_por_cursor
 from apps.core.views import (
     BaseTenantCreateView,
     BaseTenantDetailView,
+    BaseTenantEditModalView,
     BaseTenantListView,
     BaseTenantUpdateView,
 )
 from apps.treinamentos.models import TreinamentoCertificado, TreinamentoPendencia
+from apps.treinamentos.services import agendar_pendencias
+from .exportacao import enfileirar_exportacao
+from .fichas import montar_fichas, renderizar_fichas
 from .forms import (
     AfastamentoForm,
     AdvertenciaForm,
@@ -38,6 +44,7 @@ from .forms import (
 from .models import (
     Afastamento,
     CentroCusto,
+    FichaExportacao,
     Funcionario,
     FuncionarioAnexo,
     FuncionarioHistorico,
@@ -83,6 +90,7 @@ class FuncionarioListView(BaseTenantListView):
     ]
     create_url_name = "funcionarios:create"
     update_url_name = "funcionarios:update"
+    lazy_edit_forms = True
 
     def get(self, request, *args, **kwargs):
         if request.headers.get("X-Requested-With") != "XMLHttpRequest":
@@ -95,11 +103,6 @@ class FuncionarioListView(BaseTenantListView):
             {"object_list": context.get("object_list", [])},
             request=request,
         )
-        modals_html = render_to_string(
-            "funcionarios/_funcionario_edit_modals.html",
-            {"edit_rows": context.get("edit_rows", [])},
-            request=request,
-        )
         pagination_html = render_to_string(
             "components/_pagination.html",
             {"page_obj": page_obj},
@@ -109,7 +112,6 @@ class FuncionarioListView(BaseTenantListView):
             {
                 "ok": True,
                 "rows_html": rows_html,
-                "modals_html": modals_html,
                 "pagination_html": pagination_html,
             }
         )
@@ -125,23 +127,11 @@ class FuncionarioListView(BaseTenantListView):
             queryset = queryset.filter(planta_id=planta_id)
         return queryset
 
+    def get_list_form_kwargs(self):
+        return {"include_validacao": False}
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        if context.get("can_add"):
-            context["create_form"] = FuncionarioForm(include_validacao=False)
-        else:
-            context["create_form"] = None
-        if context.get("can_change"):
-            context["edit_rows"] = [
-                {
-                    "object": obj,
-                    "form": FuncionarioForm(instance=obj, include_validacao=False),
-                    "update_url": reverse_lazy(self.update_url_name, args=[obj.pk]),
-                }
-                for obj in context.get("object_list", [])
-            ]
-        else:
-            context["edit_rows"] = []
         context["anexo_form"] = FuncionarioAnexoForm()
         context["anexo_create_url"] = reverse_lazy("funcionarios:anexos_create")
         context["historico_mov_filters"] = [
@@ -169,6 +159,23 @@ class FuncionarioListView(BaseTenantListView):
         return context
 
 
+class FuncionarioEditModalView(BaseTenantEditModalView):
+    model = Funcionario
+    form_class = FuncionarioForm
+    template_name = "funcionarios/_funcionario_edit_modal.html"
+    update_url_name = "funcionarios:update"
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs["include_validacao"] = False
+        return kwargs
+
+    def get_modal_context(self):
+        context = super().get_modal_context()
+        context["funcionario"] = self.object
+        return context
+
+
 class FuncionarioCreateView(BaseTenantCreateView):
     model = Funcionario
     form_class = FuncionarioForm
@@ -257,9 +264,13 @@ class FichasEPIView(PermissionRequiredMixin, View):
         if planta_id:
             funcionarios = funcionarios.filter(planta_id=planta_id)
         funcionarios = funcionarios.order_by("nome").only("id", "nome", "registro")
+        exportacoes = FichaExportacao.objects.filter(company=request.tenant).prefetch_related("arquivos")[:5]
         context = {
             "funcionarios": funcionarios,
             "relatorio_url": reverse("funcionarios:fichas_epi_relatorio"),
+            "exportar_url": reverse("funcionarios:fichas_epi_exportar"),
+            "exportacoes": exportacoes,
+            "agrupamento_choices": FichaExportacao.AGRUPAMENTO_CHOICES,
         }
         return render(request, "funcionarios/fichas_epi.html", context)
 
@@ -275,102 +286,63 @@ class FichasEPIReportView(PermissionRequiredMixin, View):
         only_active = (request.GET.get("only_active") or "1").strip() not in ("0", "false", "off", "")
         auto_print = (request.GET.get("print") or "").strip() in ("1", "true", "on")
 
-        funcionarios = (
-            Funcionario.objects.filter(company=request.tenant, pk__in=funcionario_ids)
-            .select_related("setor", "cargo", "planta", "centro_custo", "ghe")
-            .order_by("nome")
-        )
-
-        fichas = []
-        for funcionario in funcionarios:
-            itens_qs = (
-                EntregaItem.objects.filter(company=request.tenant, entrega__funcionario_id=funcionario.pk)
-                .exclude(entrega__status="cancelada")
-                .exclude(entrega__entregue_em__isnull=True)
-                .select_related("produto", "deposito", "entrega")
-                .order_by("-entrega__entregue_em", "-entrega_id", "-id")
-            )
-
-            entrega_items = list(itens_qs)
-            if only_active:
-                latest = {}
-                active_items = []
-                for item in entrega_items:
-                    key = (item.produto_id, ((item.grade or "").strip() or "").lower())
-                    if key in latest:
-                        continue
-                    latest[key] = item.pk
-                    active_items.append(item)
-                entrega_items = active_items
-
-            last_devolucao_item_by_entrega_item = {}
-            if entrega_items:
-                entrega_item_ids = [item.pk for item in entrega_items]
-                devolucao_items = (
-                    DevolucaoItem.objects.filter(company=request.tenant, entrega_item_id__in=entrega_item_ids)
-                    .select_related("devolucao")
-                    .order_by("-devolucao__devolvida_em", "-devolucao_id", "-id")
-                )
-                for devolucao_item in devolucao_items:
-                    if devolucao_item.entrega_item_id in last_devolucao_item_by_entrega_item:
-                        continue
-                    last_devolucao_item_by_entrega_item[devolucao_item.entrega_item_id] = devolucao_item
-
-            movimentos = []
-            for entrega_item in entrega_items:
-                last_dev = last_devolucao_item_by_entrega_item.get(entrega_item.pk)
-                entrega = entrega_item.entrega
-                devolucao_em = None
-                motivo_dev = ""
-                if last_dev and last_dev.devolucao_id and last_dev.devolucao:
-                    devolucao_em = last_dev.devolucao.devolvida_em
-                    motivo_dev = (last_dev.motivo or "").strip()
-                ca_label = (entrega_item.ca or "").strip() or (getattr(entrega_item.produto, "ca", "") or "-")
-                assinatura_url = None
-                if entrega and getattr(entrega, "assinatura", None):
-                    try:
-                        assinatura_url = entrega.assinatura.url
-                    except Exception:
-                        assinatura_url = None
-                validacao_tipo = (getattr(entrega, "validacao_recebimento", "") or "nenhum") if entrega else "nenhum"
-                validacao_em = None
-                if entrega and validacao_tipo != "nenhum":
-                    validacao_em = entrega.entregue_em
-                movimentos.append(
-                    {
-                        "entrega_id": entrega_item.entrega_id,
-                        "entrega_em": entrega.entregue_em if entrega else None,
-                        "devolucao_em": devolucao_em,
-                        "quantidade": entrega_item.quantidade,
-                        "equipamento": entrega_item.produto,
-                        "ca": ca_label,
-                        "motivo": motivo_dev,
-                        "assinatura_url": assinatura_url,
-                        "validacao_em": validacao_em,
-                        "validacao_tipo": validacao_tipo,
-                        "validacao_label": (
-                            "Assinatura (nao registrada)"
-                            if entrega and (entrega.validacao_recebimento or "") == "assinatura" and not assinatura_url
-                            else (entrega.get_validacao_recebimento_display() if entrega else "-")
-                        ),
-                    }
-                )
-
-            fichas.append(
-                {
-                    "funcionario": funcionario,
-                    "movimentos": movimentos,
-                }
-            )
-
         context = {
-            "fichas": fichas,
             "gerado_em": timezone.now(),
             "empresa_nome": getattr(request.tenant, "name", "-"),
             "only_active": only_active,
             "auto_print": auto_print,
         }
-        return render(request, "funcionarios/fichas_epi_report.html", context)
+        fichas = montar_fichas(request.tenant, funcionario_ids, only_active=only_active)
+        return StreamingHttpResponse(
+            renderizar_fichas(request, context, fichas),
+            content_type="text/html; charset=utf-8",
+        )
+
+
+def _exportacao_payload(exportacao):
+    return {
+        "id": exportacao.pk,
+        "status": exportacao.status,
+        "status_label": exportacao.get_status_display(),
+        "total": exportacao.total,
+        "processadas": exportacao.processadas,
+        "reaproveitadas": exportacao.reaproveitadas,
+        "percentual": exportacao.percentual,
+        "erro": exportacao.erro,
+        "status_url": reverse("funcionarios:fichas_epi_exportacao", args=[exportacao.pk]),
+        "arquivos": [
+            {"grupo": arquivo.grupo, "fichas": arquivo.fichas, "url": arquivo.arquivo.url}
+            for arquivo in exportacao.arquivos.all()
+        ],
+    }
+
+
+class FichasEPIExportarView(PermissionRequiredMixin, View):
+    permission_required = "funcionarios.view_funcionario"
+
+    def post(self, request):
+        funcionario_ids = _parse_ids(request.POST.getlist("funcionario_id"))
+        if not funcionario_ids:
+            return JsonResponse({"ok": False, "error": "Selecione ao menos um funcionario."}, status=400)
+        agrupamento = request.POST.get("agrupamento") or "planta"
+        if agrupamento not in dict(FichaExportacao.AGRUPAMENTO_CHOICES):
+            return JsonResponse({"ok": False, "error": "Agrupamento invalido."}, status=400)
+        only_active = (request.POST.get("only_active") or "1").strip() not in ("0", "false", "off", "")
+        exportacao = enfileirar_exportacao(
+            request.tenant, request.user, funcionario_ids, agrupamento=agrupamento, only_active=only_active
+        )
+        if not exportacao.total:
+            exportacao.delete()
+            return JsonResponse({"ok": False, "error": "Nenhum funcionario encontrado."}, status=400)
+        return JsonResponse({"ok": True, "exportacao": _exportacao_payload(exportacao)})
+
+
+class FichasEPIExportacaoStatusView(PermissionRequiredMixin, View):
+    permission_required = "funcionarios.view_funcionario"
+
+    def get(self, request, pk):
+        exportacao = get_object_or_404(FichaExportacao, pk=pk, company=request.tenant)
+        return JsonResponse({"ok": True, "exportacao": _exportacao_payload(exportacao)})
 
 class FuncionarioUpdateView(BaseTenantUpdateView):
     model = Funcionario
@@ -825,6 +797,9 @@ class FuncionarioProdutoCreateView(BaseTenantCreateView):
             return None
 
         FuncionarioProduto.objects.bulk_create(created)
+        # bulk_create nao dispara post_save: pendencias de treinamento por EPI.
+        agendar_pendencias(self.request.tenant.pk, funcionario_ids={item.funcionario_id for item in created})
+        invalidar_liberacoes(self.request.tenant.pk)
         return created
 
     def post(self, request, *args, **kwargs):
@@ -1461,18 +1436,7 @@ class FuncionarioHistoricoListView(View):
             queryset = queryset.filter(created_at__date__gte=data_inicio)
         if data_fim:
             queryset = queryset.filter(created_at__date__lte=data_fim)
-        paginator = Paginator(queryset, 10)
-        page = request.GET.get("page") or 1
-        try:
-            page_number = int(page)
-        except (TypeError, ValueError):
-            page_number = 1
-        if page_number < 1:
-            page_number = 1
-        try:
-            page_obj = paginator.page(page_number)
-        except InvalidPage:
-            page_obj = paginator.page(1)
+        page_obj = paginar_por_cursor(request, queryset, 10, ("-created_at",))
         rows_html = render_to_string(
             "funcionarios/_historico_rows.html",
             {"historico": page_obj.object_list},
@@ -1494,6 +1458,26 @@ class FuncionarioHistoricoListView(View):
         return render(request, "funcionarios/list.html")
 
 
+class FuncionarioPosseListView(PermissionRequiredMixin, View):
+    permission_required = "funcionarios.view_funcionario"
+
+    def get(self, request, pk):
+        funcionario = get_object_or_404(Funcionario, pk=pk, company=request.tenant)
+        posses = (
+            PosseAtual.objects.filter(company=request.tenant, funcionario=funcionario, saldo__gt=0)
+            .select_related("produto", "entrega_item")
+            .order_by("produto__nome", "grade")
+        )
+        rows_html = render_to_string(
+            "funcionarios/_posse_rows.html",
+            {"posses": posses},
+            request=request,
+        )
+        if request.headers.get("X-Requested-With") == "XMLHttpRequest":
+            return JsonResponse({"ok": True, "rows_html": rows_html})
+        return render(request, "funcionarios/list.html")
+
+
 class FuncionarioHistoricoEntregaListView(View):
     def get(self, request, pk):
         funcionario = get_object_or_404(Funcionario, pk=pk, company=request.tenant)
@@ -1518,18 +1502,7 @@ class FuncionarioHistoricoEntregaListView(View):
             queryset = queryset.filter(entrega__entregue_em__date__gte=data_inicio)
         if data_fim:
             queryset = queryset.filter(entrega__entregue_em__date__lte=data_fim)
-        paginator = Paginator(queryset, 10)
-        page = request.GET.get("page") or 1
-        try:
-            page_number = int(page)
-        except (TypeError, ValueError):
-            page_number = 1
-        if page_number < 1:
-            page_number = 1
-        try:
-            page_obj = paginator.page(page_number)
-        except InvalidPage:
-            page_obj = paginator.page(1)
+        page_obj = paginar_por_cursor(request, queryset, 10, ("-entrega__entregue_em", "-entrega_id"))
         rows_html = render_to_string(
             "funcionarios/_historico_entregas_rows.html",
             {"historico": page_obj.object_list},
@@ -1,10 +1,7 @@
 from django import forms
-from django.utils import timezone
-
-from django_tenants.utils import schema_context
 
 from apps.core.forms import BootstrapModelForm
-from apps.caepi.models import CaEPI
+from apps.caepi.services import status_cas
 from apps.fornecedores.models import Fornecedor
 from .models import (
     FamiliaProduto,
@@ -101,17 +98,11 @@ class ProdutoForm(BootstrapModelForm):
         if not ca:
             return cleaned_data
 
-        today = timezone.localdate()
-        with schema_context("public"):
-            caepi = (
-                CaEPI.objects.filter(registro_ca=ca)
-                .order_by("-data_validade", "-ultima_atualizacao")
-                .first()
-            )
-        if caepi and caepi.data_validade:
+        oficial = status_cas([ca], usar_cache=False)[ca]
+        if oficial["data_validade"]:
             if not cleaned_data.get("data_vencimento_ca"):
-                cleaned_data["data_vencimento_ca"] = caepi.data_validade
-            if caepi.data_validade < today:
+                cleaned_data["data_vencimento_ca"] = oficial["data_validade"]
+            if oficial["status"] == "expired":
                 self.add_error("ca", "CA vencido.")
         return cleaned_data
 
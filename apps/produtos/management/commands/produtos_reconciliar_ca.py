@@ -0,0 +1,112 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django_tenants.utils import schema_context
+
+from apps.caepi.models import CaEPIAtual
+from apps.estoque.models import ActionLog
+from apps.produtos.models import Produto
+from apps.tenants.models import Company
+
+ACTION = "produto_ca_reconciliado"
+
+
+class Command(BaseCommand):
+    help = (
+        "Atualiza validade e situacao do CA dos produtos de cada tenant a partir da base "
+        "oficial (CaEPIAtual) e registra as diferencas no historico do produto."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--schema", help="Processa apenas o tenant informado.")
+        parser.add_argument("--dry-run", action="store_true", help="Simula sem gravar no banco.")
+
+    def handle(self, *args, **options):
+        tenants = Company.objects.exclude(schema_name="public").order_by("schema_name")
+        if options.get("schema"):
+            tenants = tenants.filter(schema_name=options["schema"])
+            if not tenants.exists():
+                raise CommandError(f"Tenant '{options['schema']}' nao encontrado.")
+
+        total_alterados = 0
+        started = time.perf_counter()
+        for tenant in tenants:
+            with schema_context(tenant.schema_name):
+                total_alterados += self._process_tenant(tenant, options.get("dry_run", False))
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Reconciliacao de CAs concluida. Produtos alterados: {total_alterados} ({elapsed:.1f}s)."
+            )
+        )
+
+    def _diferencas(self):
+        # Uma consulta por schema: o join com a tabela publica (unique em registro_ca)
+        # fica no banco; so os produtos que mudam voltam para o Python.
+        produtos = Produto._meta.db_table
+        oficial = f"public.{CaEPIAtual._meta.db_table}"
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT
+                    p.id,
+                    p.company_id,
+                    p.data_vencimento_ca,
+                    p.situacao_ca,
+                    coalesce(a.data_validade, p.data_vencimento_ca),
+                    left(a.situacao, 120)
+                FROM {produtos} AS p
+                JOIN {oficial} AS a ON a.registro_ca = btrim(p.ca)
+                WHERE btrim(p.ca) <> ''
+                  AND (
+                      p.data_vencimento_ca IS DISTINCT FROM coalesce(a.data_validade, p.data_vencimento_ca)
+                      OR p.situacao_ca IS DISTINCT FROM left(a.situacao, 120)
+                  )
+                """
+            )
+            return cursor.fetchall()
+
+    def _process_tenant(self, tenant, dry_run):
+        if Produto._meta.db_table not in set(connection.introspection.table_names()):
+            self.stdout.write(self.style.WARNING(f"[{tenant.schema_name}] tabela de produtos ausente, pulei."))
+            return 0
+
+        started = time.perf_counter()
+        with transaction.atomic():
+            diferencas = self._diferencas()
+            agora = timezone.now()
+            produtos = []
+            logs = []
+            for pk, company_id, validade_anterior, situacao_anterior, validade, situacao in diferencas:
+                produtos.append(
+                    Produto(pk=pk, data_vencimento_ca=validade, situacao_ca=situacao, updated_at=agora)
+                )
+                logs.append(
+                    ActionLog(
+                        company_id=company_id,
+                        action=ACTION,
+                        reference=f"Produto:{pk}",
+                        payload={
+                            "data_vencimento_ca": [
+                                validade_anterior.isoformat() if validade_anterior else None,
+                                validade.isoformat() if validade else None,
+                            ],
+                            "situacao_ca": [situacao_anterior, situacao],
+                        },
+                    )
+                )
+            if not dry_run and produtos:
+                Produto.objects.bulk_update(
+                    produtos, ["data_vencimento_ca", "situacao_ca", "updated_at"], batch_size=500
+                )
+                ActionLog.objects.bulk_create(logs, batch_size=500)
+
+        elapsed = (time.perf_counter() - started) * 1000
+        prefixo = "[dry-run] " if dry_run else ""
+        self.stdout.write(
+            f"{prefixo}[{tenant.schema_name}] produtos alterados={len(produtos)} tempo={elapsed:.0f}ms"
+        )
+        return len(produtos)
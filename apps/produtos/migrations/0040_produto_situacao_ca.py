@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("produtos", "0039_migrar_grade_texto_para_model"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="produto",
+            name="situacao_ca",
+            field=models.CharField(blank=True, default="", editable=False, max_length=120),
+        ),
+    ]
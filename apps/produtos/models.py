@@ -16,6 +16,39 @@ def validate_attachment_size(value):
         raise ValidationError("Arquivo excede o limite de 3MB.")
 
 
+def merge_grade_opcoes(nomes, raw):
+    """
+    Junta as grades cadastradas (GradeProduto) com o texto legado de Produto.grade,
+    sem repetir valores (comparacao sem diferenciar maiusculas).
+    """
+    items = []
+    seen = set()
+    for nome in nomes:
+        value = (nome or "").strip()
+        if not value:
+            continue
+        key = value.lower()
+        if key in seen:
+            continue
+        seen.add(key)
+        items.append(value)
+
+    raw = (raw or "").strip()
+    if not raw:
+        return items
+    parts = re.split(r"[,\n;/]+", raw)
+    for part in parts:
+        value = (part or "").strip()
+        if not value:
+            continue
+        key = value.lower()
+        if key in seen:
+            continue
+        seen.add(key)
+        items.append(value)
+    return items
+
+
 class GradeProduto(TenantModel):
     nome = models.CharField(max_length=50)
     ativo = models.BooleanField(default=True)
@@ -48,6 +81,8 @@ class Produto(TenantModel):
         blank=True,
     )
     data_vencimento_ca = models.DateField(null=True, blank=True)
+    # Situacao do CA na base oficial, gravada por produtos_reconciliar_ca.
+    situacao_ca = models.CharField(max_length=120, blank=True, default="", editable=False)
     referencia = models.CharField(max_length=120, blank=True)
     periodicidade_quantidade = models.PositiveIntegerField(default=1, verbose_name="Quantidade")
     periodicidade = models.ForeignKey(
@@ -99,37 +134,13 @@ class Produto(TenantModel):
         return "Vencido" if self.data_vencimento_ca < timezone.localdate() else "Valido"
 
     def grade_opcoes(self):
-        items = []
-        seen = set()
-
+        nomes = []
         try:
-            for nome in self.grades.filter(ativo=True).order_by("nome").values_list("nome", flat=True):
-                value = (nome or "").strip()
-                if not value:
-                    continue
-                key = value.lower()
-                if key in seen:
-                    continue
-                seen.add(key)
-                items.append(value)
+            nomes = list(self.grades.filter(ativo=True).order_by("nome").values_list("nome", flat=True))
         except Exception:
             # Evita quebrar chamadas em ambientes/migrations onde o relacionamento ainda nao existe.
             pass
-
-        raw = (self.grade or "").strip()
-        if not raw:
-            return items
-        parts = re.split(r"[,\n;/]+", raw)
-        for part in parts:
-            value = (part or "").strip()
-            if not value:
-                continue
-            key = value.lower()
-            if key in seen:
-                continue
-            seen.add(key)
-            items.append(value)
-        return items
+        return merge_grade_opcoes(nomes, self.grade)
 
     def clean(self):
         if self.controle_epi:
@@ -1,5 +1,5 @@
 from apps.fornecedores.models import Fornecedor
-from apps.produtos.models import Produto, ProdutoFornecedor
+from apps.produtos.models import Produto, ProdutoFornecedor, ProdutoGrade, merge_grade_opcoes
 
 
 DEFAULT_FORNECEDOR_PLACEHOLDER_NOME = "Sem fornecedor"
@@ -42,3 +42,27 @@ def ensure_produtofornecedor_placeholders(company):
         ignore_conflicts=True,
     )
 
+
+def grade_opcoes_por_produto(produtos):
+    """
+    Versao em lote de Produto.grade_opcoes(): resolve as grades de varios produtos
+    com uma unica consulta. Retorna {produto_id: [grades]}.
+    """
+    produtos = [produto for produto in produtos if produto is not None]
+    if not produtos:
+        return {}
+    nomes_map = {}
+    rows = (
+        ProdutoGrade.objects.filter(
+            produto_id__in={produto.pk for produto in produtos},
+            grade__ativo=True,
+        )
+        .order_by("grade__nome")
+        .values_list("produto_id", "grade__nome")
+    )
+    for produto_id, nome in rows:
+        nomes_map.setdefault(produto_id, []).append(nome)
+    return {
+        produto.pk: merge_grade_opcoes(nomes_map.get(produto.pk, []), produto.grade)
+        for produto in produtos
+    }
@@ -8,6 +8,7 @@ urlpatterns = [
     path("produtos/", views.ProdutoListView.as_view(), name="list"),
     path("produtos/novo/", views.ProdutoCreateView.as_view(), name="create"),
     path("produtos/<int:pk>/editar/", views.ProdutoUpdateView.as_view(), name="update"),
+    path("produtos/<int:pk>/modal/", views.ProdutoModalView.as_view(), name="modal"),
     path("produtos/<int:pk>/toggle/", views.ProdutoToggleActiveView.as_view(), name="toggle_active"),
     path("produtos/<int:pk>/historico/", views.ProdutoHistoricoListView.as_view(), name="historico"),
     path("produtos/unidades/", views.UnidadeProdutoListView.as_view(), name="unidades_list"),
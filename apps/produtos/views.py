@@ -8,15 +8,18 @@ from django.db.models import Avg, Prefetch, Q
 from django.http import HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404, render
 from django.template.loader import render_to_string
-from django.urls import reverse, reverse_lazy
+from django.urls import reverse
 from django.utils import timezone
 from django.views import View
-from django.core.paginator import InvalidPage, Paginator
 
-from django_tenants.utils import schema_context
-
-from apps.core.views import BaseTenantCreateView, BaseTenantListView, BaseTenantUpdateView
-from apps.caepi.models import CaEPI
+from apps.core.pagination import KeysetUnionPaginator
+from apps.core.views import (
+    BaseTenantCreateView,
+    BaseTenantEditModalView,
+    BaseTenantListView,
+    BaseTenantUpdateView,
+)
+from apps.caepi.services import anotar_status_ca, base_ca_disponivel, buscar_cas, status_cas
 from apps.fornecedores.models import Fornecedor
 from .forms import (
     FamiliaProdutoForm,
@@ -91,6 +94,7 @@ class ProdutoListView(BaseTenantListView):
     ]
     create_url_name = "produtos:create"
     update_url_name = "produtos:update"
+    lazy_edit_forms = True
 
     def get(self, request, *args, **kwargs):
         if request.headers.get("X-Requested-With") != "XMLHttpRequest":
@@ -102,14 +106,6 @@ class ProdutoListView(BaseTenantListView):
             {"object_list": context.get("object_list", []), "headers": self.headers},
             request=request,
         )
-        modals_html = render_to_string(
-            "produtos/_produto_modals.html",
-            {
-                "edit_rows": context.get("edit_rows", []),
-                "grades_disponiveis": context.get("grades_disponiveis"),
-            },
-            request=request,
-        )
         pagination_html = render_to_string(
             "components/_pagination.html",
             {"page_obj": context.get("page_obj")},
@@ -119,7 +115,6 @@ class ProdutoListView(BaseTenantListView):
             {
                 "ok": True,
                 "rows_html": rows_html,
-                "modals_html": modals_html,
                 "pagination_html": pagination_html,
             }
         )
@@ -136,40 +131,53 @@ class ProdutoListView(BaseTenantListView):
             )
         )
 
+    def get_list_form_kwargs(self):
+        return {"tenant": self.request.tenant}
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["today"] = timezone.localdate()
+        anotar_status_ca(context.get("object_list", []))
+        context["grades_disponiveis"] = GradeProduto.objects.filter(
+            company=self.request.tenant,
+            ativo=True,
+        ).order_by("nome")
+        return context
+
+
+class ProdutoModalView(BaseTenantEditModalView):
+    model = Produto
+    form_class = ProdutoForm
+    template_name = "produtos/_produto_row_modals.html"
+    update_url_name = "produtos:update"
+    # O modal de visualizacao vem junto; o de edicao so e renderizado com change_produto.
+    permission_action = "view"
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs["tenant"] = self.request.tenant
+        return kwargs
+
+    def get_modal_context(self):
+        context = super().get_modal_context()
         context["grades_disponiveis"] = GradeProduto.objects.filter(
             company=self.request.tenant,
             ativo=True,
         ).order_by("nome")
-        if context.get("can_add"):
-            context["create_form"] = ProdutoForm(tenant=self.request.tenant)
-        else:
-            context["create_form"] = None
-        if context.get("can_change"):
-            context["edit_rows"] = [
-                {
-                    "object": obj,
-                    "form": ProdutoForm(instance=obj, tenant=self.request.tenant),
-                    "update_url": reverse_lazy(self.update_url_name, args=[obj.pk]),
-                }
-                for obj in context.get("object_list", [])
-            ]
-        else:
-            context["edit_rows"] = []
         return context
 
 
 class ProdutoFornecedorAnexoMixin:
     def _get_annotated_produto(self, produto_id):
-        return (
+        produto = (
             Produto.objects.filter(pk=produto_id)
             .annotate(
                 valor_medio=Avg("fornecedores_rel__valor"),
             )
             .get()
         )
+        anotar_status_ca([produto])
+        return produto
 
     def _parse_indexed_data(self, prefix, data):
         pattern = re.compile(rf"^{re.escape(prefix)}\[(\d+)\]\[([^\]]+)\]$")
@@ -1893,16 +1901,21 @@ class ProdutoToggleActiveView(PermissionRequiredMixin, ProdutoFornecedorAnexoMix
 
 
 class ProdutoHistoricoListView(View):
+    descricao_map = {
+        "produto_criado": "Produto criado.",
+        "produto_atualizado": "Produto atualizado.",
+        "produto_ativado": "Produto ativado.",
+        "produto_desativado": "Produto desativado.",
+        "produto_ca_reconciliado": "Validade/situacao do CA atualizada pela base oficial.",
+    }
+    descricao_padrao = "Alteracao registrada."
+
     def get(self, request, pk):
         produto = get_object_or_404(Produto, pk=pk, company=request.tenant)
-        movimentos = (
-            MovimentacaoEstoque.objects.filter(
-                company=request.tenant,
-                estoque__produto=produto,
-            )
-            .select_related("estoque__deposito", "deposito_destino", "created_by")
-            .order_by("-criado_em")
-        )
+        movimentos = MovimentacaoEstoque.objects.filter(
+            company=request.tenant,
+            estoque__produto=produto,
+        ).select_related("estoque__deposito", "deposito_destino", "created_by")
         logs = ActionLog.objects.filter(
             company=request.tenant,
             reference=f"Produto:{produto.pk}",
@@ -1913,6 +1926,13 @@ class ProdutoHistoricoListView(View):
         tipo = request.GET.get("tipo")
         if descricao:
             movimentos = movimentos.filter(observacao__icontains=descricao)
+            # O texto exibido dos logs vem de descricao_map; o filtro vira um filtro por action.
+            termo = descricao.lower()
+            actions = [action for action, texto in self.descricao_map.items() if termo in texto.lower()]
+            filtro_logs = Q(action__in=actions)
+            if termo in self.descricao_padrao.lower():
+                filtro_logs |= ~Q(action__in=list(self.descricao_map))
+            logs = logs.filter(filtro_logs)
         if data_inicio:
             movimentos = movimentos.filter(criado_em__date__gte=data_inicio)
             logs = logs.filter(created_at__date__gte=data_inicio)
@@ -1923,63 +1943,10 @@ class ProdutoHistoricoListView(View):
             movimentos = movimentos.filter(tipo=tipo)
             logs = logs.none()
 
-        registros = []
-        for movimento in movimentos:
-            if movimento.tipo == "entrada":
-                descricao_mov = (
-                    f"Entrada de {movimento.quantidade} no deposito {movimento.estoque.deposito}"
-                )
-            elif movimento.tipo == "saida":
-                descricao_mov = (
-                    f"Saida de {movimento.quantidade} do deposito {movimento.estoque.deposito}"
-                )
-            else:
-                descricao_mov = (
-                    f"Transferencia de {movimento.quantidade} do deposito "
-                    f"{movimento.estoque.deposito} para {movimento.deposito_destino or '-'}"
-                )
-            if movimento.observacao:
-                descricao_mov = f"{descricao_mov} ({movimento.observacao})"
-            registros.append(
-                {
-                    "descricao": descricao_mov,
-                    "usuario": movimento.created_by,
-                    "horario": movimento.criado_em,
-                }
-            )
-
-        descricao_map = {
-            "produto_criado": "Produto criado.",
-            "produto_atualizado": "Produto atualizado.",
-            "produto_ativado": "Produto ativado.",
-            "produto_desativado": "Produto desativado.",
-        }
-        for log in logs:
-            descricao_log = descricao_map.get(log.action, "Alteracao registrada.")
-            if descricao and descricao.lower() not in descricao_log.lower():
-                continue
-            registros.append(
-                {
-                    "descricao": descricao_log,
-                    "usuario": log.actor,
-                    "horario": log.created_at,
-                }
-            )
-
-        registros.sort(key=lambda item: item["horario"], reverse=True)
-
-        paginator = Paginator(registros, 10)
-        page = request.GET.get("page") or 1
-        try:
-            page_number = int(page)
-        except (TypeError, ValueError):
-            page_number = 1
-        if page_number < 1:
-            page_number = 1
-        try:
-            page_obj = paginator.page(page_number)
-        except InvalidPage:
-            page_obj = paginator.page(1)
+        # Movimentacoes e logs sao paginados juntos por (horario, fonte, id), sem carregar o historico inteiro.
+        paginator = KeysetUnionPaginator([(movimentos, "criado_em"), (logs, "created_at")], 10)
+        page_obj = paginator.page(request.GET.get("cursor"))
+        page_obj.object_list = [self._registro(item) for item in page_obj.object_list]
         rows_html = render_to_string(
             "produtos/_historico_rows.html",
             {"registros": page_obj.object_list},
@@ -2000,6 +1967,30 @@ class ProdutoHistoricoListView(View):
             )
         return HttpResponseRedirect(reverse("produtos:list"))
 
+    def _registro(self, item):
+        if isinstance(item, ActionLog):
+            return {
+                "descricao": self.descricao_map.get(item.action, self.descricao_padrao),
+                "usuario": item.actor,
+                "horario": item.created_at,
+            }
+        if item.tipo == "entrada":
+            descricao = f"Entrada de {item.quantidade} no deposito {item.estoque.deposito}"
+        elif item.tipo == "saida":
+            descricao = f"Saida de {item.quantidade} do deposito {item.estoque.deposito}"
+        else:
+            descricao = (
+                f"Transferencia de {item.quantidade} do deposito "
+                f"{item.estoque.deposito} para {item.deposito_destino or '-'}"
+            )
+        if item.observacao:
+            descricao = f"{descricao} ({item.observacao})"
+        return {
+            "descricao": descricao,
+            "usuario": item.created_by,
+            "horario": item.criado_em,
+        }
+
 
 def _caepi_to_dict(item):
     return {
@@ -2031,26 +2022,20 @@ def _get_caepi_status(registro_ca):
     if not registro_ca:
         return {"status": "empty", "found": False}
 
-    today = timezone.localdate()
-    with schema_context("public"):
-        caepi = (
-            CaEPI.objects.filter(registro_ca=registro_ca)
-            .order_by("-data_validade", "-ultima_atualizacao")
-            .first()
+    oficial = status_cas([registro_ca], usar_cache=False)[registro_ca]
+    result = {"status": oficial["status"], "found": oficial["found"]}
+    if oficial["status"] in ("valid", "expired"):
+        data_validade = oficial["data_validade"]
+        result.update(
+            {
+                "data_validade": data_validade,
+                "data_validade_display": data_validade.strftime("%d/%m/%Y"),
+                "expired": oficial["status"] == "expired",
+            }
         )
-    if not caepi:
-        return {"status": "not_found", "found": False}
-    if not caepi.data_validade:
-        return {"status": "unknown", "found": True, "data_validade": None}
-
-    expired = caepi.data_validade < today
-    return {
-        "status": "expired" if expired else "valid",
-        "found": True,
-        "data_validade": caepi.data_validade,
-        "data_validade_display": caepi.data_validade.strftime("%d/%m/%Y"),
-        "expired": expired,
-    }
+    elif oficial["status"] == "unknown":
+        result["data_validade"] = None
+    return result
 
 
 class CaStatusApiView(PermissionRequiredMixin, View):
@@ -2071,41 +2056,15 @@ class CaStatusApiView(PermissionRequiredMixin, View):
 def _query_caepi(ca, descricao, fabricante, somente_validos, offset, limit):
     results = []
     selected = None
-    data_found = False
     has_more = False
     next_offset = offset + limit
 
-    today = timezone.localdate()
-    with schema_context("public"):
-        queryset = CaEPI.objects.all()
-        data_found = queryset.exists()
-        if somente_validos:
-            queryset = queryset.filter(data_validade__gte=today)
-        if ca:
-            queryset = queryset.filter(registro_ca=ca)
-        else:
-            if descricao:
-                queryset = queryset.filter(
-                    Q(descricao_equipamento__icontains=descricao)
-                    | Q(nome_equipamento__icontains=descricao)
-                )
-            if fabricante:
-                queryset = queryset.filter(razao_social__icontains=fabricante)
-
-        # Evita repeticao de um mesmo CA quando ha registros duplicados na base
-        queryset = queryset.order_by("registro_ca", "-data_validade").distinct("registro_ca")
-        if ca:
-            items = list(queryset[:limit])
-            results = [_caepi_to_dict(item) for item in items]
-            if results:
-                selected = results[0]
-            has_more = False
-        else:
-            if descricao or fabricante:
-                items = list(queryset[offset : offset + limit + 1])
-                has_more = len(items) > limit
-                items = items[:limit]
-                results = [_caepi_to_dict(item) for item in items]
+    data_found = base_ca_disponivel()
+    if ca or descricao or fabricante:
+        items, has_more = buscar_cas(ca, descricao, fabricante, somente_validos, offset, limit)
+        results = [_caepi_to_dict(item) for item in items]
+        if ca and results:
+            selected = results[0]
 
     return data_found, results, selected, has_more, next_offset
 
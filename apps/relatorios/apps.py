@@ -5,3 +5,6 @@ class RelatoriosConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "apps.relatorios"
     verbose_name = "Relatorios"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,57 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django_tenants.utils import schema_context
+
+from apps.relatorios.models import FatoEntregaDiaria
+from apps.relatorios.services import reconstruir_fatos_entrega, reconstruir_fatos_estoque
+from apps.tenants.models import Company
+
+
+class Command(BaseCommand):
+    help = (
+        "Recria as tabelas de fatos diarios dos relatorios (entregas e saldos de estoque) "
+        "a partir de Entrega e MovimentacaoEstoque."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--schema", help="Processa apenas o tenant informado.")
+        parser.add_argument(
+            "--desde",
+            help="Recria os fatos de entrega a partir desta data (AAAA-MM-DD). Os saldos sao sempre recriados.",
+        )
+        parser.add_argument("--sem-estoque", action="store_true", help="Nao recria os saldos diarios de estoque.")
+
+    def handle(self, *args, **options):
+        desde = None
+        if options.get("desde"):
+            try:
+                desde = date.fromisoformat(options["desde"])
+            except ValueError:
+                raise CommandError("Data invalida em --desde. Use AAAA-MM-DD.")
+
+        tenants = Company.objects.exclude(schema_name="public").order_by("schema_name")
+        if options.get("schema"):
+            tenants = tenants.filter(schema_name=options["schema"])
+            if not tenants.exists():
+                raise CommandError(f"Tenant '{options['schema']}' nao encontrado.")
+
+        for tenant in tenants:
+            with schema_context(tenant.schema_name):
+                self._process_tenant(tenant, desde, options.get("sem_estoque", False))
+
+        self.stdout.write(self.style.SUCCESS("Fatos dos relatorios recriados."))
+
+    def _process_tenant(self, tenant, desde, sem_estoque):
+        if FatoEntregaDiaria._meta.db_table not in set(connection.introspection.table_names()):
+            self.stdout.write(self.style.WARNING(f"[{tenant.schema_name}] tabelas de fatos ausentes, pulei."))
+            return
+        started = time.perf_counter()
+        entregas = reconstruir_fatos_entrega(tenant.pk, desde)
+        estoque = 0 if sem_estoque else reconstruir_fatos_estoque(tenant.pk)
+        elapsed = (time.perf_counter() - started) * 1000
+        self.stdout.write(
+            f"[{tenant.schema_name}] fatos_entrega={entregas} fatos_estoque={estoque} tempo={elapsed:.0f}ms"
+        )
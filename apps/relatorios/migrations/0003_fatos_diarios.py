@@ -0,0 +1,223 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def preencher_fatos(apps, schema_editor):
+    # Mesmo calculo de reconstruir_fatos_entrega/reconstruir_fatos_estoque, com as
+    # tabelas historicas e todos os tenants do schema de uma vez.
+    def tabela(app_label, model_name):
+        return apps.get_model(app_label, model_name)._meta.db_table
+
+    entrega = tabela("entregas", "Entrega")
+    funcionario = tabela("funcionarios", "Funcionario")
+    estoque = tabela("estoque", "Estoque")
+    movimentacao = tabela("estoque", "MovimentacaoEstoque")
+    deposito = tabela("depositos", "Deposito")
+    fuso = timezone.get_current_timezone_name()
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {tabela("relatorios", "FatoEntregaDiaria")}
+                (company_id, dia, status, produto_id, planta_id, setor_id, entregas, quantidade)
+            SELECT e.company_id, (e.created_at AT TIME ZONE %s)::date, e.status, e.produto_id,
+                   f.planta_id, f.setor_id, count(*), coalesce(sum(e.quantidade), 0)
+            FROM {entrega} AS e
+            JOIN {funcionario} AS f ON f.id = e.funcionario_id
+            GROUP BY 1, 2, 3, 4, 5, 6
+            """,
+            [fuso],
+        )
+        cursor.execute(
+            f"""
+            INSERT INTO {tabela("relatorios", "FatoEntregaFuncionarioDiaria")}
+                (company_id, dia, status, funcionario_id, planta_id, entregas, quantidade)
+            SELECT e.company_id, (e.created_at AT TIME ZONE %s)::date, e.status, e.funcionario_id,
+                   f.planta_id, count(*), coalesce(sum(e.quantidade), 0)
+            FROM {entrega} AS e
+            JOIN {funcionario} AS f ON f.id = e.funcionario_id
+            GROUP BY 1, 2, 3, 4, 5
+            """,
+            [fuso],
+        )
+        cursor.execute(
+            f"""
+            WITH variacoes AS (
+                SELECT m.estoque_id, (m.criado_em AT TIME ZONE %s)::date AS dia,
+                       CASE WHEN m.tipo = 'entrada' THEN m.quantidade ELSE -m.quantidade END AS delta
+                FROM {movimentacao} AS m
+                UNION ALL
+                SELECT destino.id, (m.criado_em AT TIME ZONE %s)::date, m.quantidade
+                FROM {movimentacao} AS m
+                JOIN {estoque} AS origem ON origem.id = m.estoque_id
+                JOIN {estoque} AS destino
+                  ON destino.produto_id = origem.produto_id
+                 AND destino.grade = origem.grade
+                 AND destino.deposito_id = m.deposito_destino_id
+                WHERE m.tipo = 'transferencia'
+            ),
+            por_dia AS (
+                SELECT estoque_id, dia, sum(delta) AS delta FROM variacoes GROUP BY estoque_id, dia
+            )
+            INSERT INTO {tabela("relatorios", "FatoEstoqueDiario")}
+                (company_id, dia, estoque_id, produto_id, planta_id, quantidade)
+            SELECT
+                e.company_id, por_dia.dia, e.id, e.produto_id, d.planta_id,
+                e.quantidade - coalesce(
+                    sum(por_dia.delta) OVER (
+                        PARTITION BY por_dia.estoque_id ORDER BY por_dia.dia DESC
+                        ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+                    ),
+                    0
+                )
+            FROM por_dia
+            JOIN {estoque} AS e ON e.id = por_dia.estoque_id
+            JOIN {deposito} AS d ON d.id = e.deposito_id
+            """,
+            [fuso, fuso],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tenants", "0002_company_estoque_enabled"),
+        ("produtos", "0040_produto_situacao_ca"),
+        ("funcionarios", "0025_alter_funcionario_validacao_recebimento"),
+        ("setores", "0004_setor_responsaveis"),
+        ("entregas", "0012_devolucaoitem_volta_para_estoque"),
+        ("estoque", "0006_movimentacaoestoque_saldo_anterior_and_more"),
+        ("relatorios", "0002_alter_relatorio_company_alter_relatorio_created_by_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FatoEntregaDiaria",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("dia", models.DateField()),
+                ("status", models.CharField(max_length=20)),
+                ("entregas", models.PositiveIntegerField(default=0)),
+                ("quantidade", models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                (
+                    "company",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="+", to="tenants.company"
+                    ),
+                ),
+                (
+                    "planta",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="funcionarios.planta",
+                    ),
+                ),
+                (
+                    "produto",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="+", to="produtos.produto"
+                    ),
+                ),
+                (
+                    "setor",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="setores.setor",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["company", "dia"], name="fato_entrega_company_dia"),
+                    models.Index(fields=["produto", "dia"], name="fato_entrega_produto_dia"),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="FatoEntregaFuncionarioDiaria",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("dia", models.DateField()),
+                ("status", models.CharField(max_length=20)),
+                ("entregas", models.PositiveIntegerField(default=0)),
+                ("quantidade", models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                (
+                    "company",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="+", to="tenants.company"
+                    ),
+                ),
+                (
+                    "funcionario",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="+", to="funcionarios.funcionario"
+                    ),
+                ),
+                (
+                    "planta",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="funcionarios.planta",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["company", "dia"], name="fato_ent_func_company_dia"),
+                    models.Index(fields=["funcionario", "dia"], name="fato_ent_func_funcionario_dia"),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="FatoEstoqueDiario",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("dia", models.DateField()),
+                ("quantidade", models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                (
+                    "company",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="+", to="tenants.company"
+                    ),
+                ),
+                (
+                    "estoque",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="+", to="estoque.estoque"
+                    ),
+                ),
+                (
+                    "planta",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="funcionarios.planta",
+                    ),
+                ),
+                (
+                    "produto",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="+", to="produtos.produto"
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [models.Index(fields=["company", "dia"], name="fato_estoque_company_dia")],
+                "constraints": [
+                    models.UniqueConstraint(fields=("estoque", "dia"), name="relatorios_fato_estoque_dia_uniq")
+                ],
+            },
+        ),
+        migrations.RunPython(preencher_fatos, migrations.RunPython.noop),
+    ]
@@ -13,3 +13,74 @@ class Relatorio(TenantModel):
 
     def __str__(self):
         return self.nome
+
+
+# Tabelas de fatos diarios lidas pelos widgets de RelatorioDetailView. Sao
+# mantidas pelos sinais de apps/relatorios/signals.py e recriadas pelo comando
+# relatorios_reconstruir_fatos; planta e setor sao os do funcionario no momento
+# em que a linha foi calculada.
+class FatoEntregaDiaria(models.Model):
+    company = models.ForeignKey("tenants.Company", on_delete=models.CASCADE, related_name="+")
+    dia = models.DateField()
+    status = models.CharField(max_length=20)
+    produto = models.ForeignKey("produtos.Produto", on_delete=models.CASCADE, related_name="+")
+    planta = models.ForeignKey(
+        "funcionarios.Planta", on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    setor = models.ForeignKey("setores.Setor", on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    entregas = models.PositiveIntegerField(default=0)
+    quantidade = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["company", "dia"], name="fato_entrega_company_dia"),
+            models.Index(fields=["produto", "dia"], name="fato_entrega_produto_dia"),
+        ]
+
+    def __str__(self):
+        return f"{self.dia} - {self.produto_id} ({self.status})"
+
+
+class FatoEntregaFuncionarioDiaria(models.Model):
+    company = models.ForeignKey("tenants.Company", on_delete=models.CASCADE, related_name="+")
+    dia = models.DateField()
+    status = models.CharField(max_length=20)
+    funcionario = models.ForeignKey("funcionarios.Funcionario", on_delete=models.CASCADE, related_name="+")
+    planta = models.ForeignKey(
+        "funcionarios.Planta", on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    entregas = models.PositiveIntegerField(default=0)
+    quantidade = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["company", "dia"], name="fato_ent_func_company_dia"),
+            models.Index(fields=["funcionario", "dia"], name="fato_ent_func_funcionario_dia"),
+        ]
+
+    def __str__(self):
+        return f"{self.dia} - {self.funcionario_id} ({self.status})"
+
+
+class FatoEstoqueDiario(models.Model):
+    """Saldo de cada estoque no fim dos dias em que ele teve movimentacao."""
+
+    company = models.ForeignKey("tenants.Company", on_delete=models.CASCADE, related_name="+")
+    dia = models.DateField()
+    estoque = models.ForeignKey("estoque.Estoque", on_delete=models.CASCADE, related_name="+")
+    produto = models.ForeignKey("produtos.Produto", on_delete=models.CASCADE, related_name="+")
+    planta = models.ForeignKey(
+        "funcionarios.Planta", on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    quantidade = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["estoque", "dia"], name="relatorios_fato_estoque_dia_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["company", "dia"], name="fato_estoque_company_dia"),
+        ]
+
+    def __str__(self):
+        return f"{self.dia} - {self.estoque_id}"
@@ -0,0 +1,229 @@
+import hashlib
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from apps.depositos.models import Deposito
+from apps.entregas.models import Entrega
+from apps.estoque.models import Estoque, MovimentacaoEstoque
+from .models import FatoEntregaDiaria, FatoEntregaFuncionarioDiaria, FatoEstoqueDiario
+
+LOTE_FATOS = 1000
+
+
+def _widgets_versao_key(company_id):
+    return f"relatorios:widgets:{company_id}:versao"
+
+
+def versao_widgets(company_id):
+    key = _widgets_versao_key(company_id)
+    versao = cache.get(key)
+    if versao is None:
+        versao = 1
+        cache.add(key, versao, None)
+    return versao
+
+
+def invalidar_widgets(company_id):
+    """Troca a versao dos widgets do tenant: os payloads em cache deixam de ser lidos."""
+    if not company_id:
+        return
+    key = _widgets_versao_key(company_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+
+
+def _lock_fato(*partes, compartilhado=False):
+    # Serializa recalculos concorrentes da mesma celula ate o commit; sem isso
+    # duas transacoes podem apagar e reinserir a mesma celula em paralelo.
+    chave = ":".join(str(parte) for parte in (getattr(connection, "schema_name", "public"),) + partes)
+    numero = int(hashlib.md5(chave.encode("utf-8")).hexdigest()[:15], 16)
+    funcao = "pg_advisory_xact_lock_shared" if compartilhado else "pg_advisory_xact_lock"
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {funcao}(%s)", [numero])
+
+
+def _linhas_entrega(queryset, dimensoes):
+    return (
+        queryset.annotate(dia=TruncDate("created_at"))
+        .values("company_id", "dia", "status", *dimensoes)
+        .annotate(total_entregas=Count("id"), total_quantidade=Sum("quantidade"))
+        .order_by()
+    )
+
+
+def _fatos_produto(queryset):
+    linhas = _linhas_entrega(
+        queryset.annotate(planta_ref=F("funcionario__planta_id"), setor_ref=F("funcionario__setor_id")),
+        ["produto_id", "planta_ref", "setor_ref"],
+    )
+    for linha in linhas.iterator(chunk_size=LOTE_FATOS):
+        yield FatoEntregaDiaria(
+            company_id=linha["company_id"],
+            dia=linha["dia"],
+            status=linha["status"],
+            produto_id=linha["produto_id"],
+            planta_id=linha["planta_ref"],
+            setor_id=linha["setor_ref"],
+            entregas=linha["total_entregas"],
+            quantidade=linha["total_quantidade"] or 0,
+        )
+
+
+def _fatos_funcionario(queryset):
+    linhas = _linhas_entrega(
+        queryset.annotate(planta_ref=F("funcionario__planta_id")),
+        ["funcionario_id", "planta_ref"],
+    )
+    for linha in linhas.iterator(chunk_size=LOTE_FATOS):
+        yield FatoEntregaFuncionarioDiaria(
+            company_id=linha["company_id"],
+            dia=linha["dia"],
+            status=linha["status"],
+            funcionario_id=linha["funcionario_id"],
+            planta_id=linha["planta_ref"],
+            entregas=linha["total_entregas"],
+            quantidade=linha["total_quantidade"] or 0,
+        )
+
+
+def _gravar_em_lotes(model, objetos):
+    total = 0
+    lote = []
+    for objeto in objetos:
+        lote.append(objeto)
+        if len(lote) >= LOTE_FATOS:
+            model.objects.bulk_create(lote)
+            total += len(lote)
+            lote = []
+    if lote:
+        model.objects.bulk_create(lote)
+        total += len(lote)
+    return total
+
+
+def recalcular_fatos_entrega(company_id, dia, produto_id, funcionario_id):
+    """
+    Recalcula as celulas (dia, produto) e (dia, funcionario) dos fatos de entrega
+    a partir das entregas do dia. O custo depende so das entregas daquele dia,
+    produto e funcionario.
+    """
+    with transaction.atomic():
+        # Compartilhado com outros recalculos; exclusivo na reconstrucao do tenant.
+        _lock_fato("entrega-reconstrucao", company_id, compartilhado=True)
+        _lock_fato("entrega-produto", company_id, dia, produto_id)
+        _lock_fato("entrega-funcionario", company_id, dia, funcionario_id)
+        entregas = Entrega.objects.filter(company_id=company_id, created_at__date=dia)
+        FatoEntregaDiaria.objects.filter(company_id=company_id, dia=dia, produto_id=produto_id).delete()
+        _gravar_em_lotes(FatoEntregaDiaria, _fatos_produto(entregas.filter(produto_id=produto_id)))
+        FatoEntregaFuncionarioDiaria.objects.filter(
+            company_id=company_id, dia=dia, funcionario_id=funcionario_id
+        ).delete()
+        _gravar_em_lotes(
+            FatoEntregaFuncionarioDiaria, _fatos_funcionario(entregas.filter(funcionario_id=funcionario_id))
+        )
+    invalidar_widgets(company_id)
+
+
+def registrar_saldos_estoque(saldos, dia=None):
+    """
+    Grava o saldo final do dia de cada estoque em {estoque_id: quantidade}, com um
+    unico INSERT ... ON CONFLICT. Chamado na mesma transacao que alterou os saldos.
+    """
+    if not saldos:
+        return
+    dia = dia or timezone.localdate()
+    ids = list(saldos)
+    fato = FatoEstoqueDiario._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {fato} (company_id, dia, estoque_id, produto_id, planta_id, quantidade)
+            SELECT e.company_id, %s, e.id, e.produto_id, d.planta_id, v.quantidade
+            FROM unnest(%s::bigint[], %s::numeric[]) AS v(estoque_id, quantidade)
+            JOIN {Estoque._meta.db_table} AS e ON e.id = v.estoque_id
+            JOIN {Deposito._meta.db_table} AS d ON d.id = e.deposito_id
+            ON CONFLICT (estoque_id, dia) DO UPDATE SET quantidade = EXCLUDED.quantidade
+            """,
+            [dia, ids, [saldos[pk] for pk in ids]],
+        )
+
+
+def reconstruir_fatos_entrega(company_id, desde=None):
+    """
+    Recria os fatos de entrega do tenant (a partir de desde, se informado).
+    Retorna a quantidade de linhas gravadas em FatoEntregaDiaria.
+    """
+    entregas = Entrega.objects.filter(company_id=company_id)
+    fatos_produto = FatoEntregaDiaria.objects.filter(company_id=company_id)
+    fatos_funcionario = FatoEntregaFuncionarioDiaria.objects.filter(company_id=company_id)
+    if desde:
+        entregas = entregas.filter(created_at__date__gte=desde)
+        fatos_produto = fatos_produto.filter(dia__gte=desde)
+        fatos_funcionario = fatos_funcionario.filter(dia__gte=desde)
+    with transaction.atomic():
+        _lock_fato("entrega-reconstrucao", company_id)
+        fatos_produto.delete()
+        fatos_funcionario.delete()
+        total = _gravar_em_lotes(FatoEntregaDiaria, _fatos_produto(entregas))
+        _gravar_em_lotes(FatoEntregaFuncionarioDiaria, _fatos_funcionario(entregas))
+    invalidar_widgets(company_id)
+    return total
+
+
+def reconstruir_fatos_estoque(company_id):
+    """
+    Recria os saldos diarios do tenant a partir das movimentacoes: o saldo no fim
+    de cada dia e o saldo atual menos as variacoes dos dias seguintes (entradas,
+    saidas e transferencias recebidas). Retorna a quantidade de linhas gravadas.
+    """
+    estoque = Estoque._meta.db_table
+    movimentacao = MovimentacaoEstoque._meta.db_table
+    fato = FatoEstoqueDiario._meta.db_table
+    fuso = timezone.get_current_timezone_name()
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {fato} WHERE company_id = %s", [company_id])
+        cursor.execute(
+            f"""
+            WITH variacoes AS (
+                SELECT m.estoque_id, (m.criado_em AT TIME ZONE %s)::date AS dia,
+                       CASE WHEN m.tipo = 'entrada' THEN m.quantidade ELSE -m.quantidade END AS delta
+                FROM {movimentacao} AS m
+                WHERE m.company_id = %s
+                UNION ALL
+                SELECT destino.id, (m.criado_em AT TIME ZONE %s)::date, m.quantidade
+                FROM {movimentacao} AS m
+                JOIN {estoque} AS origem ON origem.id = m.estoque_id
+                JOIN {estoque} AS destino
+                  ON destino.produto_id = origem.produto_id
+                 AND destino.grade = origem.grade
+                 AND destino.deposito_id = m.deposito_destino_id
+                WHERE m.company_id = %s AND m.tipo = 'transferencia'
+            ),
+            por_dia AS (
+                SELECT estoque_id, dia, sum(delta) AS delta FROM variacoes GROUP BY estoque_id, dia
+            )
+            INSERT INTO {fato} (company_id, dia, estoque_id, produto_id, planta_id, quantidade)
+            SELECT
+                e.company_id, por_dia.dia, e.id, e.produto_id, d.planta_id,
+                e.quantidade - coalesce(
+                    sum(por_dia.delta) OVER (
+                        PARTITION BY por_dia.estoque_id ORDER BY por_dia.dia DESC
+                        ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+                    ),
+                    0
+                )
+            FROM por_dia
+            JOIN {estoque} AS e ON e.id = por_dia.estoque_id
+            JOIN {Deposito._meta.db_table} AS d ON d.id = e.deposito_id
+            """,
+            [fuso, company_id, fuso, company_id],
+        )
+        total = cursor.rowcount
+    invalidar_widgets(company_id)
+    return total
@@ -0,0 +1,70 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from apps.entregas.models import Entrega
+from apps.estoque.signals import saldos_alterados
+from .services import invalidar_widgets, recalcular_fatos_entrega, registrar_saldos_estoque
+
+# Campos de Entrega que mudam alguma celula dos fatos diarios.
+CAMPOS_FATO_ENTREGA = {"status", "quantidade", "produto", "funcionario", "created_at"}
+
+
+def _chave_fato(company_id, created_at, produto_id, funcionario_id):
+    return (company_id, timezone.localdate(created_at), produto_id, funcionario_id)
+
+
+def _recalcular_no_commit(chaves):
+    # Depois do commit o recalculo ve a entrega gravada (e nao a deixa no fato se
+    # a transacao for desfeita).
+    for chave in chaves:
+        transaction.on_commit(lambda chave=chave: recalcular_fatos_entrega(*chave))
+
+
+def _altera_fato(update_fields):
+    return update_fields is None or bool(CAMPOS_FATO_ENTREGA & set(update_fields))
+
+
+@receiver(pre_save, sender=Entrega)
+def guardar_chave_fato_entrega(sender, instance, update_fields=None, **kwargs):
+    instance._chave_fato_anterior = None
+    if instance.pk is None or not _altera_fato(update_fields):
+        return
+    anterior = (
+        Entrega.objects.filter(pk=instance.pk)
+        .values_list("company_id", "created_at", "produto_id", "funcionario_id")
+        .first()
+    )
+    if anterior:
+        instance._chave_fato_anterior = _chave_fato(*anterior)
+
+
+@receiver(post_save, sender=Entrega)
+def atualizar_fatos_entrega(sender, instance, update_fields=None, **kwargs):
+    if not instance.company_id or not _altera_fato(update_fields):
+        return
+    chaves = {
+        _chave_fato(instance.company_id, instance.created_at, instance.produto_id, instance.funcionario_id)
+    }
+    if getattr(instance, "_chave_fato_anterior", None):
+        chaves.add(instance._chave_fato_anterior)
+    _recalcular_no_commit(chaves)
+
+
+@receiver(post_delete, sender=Entrega)
+def remover_fatos_entrega(sender, instance, **kwargs):
+    if not instance.company_id:
+        return
+    _recalcular_no_commit(
+        {_chave_fato(instance.company_id, instance.created_at, instance.produto_id, instance.funcionario_id)}
+    )
+
+
+@receiver(saldos_alterados)
+def atualizar_fatos_estoque(sender, saldos=None, company_ids=(), **kwargs):
+    registrar_saldos_estoque(saldos or {})
+    for company_id in company_ids:
+        # Invalida ja e de novo no commit, como nos demais caches por versao.
+        invalidar_widgets(company_id)
+        transaction.on_commit(lambda company_id=company_id: invalidar_widgets(company_id))
@@ -10,4 +10,5 @@ urlpatterns = [
     path("relatorios/<int:pk>/editar/", views.RelatorioUpdateView.as_view(), name="update"),
     path("relatorios/<int:pk>/excluir/", views.RelatorioDeleteView.as_view(), name="delete"),
     path("relatorios/<int:pk>/", views.RelatorioDetailView.as_view(), name="detail"),
+    path("relatorios/<int:pk>/widgets/", views.RelatorioWidgetsView.as_view(), name="widgets"),
 ]
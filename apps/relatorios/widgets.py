@@ -0,0 +1,514 @@
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections
+from django.db.models import Count, Exists, F, OuterRef, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.utils import timezone
+from django_tenants.utils import schema_context
+
+from apps.entregas.models import Entrega
+from apps.estoque.models import Estoque
+from .models import FatoEntregaDiaria, FatoEntregaFuncionarioDiaria, FatoEstoqueDiario
+from .services import versao_widgets
+
+WIDGET_CACHE_TIMEOUT = 300
+WIDGET_WORKERS = 4
+METRICAS_ENTREGA = {
+    "entregas_realizadas",
+    "entregas_pendentes",
+    "entregas_canceladas",
+    "entregas_por_dia",
+    "entregas_pendentes_por_dia",
+    "entregas_canceladas_por_dia",
+}
+SERIE_VAZIA = {"labels": [], "values": []}
+
+PERIOD_CHOICES = [
+    ("today", "Hoje"),
+    ("week", "Esta semana"),
+    ("last7", "Ultimos 7 dias"),
+    ("month", "Este mes"),
+    ("last30", "Ultimos 30 dias"),
+    ("year", "Este ano"),
+    ("custom", "Personalizado"),
+]
+PERIOD_LABELS = dict(PERIOD_CHOICES)
+
+
+def _period_range(period_key, now=None):
+    now = now or timezone.localtime()
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period_key == "week":
+        start = today_start - timedelta(days=today_start.weekday())
+    elif period_key == "last7":
+        start = today_start - timedelta(days=6)
+    elif period_key == "month":
+        start = today_start.replace(day=1)
+    elif period_key == "last30":
+        start = today_start - timedelta(days=29)
+    elif period_key == "year":
+        start = today_start.replace(month=1, day=1)
+    else:
+        start = today_start
+    return start, now
+
+
+def _custom_range(start_value, end_value):
+    if not start_value or not end_value:
+        return None
+    try:
+        start_date = date.fromisoformat(str(start_value))
+        end_date = date.fromisoformat(str(end_value))
+    except ValueError:
+        return None
+    if end_date < start_date:
+        return None
+    tz = timezone.get_current_timezone()
+    start_dt = timezone.make_aware(datetime.combine(start_date, time.min), tz)
+    end_dt = timezone.make_aware(datetime.combine(end_date, time.max), tz)
+    return start_dt, end_dt
+
+
+def _format_dt(value):
+    if not value:
+        return "-"
+    return timezone.localtime(value).strftime("%d/%m/%Y %H:%M")
+
+
+def _date_series(start, end):
+    current = start.date()
+    end_date = end.date()
+    labels = []
+    while current <= end_date:
+        labels.append(current.strftime("%d/%m"))
+        current += timedelta(days=1)
+    return labels
+
+
+def _build_series(queryset, start, end):
+    labels = _date_series(start, end)
+    counts = {entry["day"]: entry["total"] for entry in queryset}
+    values = []
+    current = start.date()
+    end_date = end.date()
+    while current <= end_date:
+        values.append(int(counts.get(current, 0)))
+        current += timedelta(days=1)
+    return {"labels": labels, "values": values}
+
+
+def _bucket_range(start, end, category):
+    start_date = start.date()
+    end_date = end.date()
+    buckets = []
+    labels = []
+    if category == "semana":
+        current = start_date - timedelta(days=start_date.weekday())
+        while current <= end_date:
+            buckets.append(current)
+            labels.append(f"Sem {current.isocalendar().week}")
+            current += timedelta(days=7)
+        return buckets, labels
+    if category == "mes":
+        current = start_date.replace(day=1)
+        while current <= end_date:
+            buckets.append(current)
+            labels.append(current.strftime("%m/%Y"))
+            year = current.year + (1 if current.month == 12 else 0)
+            month = 1 if current.month == 12 else current.month + 1
+            current = current.replace(year=year, month=month)
+        return buckets, labels
+    current = start_date
+    while current <= end_date:
+        buckets.append(current)
+        labels.append(current.strftime("%d/%m"))
+        current += timedelta(days=1)
+    return buckets, labels
+
+
+def _bucket_expr(category, field_name):
+    if category == "semana":
+        return TruncWeek(field_name)
+    if category == "mes":
+        return TruncMonth(field_name)
+    return F(field_name)
+
+
+def _group_field(source, group_by):
+    if source == "estoque":
+        if group_by == "planta":
+            return "planta__nome"
+        return "produto__nome"
+    if group_by == "produto":
+        return "produto__nome"
+    if group_by == "funcionario":
+        return "funcionario__nome"
+    if group_by == "planta":
+        return "planta__nome"
+    if group_by == "setor":
+        return "setor__nome"
+    return "produto__nome"
+
+
+def _value_expr(source, value_type):
+    if value_type == "quantidade":
+        return Sum("quantidade")
+    if source == "estoque":
+        return Count("id")
+    return Sum("entregas")
+
+
+def _fatos_entrega(tenant, start, end, plant, group_by=None):
+    # Os graficos por funcionario leem a tabela por funcionario; o resto, a tabela por produto.
+    model = FatoEntregaFuncionarioDiaria if group_by == "funcionario" else FatoEntregaDiaria
+    queryset = model.objects.filter(company=tenant, dia__gte=start.date(), dia__lte=end.date())
+    if plant:
+        queryset = queryset.filter(planta_id=plant)
+    return queryset
+
+
+def _saldos_estoque(tenant, start, end, plant, category=None):
+    """
+    Saldos diarios do periodo, mantendo so o ultimo dia de cada estoque no
+    periodo (ou em cada semana/mes, com category).
+    """
+    queryset = FatoEstoqueDiario.objects.filter(company=tenant, dia__gte=start.date(), dia__lte=end.date())
+    if plant:
+        queryset = queryset.filter(planta_id=plant)
+    posteriores = FatoEstoqueDiario.objects.filter(
+        estoque_id=OuterRef("estoque_id"),
+        dia__gt=OuterRef("dia"),
+        dia__lte=end.date(),
+    )
+    if category in ("semana", "mes"):
+        queryset = queryset.annotate(saldo_bucket=_bucket_expr(category, "dia"))
+        posteriores = posteriores.annotate(saldo_bucket=_bucket_expr(category, "dia")).filter(
+            saldo_bucket=OuterRef("saldo_bucket")
+        )
+    elif category is not None:
+        # Uma linha por estoque e dia: cada linha ja e a ultima do seu bucket.
+        return queryset
+    return queryset.filter(~Exists(posteriores))
+
+
+def _limit(value):
+    try:
+        limit = int(value or 10)
+    except (TypeError, ValueError):
+        return 10
+    return limit if limit > 0 else 10
+
+
+# Consultas: cada uma recebe o tenant e os argumentos da chave (sem o nome).
+# Widgets que geram a mesma chave compartilham o resultado.
+def _consulta_resumo(tenant, start, end, plant):
+    # Uma consulta nos fatos diarios: o custo nao cresce com o numero de entregas.
+    por_status = {}
+    totais = {}
+    linhas = (
+        _fatos_entrega(tenant, start, end, plant)
+        .values("dia", "status")
+        .annotate(total=Sum("entregas"))
+        .order_by()
+    )
+    for linha in linhas:
+        por_status.setdefault(linha["status"], []).append({"day": linha["dia"], "total": linha["total"]})
+        totais[linha["status"]] = totais.get(linha["status"], 0) + linha["total"]
+    return {
+        "metric_values": {
+            "entregas_realizadas": totais.get("entregue", 0),
+            "entregas_pendentes": totais.get("aguardando", 0),
+            "entregas_canceladas": totais.get("cancelada", 0),
+        },
+        "series_map": {
+            "entregas_por_dia": _build_series(por_status.get("entregue", []), start, end),
+            "entregas_pendentes_por_dia": _build_series(por_status.get("aguardando", []), start, end),
+            "entregas_canceladas_por_dia": _build_series(por_status.get("cancelada", []), start, end),
+        },
+    }
+
+
+def _consulta_estoque_critico(tenant, plant):
+    # Estoque critico e o saldo atual: independe do periodo.
+    estoque_base = Estoque.objects.filter(
+        company=tenant,
+        produto__estoque_minimo__gt=0,
+        quantidade__lte=F("produto__estoque_minimo"),
+    )
+    if plant:
+        estoque_base = estoque_base.filter(deposito__planta_id=plant)
+    estoque_critico_count = estoque_base.count()
+    estoque_qs = []
+    if estoque_critico_count:
+        estoque_qs = (
+            estoque_base.select_related("produto")
+            .annotate(deficit=F("produto__estoque_minimo") - F("quantidade"))
+            .order_by("-deficit", "produto__nome")[:7]
+        )
+    return {
+        "count": estoque_critico_count,
+        "series": {
+            "labels": [estoque.produto.nome[:12] for estoque in estoque_qs],
+            "values": [float(estoque.quantidade) for estoque in estoque_qs],
+        },
+    }
+
+
+def _consulta_grafico(tenant, start, end, plant, source, group_by, category, value_type, chart_type, limit):
+    if source == "estoque":
+        base_qs = _saldos_estoque(tenant, start, end, plant)
+        bucket_qs = _saldos_estoque(tenant, start, end, plant, category)
+    else:
+        base_qs = bucket_qs = _fatos_entrega(tenant, start, end, plant, group_by)
+    group_field = _group_field(source, group_by)
+    value_expr = _value_expr(source, value_type)
+
+    if chart_type == "pie" or category == "mes":
+        totals = (
+            base_qs.exclude(**{f"{group_field}__isnull": True})
+            .values(group_field)
+            .annotate(total=value_expr)
+            .order_by("-total")[:limit]
+        )
+        labels = [item[group_field] for item in totals]
+        values = [float(item["total"] or 0) for item in totals]
+        if chart_type == "pie":
+            return {"labels": labels, "series": values}
+        return {"labels": labels, "series": [{"name": "Total", "data": values}]}
+
+    buckets, labels = _bucket_range(start, end, category)
+    bucket_expr = _bucket_expr(category, "dia")
+    series = []
+    top_groups = list(
+        base_qs.exclude(**{f"{group_field}__isnull": True})
+        .values(group_field)
+        .annotate(total=value_expr)
+        .order_by("-total")[:limit]
+    )
+    group_keys = [item[group_field] for item in top_groups]
+    if group_keys:
+        bucketed = (
+            bucket_qs.filter(**{f"{group_field}__in": group_keys})
+            .annotate(bucket=bucket_expr)
+            .values(group_field, "bucket")
+            .annotate(total=value_expr)
+        )
+        grouped_map = {key: {} for key in group_keys}
+        for entry in bucketed:
+            bucket_val = entry["bucket"]
+            if bucket_val is None:
+                continue
+            bucket_key = bucket_val.date() if hasattr(bucket_val, "date") else bucket_val
+            grouped_map[entry[group_field]][bucket_key] = float(entry["total"] or 0)
+        for key in group_keys:
+            series.append({"name": key, "data": [grouped_map.get(key, {}).get(bucket, 0) for bucket in buckets]})
+    return {"labels": labels, "series": series}
+
+
+def _consulta_tabela(tenant, start, end, plant, metric, limit, value_type):
+    table_headers = []
+    table_rows = []
+    base_qs = Entrega.objects.filter(company=tenant, created_at__gte=start, created_at__lte=end)
+    if plant:
+        base_qs = base_qs.filter(funcionario__planta_id=plant)
+
+    if metric == "entregas_pendentes":
+        table_headers = ["Funcionario", "Produto", "Quantidade", "Solicitada em", "Planta"]
+        rows = (
+            base_qs.filter(status="aguardando")
+            .select_related("funcionario", "produto", "funcionario__planta")
+            .order_by("-created_at")[:limit]
+        )
+        for entrega in rows:
+            table_rows.append(
+                [
+                    str(entrega.funcionario),
+                    str(entrega.produto),
+                    float(entrega.quantidade),
+                    _format_dt(entrega.created_at),
+                    str(entrega.funcionario.planta) if entrega.funcionario.planta_id else "-",
+                ]
+            )
+    elif metric == "ultimas_entregas":
+        table_headers = ["Funcionario", "Produto", "Quantidade", "Entregue em", "Planta"]
+        rows = (
+            base_qs.filter(status="entregue")
+            .select_related("funcionario", "produto", "funcionario__planta")
+            .order_by("-entregue_em", "-created_at")[:limit]
+        )
+        for entrega in rows:
+            table_rows.append(
+                [
+                    str(entrega.funcionario),
+                    str(entrega.produto),
+                    float(entrega.quantidade),
+                    _format_dt(entrega.entregue_em or entrega.created_at),
+                    str(entrega.funcionario.planta) if entrega.funcionario.planta_id else "-",
+                ]
+            )
+    elif metric == "ranking_itens":
+        table_headers = ["Produto", "Total"]
+        rows = (
+            _fatos_entrega(tenant, start, end, plant)
+            .filter(status="entregue")
+            .exclude(produto__nome__isnull=True)
+            .values("produto__nome")
+            .annotate(total=_value_expr("entregas", value_type))
+            .order_by("-total")[:limit]
+        )
+        for item in rows:
+            table_rows.append([item["produto__nome"], float(item["total"] or 0)])
+    return {"table_headers": table_headers, "table_rows": table_rows}
+
+
+CONSULTAS = {
+    "resumo": _consulta_resumo,
+    "estoque_critico": _consulta_estoque_critico,
+    "grafico": _consulta_grafico,
+    "tabela": _consulta_tabela,
+}
+
+
+def normalizar_widget(widget, plantas_map, now=None):
+    """
+    Resolve periodo, planta e intervalo do widget. Retorna (data, contexto), com
+    data = copia do widget e contexto = {"period", "plant", "start", "end"}.
+    """
+    data = dict(widget)
+    period = data.get("period") or "today"
+    if period not in PERIOD_LABELS:
+        period = "today"
+    plant = str(data.get("plant") or "").strip()
+    if plant not in plantas_map:
+        plant = ""
+    custom_range = _custom_range(data.get("start_date"), data.get("end_date")) if period == "custom" else None
+    if custom_range:
+        start, end = custom_range
+    else:
+        start, end = _period_range("today" if period == "custom" else period, now)
+    return data, {"period": period, "plant": plant, "start": start, "end": end}
+
+
+def _plano_widget(data, contexto):
+    """Chaves das consultas de que o widget precisa: {papel: chave}."""
+    start, end, plant = contexto["start"], contexto["end"], contexto["plant"]
+    tipo = data.get("type")
+    metric = data.get("metric")
+    if tipo == "grafico":
+        chave = (
+            "grafico",
+            start,
+            end,
+            plant,
+            data.get("source") or "entregas",
+            data.get("group_by") or "produto",
+            data.get("category") or "semana",
+            data.get("value_type") or "quantidade",
+            data.get("chart_type") or "line",
+            _limit(data.get("limit")),
+        )
+        return {"grafico": chave}
+    if tipo == "tabela":
+        chave = ("tabela", start, end, plant, metric, _limit(data.get("limit")), data.get("value_type") or "quantidade")
+        return {"tabela": chave}
+    if metric == "estoque_critico":
+        return {"estoque_critico": ("estoque_critico", plant)}
+    if metric in METRICAS_ENTREGA:
+        return {"resumo": ("resumo", start, end, plant)}
+    return {}
+
+
+def _montar_payload(data, contexto, plano, resultados, plantas_map):
+    metric = data.get("metric")
+    payload = {
+        "value": None,
+        "series_payload": SERIE_VAZIA,
+        "period_label": PERIOD_LABELS.get(contexto["period"], ""),
+        "plant_label": plantas_map.get(contexto["plant"], "Todas"),
+    }
+    if "resumo" in plano:
+        resumo = resultados[plano["resumo"]]
+        payload["value"] = resumo["metric_values"].get(metric)
+        payload["series_payload"] = resumo["series_map"].get(metric, SERIE_VAZIA)
+    elif "estoque_critico" in plano:
+        estoque = resultados[plano["estoque_critico"]]
+        payload["value"] = estoque["count"]
+        payload["series_payload"] = estoque["series"]
+    elif "grafico" in plano:
+        payload["series_payload"] = resultados[plano["grafico"]]
+        payload["chart_type"] = data.get("chart_type") or "line"
+        payload["show_legend"] = bool(data.get("show_legend"))
+    elif "tabela" in plano:
+        payload.update(resultados[plano["tabela"]])
+    return payload
+
+
+def _rodar(tenant, chave):
+    return CONSULTAS[chave[0]](tenant, *chave[1:])
+
+
+def _rodar_em_thread(tenant, chave):
+    # Cada thread usa a propria conexao: ativa nela o schema do tenant e fecha a
+    # conexao ao fim, para nao deixar conexoes abertas pelas threads do pool.
+    try:
+        with schema_context(tenant.schema_name):
+            return _rodar(tenant, chave)
+    finally:
+        connections.close_all()
+
+
+def _executar_consultas(tenant, chaves):
+    workers = getattr(settings, "RELATORIOS_WIDGET_WORKERS", WIDGET_WORKERS)
+    # Dentro de uma transacao (ex.: testes) outras conexoes nao veem os dados
+    # ainda nao commitados: roda tudo na conexao atual.
+    if workers <= 1 or len(chaves) <= 1 or connection.in_atomic_block:
+        return {chave: _rodar(tenant, chave) for chave in chaves}
+    with ThreadPoolExecutor(max_workers=min(workers, len(chaves))) as executor:
+        futuros = {chave: executor.submit(_rodar_em_thread, tenant, chave) for chave in chaves}
+        return {chave: futuro.result() for chave, futuro in futuros.items()}
+
+
+def _widget_cache_key(tenant, relatorio, versao, widget, contexto):
+    widget_hash = hashlib.md5(json.dumps(widget, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    periodo = f"{contexto['start'].date().isoformat()}:{contexto['end'].date().isoformat()}"
+    return f"relatorios:widget:{tenant.pk}:{relatorio.pk}:{versao}:{widget_hash}:{periodo}"
+
+
+def avaliar_widgets(tenant, relatorio, plantas_map, ids=None):
+    """
+    Avalia os widgets do relatorio (so os de ids, se informado) e devolve a lista
+    de widgets com os dados para o template, na ordem do relatorio.
+
+    Cada widget fica no cache por (relatorio, hash do widget, dias do periodo)
+    ate a versao de widgets do tenant mudar (escritas nos fatos) ou por
+    WIDGET_CACHE_TIMEOUT. Os que faltarem sao planejados em consultas; consultas
+    iguais entre widgets rodam uma vez e as distintas rodam em paralelo.
+    """
+    now = timezone.localtime()
+    versao = versao_widgets(tenant.pk)
+    itens = []
+    for index, widget in enumerate(relatorio.widgets or []):
+        if ids is not None and str(widget.get("id") or index) not in ids:
+            continue
+        data, contexto = normalizar_widget(widget, plantas_map, now)
+        data["index"] = index
+        itens.append((data, contexto, _widget_cache_key(tenant, relatorio, versao, widget, contexto)))
+
+    payloads = cache.get_many([key for _, _, key in itens])
+    pendentes = [(data, contexto, key) for data, contexto, key in itens if key not in payloads]
+    if pendentes:
+        planos = {key: _plano_widget(data, contexto) for data, contexto, key in pendentes}
+        chaves = {chave for plano in planos.values() for chave in plano.values()}
+        resultados = _executar_consultas(tenant, chaves)
+        novos = {
+            key: _montar_payload(data, contexto, planos[key], resultados, plantas_map)
+            for data, contexto, key in pendentes
+        }
+        cache.set_many(novos, WIDGET_CACHE_TIMEOUT)
+        payloads.update(novos)
+    return [{**data, **payloads[key]} for data, _, key in itens]
@@ -7,6 +7,7 @@ from django.urls import reverse
 from django.views import View
 
 from apps.core.views import BaseTenantCreateView, BaseTenantListView, BaseTenantUpdateView
+from apps.entregas.services import invalidar_liberacoes
 from apps.funcionarios.models import Funcionario
 from .forms import TipoFuncionarioForm, TipoFuncionarioProdutoForm
 from .models import TipoFuncionario, TipoFuncionarioProduto
@@ -277,6 +278,7 @@ class TipoFuncionarioProdutoCreateView(BaseTenantCreateView):
             return None
 
         TipoFuncionarioProduto.objects.bulk_create(created)
+        invalidar_liberacoes(self.request.tenant.pk)
         return created
 
     def post(self, request, *args, **kwargs):
@@ -0,0 +1,62 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from django_tenants.utils import schema_context
+
+from apps.tenants.models import Company
+from apps.treinamentos.models import Turma
+from apps.treinamentos.services import finalizar_turma
+
+
+class Command(BaseCommand):
+    help = (
+        "Finaliza turmas em lote (pendencias, certificados e alertas), por exemplo depois de "
+        "importar presencas e avaliacoes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--schema", required=True, help="Tenant (schema_name) das turmas.")
+        parser.add_argument("--turmas", nargs="+", type=int, metavar="ID", help="Ids das turmas a finalizar.")
+        parser.add_argument(
+            "--encerradas-ate",
+            type=date.fromisoformat,
+            metavar="AAAA-MM-DD",
+            help="Finaliza as turmas em aberto cuja ultima aula foi ate esta data.",
+        )
+        parser.add_argument(
+            "--data-emissao",
+            type=date.fromisoformat,
+            metavar="AAAA-MM-DD",
+            help="Data de emissao dos certificados (padrao: hoje).",
+        )
+
+    def handle(self, *args, **options):
+        schema = options["schema"]
+        if not Company.objects.filter(schema_name=schema).exists():
+            raise CommandError(f"Tenant '{schema}' nao encontrado.")
+        if not options.get("turmas") and not options.get("encerradas_ate"):
+            raise CommandError("Informe --turmas ou --encerradas-ate.")
+
+        with schema_context(schema):
+            turmas = Turma.objects.filter(finalizada=False).select_related("treinamento").order_by("pk")
+            if options.get("turmas"):
+                turmas = turmas.filter(pk__in=options["turmas"])
+            if options.get("encerradas_ate"):
+                turmas = turmas.annotate(ultima_aula=Max("aulas__data")).filter(
+                    ultima_aula__lte=options["encerradas_ate"]
+                )
+            finalizadas = 0
+            for turma in turmas:
+                started = time.perf_counter()
+                resultado = finalizar_turma(turma, data_emissao=options.get("data_emissao"))
+                if resultado is None:
+                    continue
+                finalizadas += 1
+                self.stdout.write(
+                    f"[{schema}] turma #{turma.pk} pendencias={resultado['pendencias']} "
+                    f"certificados={resultado['certificados']} tempo={time.perf_counter() - started:.2f}s"
+                )
+
+        self.stdout.write(self.style.SUCCESS(f"{finalizadas} turma(s) finalizada(s)."))
@@ -1,12 +1,41 @@
-from datetime import timedelta
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from django.core.management.base import BaseCommand
-from django.utils import timezone
+from django.core.management.base import BaseCommand, CommandError
 from django.db import connection
+from django.utils import timezone
 from django_tenants.utils import schema_context
 
 from apps.tenants.models import Company
 from apps.treinamentos.models import TreinamentoAlerta, TreinamentoCertificado, TreinamentoPendencia
+from apps.treinamentos.services import DIAS_ALERTA_VENCIMENTO, revalidar_treinamentos
+
+
+def _schemas_com_tabelas(tabelas):
+    # Uma consulta ao catalogo para todos os tenants, em vez de introspeccao por schema.
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT table_schema
+            FROM information_schema.tables
+            WHERE table_name = ANY(%s)
+            GROUP BY table_schema
+            HAVING count(DISTINCT table_name) = %s
+            """,
+            [list(tabelas), len(tabelas)],
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def _revalidar_tenant(schema_name, hoje, dry_run):
+    started = time.perf_counter()
+    try:
+        with schema_context(schema_name):
+            resultado = revalidar_treinamentos(hoje, DIAS_ALERTA_VENCIMENTO, dry_run=dry_run)
+    finally:
+        # Cada thread do pool abre a propria conexao.
+        connection.close()
+    return resultado, time.perf_counter() - started
 
 
 class Command(BaseCommand):
@@ -14,81 +43,73 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("--dry-run", action="store_true", help="Simula sem gravar no banco.")
+        parser.add_argument(
+            "--tenants",
+            nargs="+",
+            metavar="SCHEMA",
+            help="Processa apenas os tenants informados (schema_name).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Tenants processados em paralelo, cada um com a propria conexao (padrao: 4).",
+        )
 
     def handle(self, *args, **options):
         dry_run = options.get("dry_run", False)
+        workers = max(1, options["workers"])
         today = timezone.localdate()
-        alert_days = {30, 15, 7}
-        max_days = max(alert_days)
-
-        for tenant in Company.objects.all():
-            with schema_context(tenant.schema_name):
-                self._process_tenant(tenant, today, alert_days, max_days, dry_run)
 
-        self.stdout.write(self.style.SUCCESS("Revalidacao concluida."))
+        tenants = Company.objects.exclude(schema_name="public").order_by("schema_name")
+        selecionados = options.get("tenants")
+        if selecionados:
+            tenants = tenants.filter(schema_name__in=selecionados)
+            faltando = set(selecionados) - set(tenants.values_list("schema_name", flat=True))
+            if faltando:
+                raise CommandError(f"Tenants nao encontrados: {', '.join(sorted(faltando))}.")
 
-    def _process_tenant(self, tenant, today, alert_days, max_days, dry_run):
         required_tables = {
-            "treinamentos_treinamentocertificado",
-            "treinamentos_treinamentopendencia",
-            "treinamentos_treinamentoalerta",
+            TreinamentoCertificado._meta.db_table,
+            TreinamentoPendencia._meta.db_table,
+            TreinamentoAlerta._meta.db_table,
         }
-        existing_tables = set(connection.introspection.table_names())
-        if not required_tables.issubset(existing_tables):
-            self.stdout.write(
-                self.style.WARNING(
-                    f"[{tenant.schema_name}] tabelas de treinamentos ausentes, pulei."
-                )
-            )
-            return
-        certificados_qs = TreinamentoCertificado.objects.filter(
-            validade_ate__isnull=False,
-            validade_ate__gte=today,
-            validade_ate__lte=today + timedelta(days=max_days),
-        ).select_related("funcionario", "treinamento")
+        schemas_prontos = _schemas_com_tabelas(required_tables)
+        schemas = []
+        for schema_name in tenants.values_list("schema_name", flat=True):
+            if schema_name in schemas_prontos:
+                schemas.append(schema_name)
+            else:
+                self.stdout.write(self.style.WARNING(f"[{schema_name}] tabelas de treinamentos ausentes, pulei."))
 
-        for cert in certificados_qs:
-            dias = (cert.validade_ate - today).days
-            if dias not in alert_days:
-                continue
-            if TreinamentoAlerta.objects.filter(
-                certificado=cert,
-                dias_para_vencer=dias,
-            ).exists():
-                continue
-            if dry_run:
-                continue
-            TreinamentoAlerta.objects.create(
-                company=tenant,
-                certificado=cert,
-                funcionario=cert.funcionario,
-                treinamento=cert.treinamento,
-                dias_para_vencer=dias,
-            )
-
-        expirados_qs = TreinamentoCertificado.objects.filter(
-            validade_ate__isnull=False,
-            validade_ate__lt=today,
-        ).select_related("funcionario", "treinamento")
+        started = time.perf_counter()
+        falhas = 0
+        totais = {"alertas": 0, "reabertas": 0, "criadas": 0}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futuros = {
+                pool.submit(_revalidar_tenant, schema_name, today, dry_run): schema_name for schema_name in schemas
+            }
+            for futuro in as_completed(futuros):
+                schema_name = futuros[futuro]
+                try:
+                    resultado, elapsed = futuro.result()
+                except Exception as exc:
+                    falhas += 1
+                    self.stdout.write(self.style.ERROR(f"[{schema_name}] falhou: {exc}"))
+                    continue
+                for chave, valor in resultado.items():
+                    totais[chave] += valor
+                self.stdout.write(
+                    f"[{schema_name}] alertas={resultado['alertas']} reabertas={resultado['reabertas']} "
+                    f"criadas={resultado['criadas']} tempo={elapsed:.2f}s"
+                )
 
-        for cert in expirados_qs:
-            pendencia = TreinamentoPendencia.objects.filter(
-                funcionario=cert.funcionario,
-                treinamento=cert.treinamento,
-            ).first()
-            if pendencia:
-                if pendencia.status != "pendente":
-                    if dry_run:
-                        continue
-                    pendencia.status = "pendente"
-                    pendencia.updated_by = None
-                    pendencia.save(update_fields=["status", "updated_by", "updated_at"])
-                continue
-            if dry_run:
-                continue
-            TreinamentoPendencia.objects.create(
-                company=tenant,
-                funcionario=cert.funcionario,
-                treinamento=cert.treinamento,
-                status="pendente",
-            )
+        resumo = (
+            f"tenants={len(schemas)} alertas={totais['alertas']} reabertas={totais['reabertas']} "
+            f"criadas={totais['criadas']} tempo={time.perf_counter() - started:.1f}s"
+        )
+        if dry_run:
+            resumo += " (dry-run, nada gravado)"
+        if falhas:
+            raise CommandError(f"Revalidacao com {falhas} tenant(s) em erro. {resumo}")
+        self.stdout.write(self.style.SUCCESS(f"Revalidacao concluida. {resumo}"))
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("treinamentos", "0015_migrar_instrutor_turma"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="treinamentocertificado",
+            index=models.Index(fields=["validade_ate"], name="trein_cert_validade"),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("treinamentos", "0016_treinamentocertificado_validade_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="turmaaula",
+            index=models.Index(fields=["company", "data"], name="trein_turma_aula_data"),
+        ),
+    ]
@@ -115,6 +115,9 @@ class TurmaAula(TenantModel):
 
     class Meta:
         ordering = ["data"]
+        indexes = [
+            models.Index(fields=["company", "data"], name="trein_turma_aula_data"),
+        ]
 
     def __str__(self):
         return f"{self.turma} - {self.data}"
@@ -226,6 +229,9 @@ class TreinamentoCertificado(TenantModel):
     class Meta:
         ordering = ["-data_emissao"]
         unique_together = ("funcionario", "treinamento")
+        indexes = [
+            models.Index(fields=["validade_ate"], name="trein_cert_validade"),
+        ]
 
     def __str__(self):
         return f"{self.funcionario} - {self.treinamento}"
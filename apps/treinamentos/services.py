@@ -0,0 +1,585 @@
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import partial
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Min, OuterRef, Subquery
+from django.dispatch import Signal
+from django.utils import timezone
+
+from apps.funcionarios.models import Funcionario, FuncionarioProduto
+from apps.produtos.models import ProdutoFornecedor
+from apps.ui.services import invalidar_metricas_dashboard
+from .models import (
+    Treinamento,
+    TreinamentoAlerta,
+    TreinamentoCertificado,
+    TreinamentoParticipacao,
+    TreinamentoPendencia,
+    TreinamentoPresencaAula,
+    Turma,
+    TurmaAula,
+)
+
+_adiados = threading.local()
+
+DIAS_ALERTA_VENCIMENTO = (30, 15, 7)
+
+# Enviado por aplicar_resultados, ainda dentro da transacao, depois de gravar
+# pendencias e certificados da turma. Argumentos: turma e aprovados (ids dos
+# funcionarios com certificado emitido).
+resultados_turma_aplicados = Signal()
+
+
+def _requisito(nome):
+    campo = Treinamento._meta.get_field(nome)
+    return campo.m2m_db_table(), campo.m2m_column_name(), campo.m2m_reverse_name()
+
+
+def _requisitos_sql():
+    """
+    Condicao (sobre t = treinamento, f = funcionario) de treinamento obrigatorio
+    para o funcionario: algum cargo, setor ou tipo em comum (ou nenhum desses
+    requisitos cadastrado) e, se houver EPIs exigidos, um vinculo ativo com
+    algum deles.
+    """
+    perfis = []
+    sem_perfil = []
+    for nome, coluna in (
+        ("requisitos_cargos", "cargo_id"),
+        ("requisitos_setores", "setor_id"),
+        ("requisitos_tipos_funcionario", "tipo_id"),
+    ):
+        tabela, treinamento_col, valor_col = _requisito(nome)
+        perfis.append(
+            f"EXISTS (SELECT 1 FROM {tabela} AS r WHERE r.{treinamento_col} = t.id AND r.{valor_col} = f.{coluna})"
+        )
+        sem_perfil.append(f"NOT EXISTS (SELECT 1 FROM {tabela} AS r WHERE r.{treinamento_col} = t.id)")
+    epis, treinamento_col, produto_col = _requisito("requisitos_epis")
+    epi = (
+        f"NOT EXISTS (SELECT 1 FROM {epis} AS r WHERE r.{treinamento_col} = t.id) "
+        f"OR EXISTS ("
+        f"SELECT 1 FROM {epis} AS r "
+        f"JOIN {ProdutoFornecedor._meta.db_table} AS pf ON pf.produto_id = r.{produto_col} "
+        f"JOIN {FuncionarioProduto._meta.db_table} AS fp ON fp.produto_fornecedor_id = pf.id "
+        f"WHERE r.{treinamento_col} = t.id AND fp.funcionario_id = f.id AND fp.ativo)"
+    )
+    perfil = " OR ".join(perfis + ["(" + " AND ".join(sem_perfil) + ")"])
+    return f"({perfil}) AND ({epi})"
+
+
+def resolver_pendencias(company_id, funcionario_ids=None, treinamento_ids=None):
+    """
+    Cria as pendencias que faltam da matriz (funcionario ativo x treinamento
+    obrigatorio ativo) do tenant, limitada aos funcionarios e/ou treinamentos
+    informados. Um unico INSERT ... SELECT; as pendencias ja existentes (em
+    qualquer status) ficam como estao. Retorna a quantidade criada.
+    """
+    if not company_id:
+        return 0
+    filtros = ["t.company_id = %s", "t.ativo", "t.obrigatorio"]
+    params = [company_id]
+    if funcionario_ids is not None:
+        if not funcionario_ids:
+            return 0
+        filtros.append("f.id = ANY(%s)")
+        params.append(list(funcionario_ids))
+    if treinamento_ids is not None:
+        if not treinamento_ids:
+            return 0
+        filtros.append("t.id = ANY(%s)")
+        params.append(list(treinamento_ids))
+    pendencia = TreinamentoPendencia._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {pendencia} (company_id, funcionario_id, treinamento_id, status, created_at, updated_at)
+            SELECT t.company_id, f.id, t.id, 'pendente', now(), now()
+            FROM {Treinamento._meta.db_table} AS t
+            JOIN {Funcionario._meta.db_table} AS f ON f.company_id = t.company_id AND f.ativo
+            WHERE {" AND ".join(filtros)}
+              AND {_requisitos_sql()}
+              AND NOT EXISTS (
+                  SELECT 1 FROM {pendencia} AS p WHERE p.funcionario_id = f.id AND p.treinamento_id = t.id
+              )
+            ON CONFLICT (funcionario_id, treinamento_id) DO NOTHING
+            """,
+            params,
+        )
+        criadas = cursor.rowcount
+    if criadas:
+        # INSERT direto nao dispara post_save; o painel e invalidado aqui.
+        invalidar_metricas_dashboard(company_id)
+    return criadas
+
+
+def agendar_pendencias(company_id, funcionario_ids=None, treinamento_ids=None):
+    """
+    Resolve as pendencias no commit da transacao atual. Dentro de
+    pendencias_adiadas(), os pedidos sao acumulados e resolvidos uma vez so.
+    """
+    if not company_id:
+        return
+    lote = getattr(_adiados, "lote", None)
+    if lote is not None:
+        alvo = lote.setdefault(company_id, {"funcionarios": set(), "treinamentos": set(), "todos": False})
+        if funcionario_ids is None and treinamento_ids is None:
+            alvo["todos"] = True
+        alvo["funcionarios"].update(funcionario_ids or ())
+        alvo["treinamentos"].update(treinamento_ids or ())
+        return
+    transaction.on_commit(
+        lambda: resolver_pendencias(
+            company_id,
+            funcionario_ids=None if funcionario_ids is None else list(funcionario_ids),
+            treinamento_ids=None if treinamento_ids is None else list(treinamento_ids),
+        )
+    )
+
+
+@contextmanager
+def pendencias_adiadas():
+    """
+    Junta os pedidos de agendar_pendencias (inclusive os dos signals) feitos no
+    bloco e resolve cada tenant uma vez, no commit: para edicoes em massa.
+    """
+    if getattr(_adiados, "lote", None) is not None:
+        yield
+        return
+    _adiados.lote = lote = {}
+    try:
+        yield
+    finally:
+        _adiados.lote = None
+    for company_id, alvo in lote.items():
+        if alvo["todos"]:
+            agendar_pendencias(company_id)
+            continue
+        # Funcionarios contra todos os treinamentos e treinamentos contra todos
+        # os funcionarios: duas consultas no maximo.
+        if alvo["funcionarios"]:
+            agendar_pendencias(company_id, funcionario_ids=alvo["funcionarios"])
+        if alvo["treinamentos"]:
+            agendar_pendencias(company_id, treinamento_ids=alvo["treinamentos"])
+
+
+def gerar_alertas_vencimento(hoje, dias=DIAS_ALERTA_VENCIMENTO, certificado_ids=None):
+    """
+    Cria, no schema atual, os alertas dos certificados que vencem daqui a
+    exatamente um dos `dias` (so os de certificado_ids, se informado). Um INSERT
+    ... SELECT pelo indice de validade_ate; a unique (certificado,
+    dias_para_vencer) descarta os ja gerados. Retorna a quantidade criada.
+    """
+    datas = [hoje + timedelta(days=dia) for dia in dias]
+    filtro = ""
+    params = [hoje, hoje, datas]
+    if certificado_ids is not None:
+        if not certificado_ids:
+            return 0
+        filtro = "AND c.id = ANY(%s)"
+        params.append(list(certificado_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {TreinamentoAlerta._meta.db_table} (
+                company_id, certificado_id, funcionario_id, treinamento_id,
+                dias_para_vencer, data_alerta, enviado, created_at, updated_at
+            )
+            SELECT c.company_id, c.id, c.funcionario_id, c.treinamento_id,
+                   c.validade_ate - %s::date, %s, false, now(), now()
+            FROM {TreinamentoCertificado._meta.db_table} AS c
+            WHERE c.validade_ate = ANY(%s::date[]) {filtro}
+            ON CONFLICT (certificado_id, dias_para_vencer) DO NOTHING
+            """,
+            params,
+        )
+        return cursor.rowcount
+
+
+def recalcular_alertas(treinamento_id, funcionario_ids, hoje=None):
+    """
+    Refaz os alertas dos certificados reemitidos: os alertas da validade anterior
+    saem (e deixam de bloquear os do novo ciclo na unique) e os da nova validade
+    que ja caem hoje sao criados.
+    """
+    if not funcionario_ids:
+        return 0
+    certificado_ids = list(
+        TreinamentoCertificado.objects.filter(
+            treinamento_id=treinamento_id,
+            funcionario_id__in=funcionario_ids,
+        ).values_list("id", flat=True)
+    )
+    TreinamentoAlerta.objects.filter(certificado_id__in=certificado_ids).delete()
+    return gerar_alertas_vencimento(hoje or timezone.localdate(), certificado_ids=certificado_ids)
+
+
+def reabrir_pendencias_expiradas(hoje):
+    """
+    Volta para "pendente" as pendencias de certificados vencidos antes de `hoje`
+    e cria as que faltam, num unico comando. Retorna (reabertas, criadas).
+    """
+    pendencia = TreinamentoPendencia._meta.db_table
+    certificado = TreinamentoCertificado._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH expirados AS (
+                SELECT company_id, funcionario_id, treinamento_id
+                FROM {certificado}
+                WHERE validade_ate < %s
+            ),
+            reabertas AS (
+                UPDATE {pendencia} AS p
+                SET status = 'pendente', updated_by_id = NULL, updated_at = now()
+                FROM expirados AS e
+                WHERE p.funcionario_id = e.funcionario_id
+                  AND p.treinamento_id = e.treinamento_id
+                  AND p.status <> 'pendente'
+                RETURNING p.company_id
+            ),
+            criadas AS (
+                INSERT INTO {pendencia} (company_id, funcionario_id, treinamento_id, status, created_at, updated_at)
+                SELECT e.company_id, e.funcionario_id, e.treinamento_id, 'pendente', now(), now()
+                FROM expirados AS e
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {pendencia} AS p
+                    WHERE p.funcionario_id = e.funcionario_id AND p.treinamento_id = e.treinamento_id
+                )
+                ON CONFLICT (funcionario_id, treinamento_id) DO NOTHING
+                RETURNING company_id
+            )
+            SELECT (SELECT count(*) FROM reabertas), (SELECT count(*) FROM criadas),
+                   ARRAY(SELECT company_id FROM reabertas UNION SELECT company_id FROM criadas)
+            """,
+            [hoje],
+        )
+        reabertas, criadas, company_ids = cursor.fetchone()
+    # UPDATE/INSERT direto nao dispara post_save; o painel e invalidado no commit.
+    for company_id in company_ids:
+        transaction.on_commit(partial(invalidar_metricas_dashboard, company_id))
+    return reabertas, criadas
+
+
+def revalidar_treinamentos(hoje, dias=DIAS_ALERTA_VENCIMENTO, dry_run=False):
+    """
+    Revalidacao diaria do schema atual numa transacao: alertas de vencimento e
+    reabertura de pendencias. Com dry_run, conta o que seria feito e desfaz.
+    """
+    with transaction.atomic():
+        alertas = gerar_alertas_vencimento(hoje, dias)
+        reabertas, criadas = reabrir_pendencias_expiradas(hoje)
+        if dry_run:
+            transaction.set_rollback(True)
+    return {"alertas": alertas, "reabertas": reabertas, "criadas": criadas}
+
+
+class _ContadorConsultas:
+    """execute_wrapper que conta os comandos enviados ao banco."""
+
+    def __init__(self):
+        self.total = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.total += 1
+        return execute(sql, params, many, context)
+
+
+def registrar_presencas(turma, aula_ids, presencas, user=None):
+    """
+    Grava a matriz de presenca da turma: `presencas` e {funcionario_id: ids das
+    aulas marcadas} e cada funcionario recebe uma linha por aula de `aula_ids`.
+    Um upsert (bulk_create com update_conflicts) das presencas, uma agregacao de
+    aulas_presentes e um upsert das participacoes, independente do tamanho da
+    turma. Retorna as quantidades gravadas e os comandos executados.
+    """
+    contador = _ContadorConsultas()
+    funcionario_ids = list(presencas)
+    if not funcionario_ids:
+        return {"presencas": 0, "participacoes": 0, "consultas": 0}
+    with connection.execute_wrapper(contador), transaction.atomic():
+        linhas = [
+            TreinamentoPresencaAula(
+                company_id=turma.company_id,
+                turma_aula_id=aula_id,
+                funcionario_id=funcionario_id,
+                presente=aula_id in marcadas,
+                created_by=user,
+                updated_by=user,
+            )
+            for funcionario_id, marcadas in presencas.items()
+            for aula_id in aula_ids
+        ]
+        TreinamentoPresencaAula.objects.bulk_create(
+            linhas,
+            update_conflicts=True,
+            unique_fields=["turma_aula", "funcionario"],
+            update_fields=["presente", "updated_by", "updated_at"],
+        )
+        totais = dict(
+            TreinamentoPresencaAula.objects.filter(
+                turma_aula__turma=turma,
+                funcionario_id__in=funcionario_ids,
+                presente=True,
+            )
+            .values("funcionario_id")
+            .annotate(total=Count("id"))
+            .values_list("funcionario_id", "total")
+            .order_by()
+        )
+        participacoes = [
+            TreinamentoParticipacao(
+                company_id=turma.company_id,
+                turma=turma,
+                funcionario_id=funcionario_id,
+                presente=totais.get(funcionario_id, 0) > 0,
+                aulas_presentes=totais.get(funcionario_id, 0),
+                created_by=user,
+                updated_by=user,
+            )
+            for funcionario_id in funcionario_ids
+        ]
+        TreinamentoParticipacao.objects.bulk_create(
+            participacoes,
+            update_conflicts=True,
+            unique_fields=["turma", "funcionario"],
+            update_fields=["presente", "aulas_presentes", "updated_by", "updated_at"],
+        )
+    return {"presencas": len(linhas), "participacoes": len(participacoes), "consultas": contador.total}
+
+
+def garantir_participacoes(turma, user=None):
+    """Cria as participacoes que faltam para os participantes ativos da turma."""
+    participantes_ids = list(turma.participantes.filter(ativo=True).values_list("id", flat=True))
+    if not participantes_ids:
+        return
+    existentes = set(
+        TreinamentoParticipacao.objects.filter(
+            turma=turma,
+            funcionario_id__in=participantes_ids,
+        ).values_list("funcionario_id", flat=True)
+    )
+    faltantes = [func_id for func_id in participantes_ids if func_id not in existentes]
+    if not faltantes:
+        return
+    presencas = (
+        TreinamentoPresencaAula.objects.filter(
+            turma_aula__turma=turma,
+            funcionario_id__in=faltantes,
+            presente=True,
+        )
+        .values("funcionario_id")
+        .annotate(total=Count("id"))
+        .order_by()
+    )
+    presencas_map = {item["funcionario_id"]: item["total"] for item in presencas}
+    novos = [
+        TreinamentoParticipacao(
+            company_id=turma.company_id,
+            turma=turma,
+            funcionario_id=funcionario_id,
+            presente=presencas_map.get(funcionario_id, 0) > 0,
+            aulas_presentes=presencas_map.get(funcionario_id, 0),
+            created_by=user,
+            updated_by=user,
+        )
+        for funcionario_id in faltantes
+    ]
+    TreinamentoParticipacao.objects.bulk_create(novos, ignore_conflicts=True)
+
+
+def status_pendencia(resultado, presente):
+    if resultado == "aprovado":
+        return "aprovado"
+    if resultado == "reprovado":
+        return "reprovado"
+    return "realizado" if presente else "pendente"
+
+
+def aplicar_resultados(turma, resultados, user=None, data_emissao=None):
+    """
+    Leva os resultados da turma para pendencias e certificados. `resultados` e
+    [(funcionario_id, resultado, presente)]. Um UPDATE ... FROM (VALUES ...)
+    para o status das pendencias do treinamento e um upsert (bulk_create com
+    update_conflicts) para os certificados dos aprovados; depois envia
+    resultados_turma_aplicados uma vez. Deve rodar dentro de uma transacao.
+    """
+    if not resultados:
+        return {"pendencias": 0, "certificados": 0}
+    treinamento = turma.treinamento
+    valores = []
+    params = []
+    for funcionario_id, resultado, presente in resultados:
+        valores.append("(%s::bigint, %s::varchar)")
+        params.extend([funcionario_id, status_pendencia(resultado, presente)])
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {TreinamentoPendencia._meta.db_table} AS p
+            SET status = v.status, updated_by_id = %s, updated_at = now()
+            FROM (VALUES {", ".join(valores)}) AS v(funcionario_id, status)
+            WHERE p.funcionario_id = v.funcionario_id
+              AND p.treinamento_id = %s
+              AND p.company_id = %s
+            """,
+            [getattr(user, "pk", None), *params, treinamento.pk, turma.company_id],
+        )
+        pendencias = cursor.rowcount
+    if pendencias:
+        # UPDATE direto nao dispara post_save; o painel e invalidado no commit.
+        transaction.on_commit(partial(invalidar_metricas_dashboard, turma.company_id))
+
+    aprovados = sorted({funcionario_id for funcionario_id, resultado, _ in resultados if resultado == "aprovado"})
+    data_emissao = data_emissao or timezone.localdate()
+    validade_ate = None
+    if (treinamento.validade_dias or 0) > 0:
+        validade_ate = data_emissao + timedelta(days=treinamento.validade_dias)
+    TreinamentoCertificado.objects.bulk_create(
+        [
+            TreinamentoCertificado(
+                company_id=turma.company_id,
+                funcionario_id=funcionario_id,
+                treinamento=treinamento,
+                turma=turma,
+                data_emissao=data_emissao,
+                validade_ate=validade_ate,
+                created_by=user,
+                updated_by=user,
+            )
+            for funcionario_id in aprovados
+        ],
+        update_conflicts=True,
+        unique_fields=["funcionario", "treinamento"],
+        update_fields=["turma", "data_emissao", "validade_ate", "updated_by", "updated_at"],
+    )
+    resultados_turma_aplicados.send(sender=turma.__class__, turma=turma, aprovados=aprovados)
+    return {"pendencias": pendencias, "certificados": len(aprovados)}
+
+
+def finalizar_turma(turma, user=None, data_emissao=None):
+    """
+    Finaliza a turma numa transacao: completa as participacoes, marca
+    finalizada e aplica os resultados de todos os participantes de uma vez.
+    Retorna None se a turma ja estava finalizada.
+    """
+    with transaction.atomic():
+        turma = Turma.objects.select_for_update().select_related("treinamento").get(pk=turma.pk)
+        if turma.finalizada:
+            return None
+        garantir_participacoes(turma, user)
+        turma.finalizada = True
+        turma.updated_by = user
+        turma.save(update_fields=["finalizada", "updated_by", "updated_at"])
+        resultados = list(
+            TreinamentoParticipacao.objects.filter(turma=turma)
+            .order_by()
+            .values_list("funcionario_id", "resultado", "presente")
+        )
+        return aplicar_resultados(turma, resultados, user=user, data_emissao=data_emissao)
+
+
+def registrar_avaliacoes(turma, avaliacoes, user=None):
+    """
+    Grava as avaliacoes da turma ([{funcionario_id, resultado, nota,
+    avaliacao}]) e aplica os resultados. Sem presenca o resultado vira
+    "ausente"; presentes sem resultado ficam de fora, como no formulario.
+    """
+    with transaction.atomic():
+        aulas = dict(
+            TreinamentoParticipacao.objects.filter(
+                turma=turma,
+                funcionario_id__in=[item["funcionario_id"] for item in avaliacoes],
+            )
+            .order_by()
+            .values_list("funcionario_id", "aulas_presentes")
+        )
+        participacoes = []
+        resultados = []
+        for item in avaliacoes:
+            funcionario_id = item["funcionario_id"]
+            aulas_presentes = aulas.get(funcionario_id, 0)
+            presente = aulas_presentes > 0
+            resultado = item.get("resultado") or ""
+            nota = item.get("nota")
+            if not presente:
+                resultado = "ausente"
+                nota = None
+            elif not resultado:
+                continue
+            participacoes.append(
+                TreinamentoParticipacao(
+                    company_id=turma.company_id,
+                    turma=turma,
+                    funcionario_id=funcionario_id,
+                    presente=presente,
+                    aulas_presentes=aulas_presentes,
+                    resultado=resultado,
+                    nota=nota,
+                    avaliacao=item.get("avaliacao") or "",
+                    created_by=user,
+                    updated_by=user,
+                )
+            )
+            resultados.append((funcionario_id, resultado, presente))
+        TreinamentoParticipacao.objects.bulk_create(
+            participacoes,
+            update_conflicts=True,
+            unique_fields=["turma", "funcionario"],
+            update_fields=["presente", "resultado", "nota", "avaliacao", "updated_by", "updated_at"],
+        )
+        return aplicar_resultados(turma, resultados, user=user)
+
+
+def _aulas_agenda(tenant, inicio, fim):
+    # Pelo indice (company, data) de TurmaAula.
+    return TurmaAula.objects.filter(company=tenant, data__range=(inicio, fim), turma__finalizada=False)
+
+
+def eventos_agenda(tenant, inicio, fim):
+    """Aulas das turmas em aberto entre inicio e fim (inclusive), em ordem de data."""
+    return list(
+        _aulas_agenda(tenant, inicio, fim)
+        .order_by("data", "turma_id")
+        .values(
+            "data",
+            "turma_id",
+            "turma__local",
+            "turma__treinamento__nome",
+            "turma__instrutor__nome",
+        )
+    )
+
+
+def versao_agenda(tenant, inicio, fim):
+    """
+    ETag do intervalo: muda quando uma aula do intervalo (ou a turma, o
+    treinamento ou o instrutor dela) e criada, alterada ou removida.
+    """
+    resumo = _aulas_agenda(tenant, inicio, fim).aggregate(
+        total=Count("id"),
+        aula=Max("updated_at"),
+        turma=Max("turma__updated_at"),
+        treinamento=Max("turma__treinamento__updated_at"),
+        instrutor=Max("turma__instrutor__updated_at"),
+    )
+    chave = f"{tenant.pk}:{inicio}:{fim}:" + ":".join(str(resumo[campo]) for campo in sorted(resumo))
+    return hashlib.md5(chave.encode("utf-8")).hexdigest()
+
+
+def turmas_em_aberto(tenant):
+    """Turmas nao finalizadas com a data da primeira aula (next_date), as sem aula por ultimo."""
+    primeira_aula = (
+        TurmaAula.objects.filter(turma=OuterRef("pk"))
+        .order_by()
+        .values("turma")
+        .annotate(primeira=Min("data"))
+        .values("primeira")
+    )
+    return (
+        Turma.objects.filter(company=tenant, finalizada=False)
+        .annotate(next_date=Subquery(primeira_aula))
+        .select_related("treinamento", "instrutor")
+        .order_by(F("next_date").asc(nulls_last=True), "pk")
+    )
@@ -1,89 +1,30 @@
-from django.db.models import Q
 from django.db.models.signals import m2m_changed, post_save
 from django.dispatch import receiver
 
 from apps.funcionarios.models import Funcionario, FuncionarioProduto
+from apps.ui.services import invalidar_metricas_dashboard
 from .models import Treinamento, TreinamentoPendencia, Turma
+from .services import agendar_pendencias, recalcular_alertas, resultados_turma_aplicados
 
 
-def _create_pendencias(funcionario, treinamentos):
-    if not funcionario or not treinamentos:
-        return
-    pending = [
-        TreinamentoPendencia(
-            company=funcionario.company,
-            funcionario=funcionario,
-            treinamento=treinamento,
-        )
-        for treinamento in treinamentos
-    ]
-    TreinamentoPendencia.objects.bulk_create(pending, ignore_conflicts=True)
-
-
-def _match_funcionarios_for_treinamento(treinamento):
-    if not treinamento or not treinamento.company_id:
-        return Funcionario.objects.none()
-    filtros = Q()
-    cargo_ids = list(treinamento.requisitos_cargos.values_list("id", flat=True))
-    setor_ids = list(treinamento.requisitos_setores.values_list("id", flat=True))
-    tipo_ids = list(treinamento.requisitos_tipos_funcionario.values_list("id", flat=True))
-    if cargo_ids:
-        filtros |= Q(cargo_id__in=cargo_ids)
-    if setor_ids:
-        filtros |= Q(setor_id__in=setor_ids)
-    if tipo_ids:
-        filtros |= Q(tipo_id__in=tipo_ids)
-    funcionarios = Funcionario.objects.filter(company=treinamento.company, ativo=True)
-    if filtros:
-        funcionarios = funcionarios.filter(filtros)
-    epi_ids = list(treinamento.requisitos_epis.values_list("id", flat=True))
-    if epi_ids:
-        funcionarios_epi = Funcionario.objects.filter(
-            company=treinamento.company,
-            produtos_disponiveis__ativo=True,
-            produtos_disponiveis__produto_fornecedor__produto_id__in=epi_ids,
-        )
-        if filtros:
-            funcionarios = funcionarios.filter(pk__in=funcionarios_epi.values("id"))
-        else:
-            funcionarios = funcionarios_epi
-    return funcionarios.distinct()
+# Campos de Funcionario que mudam os treinamentos exigidos.
+CAMPOS_REQUISITO_FUNCIONARIO = {"cargo", "setor", "tipo", "ativo"}
 
 
 @receiver(post_save, sender=Funcionario)
-def gerar_pendencias_funcionario(sender, instance, **kwargs):
-    if not instance or not instance.company_id:
+def gerar_pendencias_funcionario(sender, instance, update_fields=None, **kwargs):
+    if not instance or not instance.company_id or not instance.ativo:
         return
-    filtros = Q()
-    if instance.cargo_id:
-        filtros |= Q(requisitos_cargos=instance.cargo_id)
-    if instance.setor_id:
-        filtros |= Q(requisitos_setores=instance.setor_id)
-    if instance.tipo_id:
-        filtros |= Q(requisitos_tipos_funcionario=instance.tipo_id)
-    if not filtros:
+    if update_fields is not None and not CAMPOS_REQUISITO_FUNCIONARIO.intersection(update_fields):
         return
-    treinamentos = list(
-        Treinamento.objects.filter(company=instance.company, ativo=True, obrigatorio=True)
-        .filter(filtros)
-        .distinct()
-    )
-    _create_pendencias(instance, treinamentos)
+    agendar_pendencias(instance.company_id, funcionario_ids=[instance.pk])
 
 
 @receiver(post_save, sender=FuncionarioProduto)
 def gerar_pendencias_epi(sender, instance, **kwargs):
     if not instance or not instance.company_id or not instance.ativo:
         return
-    produto_id = getattr(instance.produto_fornecedor, "produto_id", None)
-    if not produto_id:
-        return
-    treinamentos = list(
-        Treinamento.objects.filter(company=instance.company, ativo=True, obrigatorio=True)
-        .filter(requisitos_epis=produto_id)
-        .distinct()
-    )
-    _create_pendencias(instance.funcionario, treinamentos)
+    agendar_pendencias(instance.company_id, funcionario_ids=[instance.funcionario_id])
 
 
 @receiver(post_save, sender=Treinamento)
@@ -92,9 +33,20 @@ def gerar_pendencias_treinamento(sender, instance, **kwargs):
         return
     if not instance.ativo or not instance.obrigatorio:
         return
-    funcionarios = list(_match_funcionarios_for_treinamento(instance))
-    for funcionario in funcionarios:
-        _create_pendencias(funcionario, [instance])
+    # No commit: o form grava os requisitos (m2m) depois do post_save.
+    agendar_pendencias(instance.company_id, treinamento_ids=[instance.pk])
+
+
+@receiver(m2m_changed, sender=Treinamento.requisitos_cargos.through)
+@receiver(m2m_changed, sender=Treinamento.requisitos_setores.through)
+@receiver(m2m_changed, sender=Treinamento.requisitos_tipos_funcionario.through)
+@receiver(m2m_changed, sender=Treinamento.requisitos_epis.through)
+def gerar_pendencias_requisitos(sender, instance, action, reverse, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear") or reverse:
+        return
+    if not instance or not instance.company_id or not instance.ativo or not instance.obrigatorio:
+        return
+    agendar_pendencias(instance.company_id, treinamento_ids=[instance.pk])
 
 
 @receiver(m2m_changed, sender=Turma.participantes.through)
@@ -126,3 +78,9 @@ def gerar_pendencias_turma(sender, instance, action, pk_set, **kwargs):
         treinamento=instance.treinamento,
         funcionario_id__in=funcionario_ids,
     ).update(status="agendado")
+    invalidar_metricas_dashboard(instance.company_id)
+
+
+@receiver(resultados_turma_aplicados)
+def recalcular_alertas_turma(sender, turma, aprovados, **kwargs):
+    recalcular_alertas(turma.treinamento_id, aprovados)
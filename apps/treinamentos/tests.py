@@ -0,0 +1,59 @@
+from datetime import date, timedelta
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django_tenants.test.cases import TenantTestCase
+
+from apps.funcionarios.models import Funcionario
+from .models import Treinamento, TreinamentoParticipacao, TreinamentoPresencaAula, Turma, TurmaAula
+from .services import registrar_presencas
+
+
+class RegistrarPresencasTests(TenantTestCase):
+    def _turma(self, participantes, aulas=3):
+        treinamento = Treinamento.objects.create(company=self.tenant, nome="NR-35")
+        turma = Turma.objects.create(company=self.tenant, treinamento=treinamento, local="Sala 1", qtd_aulas=aulas)
+        aula_ids = [
+            TurmaAula.objects.create(company=self.tenant, turma=turma, data=date(2024, 1, 1) + timedelta(days=dia)).pk
+            for dia in range(aulas)
+        ]
+        funcionarios = Funcionario.objects.bulk_create(
+            [Funcionario(company=self.tenant, nome=f"Funcionario {numero}") for numero in range(participantes)]
+        )
+        # Metade dos funcionarios presente so na primeira aula.
+        presencas = {
+            funcionario.pk: set(aula_ids if numero % 2 else aula_ids[:1])
+            for numero, funcionario in enumerate(funcionarios)
+        }
+        return turma, aula_ids, presencas
+
+    def _registrar(self, turma, aula_ids, presencas):
+        with CaptureQueriesContext(connection) as consultas:
+            resultado = registrar_presencas(turma, aula_ids, presencas)
+        return resultado, len(consultas)
+
+    def test_comandos_nao_crescem_com_a_turma(self):
+        pequena = self._turma(participantes=2)
+        grande = self._turma(participantes=200)
+
+        resultado_pequena, consultas_pequena = self._registrar(*pequena)
+        resultado_grande, consultas_grande = self._registrar(*grande)
+
+        self.assertEqual(resultado_grande["presencas"], 600)
+        self.assertEqual(resultado_grande["participacoes"], 200)
+        self.assertEqual(resultado_pequena["consultas"], resultado_grande["consultas"])
+        self.assertEqual(consultas_pequena, consultas_grande)
+
+    def test_regravar_atualiza_presencas_e_participacoes(self):
+        turma, aula_ids, presencas = self._turma(participantes=4)
+        registrar_presencas(turma, aula_ids, presencas)
+        funcionario_id = next(iter(presencas))
+        presencas[funcionario_id] = set()
+
+        resultado = registrar_presencas(turma, aula_ids, presencas)
+
+        self.assertEqual(resultado["presencas"], 12)
+        self.assertEqual(TreinamentoPresencaAula.objects.filter(turma_aula__turma=turma).count(), 12)
+        participacao = TreinamentoParticipacao.objects.get(turma=turma, funcionario_id=funcionario_id)
+        self.assertFalse(participacao.presente)
+        self.assertEqual(participacao.aulas_presentes, 0)
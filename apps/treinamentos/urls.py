@@ -7,6 +7,7 @@ app_name = "treinamentos"
 urlpatterns = [
     path("treinamentos/", views.TreinamentoListView.as_view(), name="list"),
     path("treinamentos/agenda/", views.TreinamentoAgendaView.as_view(), name="agenda"),
+    path("treinamentos/agenda/eventos/", views.TreinamentoAgendaEventosView.as_view(), name="agenda_eventos"),
     path("treinamentos/novo/", views.TreinamentoCreateView.as_view(), name="create"),
     path("treinamentos/<int:pk>/editar/", views.TreinamentoUpdateView.as_view(), name="update"),
     path("treinamentos/<int:pk>/toggle/", views.TreinamentoToggleActiveView.as_view(), name="toggle"),
@@ -7,9 +7,10 @@ from django.http import HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 import re
 from django.views import View
-from django.db.models import Count
 from django.template import Context, Template
 from django.template import Context, Template
 from django.template.loader import render_to_string
@@ -22,54 +23,30 @@ from .models import (
     Instrutor,
     Treinamento,
     TreinamentoCertificado,
-    TreinamentoPendencia,
     TreinamentoParticipacao,
     TreinamentoPresencaAula,
     Turma,
     TurmaAula,
 )
+from .services import (
+    eventos_agenda,
+    finalizar_turma,
+    garantir_participacoes,
+    pendencias_adiadas,
+    registrar_avaliacoes,
+    registrar_presencas,
+    turmas_em_aberto,
+    versao_agenda,
+)
 
-def _ensure_participacoes(request, turma):
-    participantes_ids = list(
-        turma.participantes.filter(ativo=True).values_list("id", flat=True)
-    )
-    if not participantes_ids:
-        return
-    existentes = set(
-        TreinamentoParticipacao.objects.filter(
-            turma=turma,
-            funcionario_id__in=participantes_ids,
-        ).values_list("funcionario_id", flat=True)
-    )
-    faltantes = [func_id for func_id in participantes_ids if func_id not in existentes]
-    if not faltantes:
-        return
-    presencas = (
-        TreinamentoPresencaAula.objects.filter(
-            turma_aula__turma=turma,
-            funcionario_id__in=faltantes,
-            presente=True,
-        )
-        .values("funcionario_id")
-        .annotate(total=Count("id"))
-    )
-    presencas_map = {item["funcionario_id"]: item["total"] for item in presencas}
-    novos = []
-    for funcionario_id in faltantes:
-        aulas_presentes = presencas_map.get(funcionario_id, 0)
-        novos.append(
-            TreinamentoParticipacao(
-                company=request.tenant,
-                turma=turma,
-                funcionario_id=funcionario_id,
-                presente=aulas_presentes > 0,
-                aulas_presentes=aulas_presentes,
-                created_by=request.user,
-                updated_by=request.user,
-            )
-        )
-    if novos:
-        TreinamentoParticipacao.objects.bulk_create(novos, ignore_conflicts=True)
+
+def _evento_agenda(evento):
+    return {
+        "turma_id": evento["turma_id"],
+        "treinamento": evento["turma__treinamento__nome"],
+        "local": evento["turma__local"],
+        "instrutor": evento["turma__instrutor__nome"] or "",
+    }
 
 
 class TreinamentoAgendaView(PermissionRequiredMixin, View):
@@ -92,47 +69,20 @@ class TreinamentoAgendaView(PermissionRequiredMixin, View):
         range_start = weeks[0][0]
         range_end = weeks[-1][-1]
 
-        aulas = (
-            TurmaAula.objects.filter(
-                company=request.tenant,
-                turma__finalizada=False,
-                data__range=(range_start, range_end),
-            )
-            .select_related("turma__treinamento", "turma__instrutor")
-            .order_by("data")
-        )
         events_by_date = {}
-        for aula in aulas:
-            events_by_date.setdefault(aula.data, []).append(
-                {
-                    "turma_id": aula.turma_id,
-                    "treinamento": aula.turma.treinamento.nome,
-                    "local": aula.turma.local,
-                    "instrutor": aula.turma.instrutor.nome if aula.turma.instrutor else "",
-                }
-            )
-
-        turmas = (
-            Turma.objects.filter(company=request.tenant, finalizada=False)
-            .select_related("treinamento", "instrutor")
-            .prefetch_related("aulas")
-        )
-        open_turmas = []
-        for turma in turmas:
-            aulas_list = list(turma.aulas.all())
-            next_date = min((aula.data for aula in aulas_list), default=None)
-            open_turmas.append(
-                {
-                    "id": turma.pk,
-                    "treinamento": turma.treinamento.nome,
-                    "local": turma.local,
-                    "instrutor": turma.instrutor.nome if turma.instrutor else "",
-                    "next_date": next_date,
-                }
-            )
-        open_turmas.sort(
-            key=lambda item: (item["next_date"] is None, item["next_date"] or date.max)
-        )
+        for evento in eventos_agenda(request.tenant, range_start, range_end):
+            events_by_date.setdefault(evento["data"], []).append(_evento_agenda(evento))
+
+        open_turmas = [
+            {
+                "id": turma.pk,
+                "treinamento": turma.treinamento.nome,
+                "local": turma.local,
+                "instrutor": turma.instrutor.nome if turma.instrutor else "",
+                "next_date": turma.next_date,
+            }
+            for turma in turmas_em_aberto(request.tenant)
+        ]
 
         prev_year = year
         prev_month = month - 1
@@ -175,6 +125,38 @@ class TreinamentoAgendaView(PermissionRequiredMixin, View):
         }
         return render(request, self.template_name, context)
 
+
+class TreinamentoAgendaEventosView(PermissionRequiredMixin, View):
+    """Eventos da agenda de um intervalo (?inicio=&fim=, AAAA-MM-DD), com ETag."""
+
+    permission_required = "treinamentos.view_turma"
+    max_dias = 366
+
+    def get(self, request):
+        try:
+            inicio = date.fromisoformat(request.GET.get("inicio") or "")
+            fim = date.fromisoformat(request.GET.get("fim") or "")
+        except ValueError:
+            return JsonResponse({"ok": False, "error": "Informe inicio e fim (AAAA-MM-DD)."}, status=400)
+        if fim < inicio or (fim - inicio).days > self.max_dias:
+            return JsonResponse({"ok": False, "error": "Intervalo invalido."}, status=400)
+
+        etag = quote_etag(versao_agenda(request.tenant, inicio, fim))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            eventos = [
+                {"data": evento["data"].isoformat(), **_evento_agenda(evento)}
+                for evento in eventos_agenda(request.tenant, inicio, fim)
+            ]
+            response = JsonResponse(
+                {"ok": True, "inicio": inicio.isoformat(), "fim": fim.isoformat(), "eventos": eventos}
+            )
+        response["ETag"] = etag
+        # O navegador guarda a resposta, mas revalida (If-None-Match) a cada uso.
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
 class TreinamentoListView(BaseTenantListView):
     model = Treinamento
     form_class = TreinamentoForm
@@ -211,13 +193,20 @@ class TreinamentoListView(BaseTenantListView):
     update_url_name = "treinamentos:update"
 
 
-class TreinamentoCreateView(BaseTenantCreateView):
+class PendenciasAdiadasMixin:
+    # O save e os quatro m2m de requisitos geram uma unica resolucao de pendencias.
+    def form_valid(self, form):
+        with pendencias_adiadas():
+            return super().form_valid(form)
+
+
+class TreinamentoCreateView(PendenciasAdiadasMixin, BaseTenantCreateView):
     model = Treinamento
     form_class = TreinamentoForm
     success_url_name = "treinamentos:list"
 
 
-class TreinamentoUpdateView(BaseTenantUpdateView):
+class TreinamentoUpdateView(PendenciasAdiadasMixin, BaseTenantUpdateView):
     model = Treinamento
     form_class = TreinamentoForm
     success_url_name = "treinamentos:list"
@@ -515,46 +504,7 @@ class TurmaFinalizarView(PermissionRequiredMixin, View):
 
     def post(self, request, pk):
         turma = get_object_or_404(Turma, pk=pk, company=request.tenant)
-        if not turma.finalizada:
-            _ensure_participacoes(request, turma)
-            turma.finalizada = True
-            turma.updated_by = request.user
-            turma.save(update_fields=["finalizada", "updated_by", "updated_at"])
-            data_emissao = timezone.localdate()
-            validade_ate = None
-            validade_dias = turma.treinamento.validade_dias or 0
-            if validade_dias > 0:
-                validade_ate = data_emissao + timezone.timedelta(days=validade_dias)
-            participacoes = TreinamentoParticipacao.objects.filter(turma=turma).select_related("funcionario")
-            for item in participacoes:
-                pendencia = TreinamentoPendencia.objects.filter(
-                    funcionario=item.funcionario,
-                    treinamento=turma.treinamento,
-                    company=request.tenant,
-                ).first()
-                if pendencia:
-                    if item.resultado == "aprovado":
-                        pendencia.status = "aprovado"
-                    elif item.resultado == "reprovado":
-                        pendencia.status = "reprovado"
-                    elif item.presente:
-                        pendencia.status = "realizado"
-                    else:
-                        pendencia.status = "pendente"
-                    pendencia.updated_by = request.user
-                    pendencia.save(update_fields=["status", "updated_by", "updated_at"])
-                if item.resultado == "aprovado":
-                    TreinamentoCertificado.objects.update_or_create(
-                        funcionario=item.funcionario,
-                        treinamento=turma.treinamento,
-                        defaults={
-                            "company": request.tenant,
-                            "turma": turma,
-                            "data_emissao": data_emissao,
-                            "validade_ate": validade_ate,
-                            "updated_by": request.user,
-                        },
-                    )
+        finalizar_turma(turma, user=request.user)
         return HttpResponseRedirect(reverse("treinamentos:turmas_list"))
 
 class TurmaPresencaView(PermissionRequiredMixin, View):
@@ -562,7 +512,7 @@ class TurmaPresencaView(PermissionRequiredMixin, View):
 
     def get(self, request, pk):
         turma = get_object_or_404(Turma, pk=pk, company=request.tenant)
-        _ensure_participacoes(request, turma)
+        garantir_participacoes(turma, request.user)
         aulas = TurmaAula.objects.filter(turma=turma).order_by("data")
         participacoes_qs = (
             TreinamentoParticipacao.objects.filter(turma=turma)
@@ -597,38 +547,19 @@ class TurmaPresencaView(PermissionRequiredMixin, View):
         turma = get_object_or_404(Turma, pk=pk, company=request.tenant)
         if turma.finalizada:
             return HttpResponseRedirect(reverse("treinamentos:turmas_presenca", args=[turma.pk]))
-        aulas = list(TurmaAula.objects.filter(turma=turma).order_by("data"))
-        participantes_ids = request.POST.getlist("participante_id")
-        for raw_id in participantes_ids:
+        aula_ids = list(TurmaAula.objects.filter(turma=turma).order_by("data").values_list("id", flat=True))
+        presencas = {}
+        for raw_id in request.POST.getlist("participante_id"):
             try:
                 funcionario_id = int(raw_id)
             except (TypeError, ValueError):
                 continue
-            aulas_presentes = 0
-            for aula in aulas:
-                checked = request.POST.get(f"presenca_{funcionario_id}_{aula.id}") == "1"
-                if checked:
-                    aulas_presentes += 1
-                TreinamentoPresencaAula.objects.update_or_create(
-                    turma_aula=aula,
-                    funcionario_id=funcionario_id,
-                    defaults={
-                        "company": request.tenant,
-                        "presente": checked,
-                        "updated_by": request.user,
-                    },
-                )
-            presente = aulas_presentes > 0
-            TreinamentoParticipacao.objects.update_or_create(
-                turma=turma,
-                funcionario_id=funcionario_id,
-                defaults={
-                    "company": request.tenant,
-                    "presente": presente,
-                    "aulas_presentes": aulas_presentes,
-                    "updated_by": request.user,
-                },
-            )
+            presencas[funcionario_id] = {
+                aula_id
+                for aula_id in aula_ids
+                if request.POST.get(f"presenca_{funcionario_id}_{aula_id}") == "1"
+            }
+        registrar_presencas(turma, aula_ids, presencas, user=request.user)
         return HttpResponseRedirect(reverse("treinamentos:turmas_presenca", args=[turma.pk]))
 
 
@@ -637,7 +568,7 @@ class TurmaAvaliacaoView(PermissionRequiredMixin, View):
 
     def get(self, request, pk):
         turma = get_object_or_404(Turma, pk=pk, company=request.tenant)
-        _ensure_participacoes(request, turma)
+        garantir_participacoes(turma, request.user)
         participacoes = (
             TreinamentoParticipacao.objects.filter(turma=turma)
             .select_related("funcionario")
@@ -655,84 +586,26 @@ class TurmaAvaliacaoView(PermissionRequiredMixin, View):
         turma = get_object_or_404(Turma, pk=pk, company=request.tenant)
         if turma.finalizada:
             return HttpResponseRedirect(reverse("treinamentos:turmas_avaliacao", args=[turma.pk]))
-        participantes_ids = request.POST.getlist("participante_id")
-        for raw_id in participantes_ids:
+        avaliacoes = {}
+        for raw_id in request.POST.getlist("participante_id"):
             try:
                 funcionario_id = int(raw_id)
             except (TypeError, ValueError):
                 continue
-            resultado = request.POST.get(f"resultado_{funcionario_id}") or ""
-            nota_raw = request.POST.get(f"nota_{funcionario_id}")
-            avaliacao = request.POST.get(f"avaliacao_{funcionario_id}") or ""
-
-            participacao = TreinamentoParticipacao.objects.filter(
-                turma=turma,
-                funcionario_id=funcionario_id,
-            ).first()
-            aulas_presentes = participacao.aulas_presentes if participacao else 0
-            presente = aulas_presentes > 0
-
             nota = None
+            nota_raw = request.POST.get(f"nota_{funcionario_id}")
             if nota_raw:
                 try:
                     nota = Decimal(nota_raw)
                 except (InvalidOperation, ValueError):
                     nota = None
-            if not presente:
-                resultado = "ausente"
-                nota = None
-            else:
-                if not resultado:
-                    continue
-
-            TreinamentoParticipacao.objects.update_or_create(
-                turma=turma,
-                funcionario_id=funcionario_id,
-                defaults={
-                    "company": request.tenant,
-                    "presente": presente,
-                    "resultado": resultado,
-                    "nota": nota,
-                    "avaliacao": avaliacao,
-                    "updated_by": request.user,
-                },
-            )
-
-            pendencia = TreinamentoPendencia.objects.filter(
-                funcionario_id=funcionario_id,
-                treinamento=turma.treinamento,
-                company=request.tenant,
-            ).first()
-            if pendencia:
-                if presente:
-                    if resultado == "aprovado":
-                        pendencia.status = "aprovado"
-                    elif resultado == "reprovado":
-                        pendencia.status = "reprovado"
-                    else:
-                        pendencia.status = "realizado"
-                else:
-                    pendencia.status = "pendente"
-                pendencia.updated_by = request.user
-                pendencia.save(update_fields=["status", "updated_by", "updated_at"])
-            if presente and resultado == "aprovado":
-                data_emissao = timezone.localdate()
-                validade_ate = None
-                validade_dias = turma.treinamento.validade_dias or 0
-                if validade_dias > 0:
-                    validade_ate = data_emissao + timezone.timedelta(days=validade_dias)
-                TreinamentoCertificado.objects.update_or_create(
-                    funcionario_id=funcionario_id,
-                    treinamento=turma.treinamento,
-                    defaults={
-                        "company": request.tenant,
-                        "turma": turma,
-                        "data_emissao": data_emissao,
-                        "validade_ate": validade_ate,
-                        "updated_by": request.user,
-                    },
-                )
-
+            avaliacoes[funcionario_id] = {
+                "funcionario_id": funcionario_id,
+                "resultado": request.POST.get(f"resultado_{funcionario_id}") or "",
+                "nota": nota,
+                "avaliacao": request.POST.get(f"avaliacao_{funcionario_id}") or "",
+            }
+        registrar_avaliacoes(turma, list(avaliacoes.values()), user=request.user)
         return HttpResponseRedirect(reverse("treinamentos:turmas_avaliacao", args=[turma.pk]))
 
 
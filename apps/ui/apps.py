@@ -3,4 +3,7 @@ from django.apps import AppConfig
 
 class UiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
-    name = "apps.ui"
\ No newline at end of file
+    name = "apps.ui"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,235 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Q
+from django.utils import timezone
+
+from apps.entregas.models import Entrega
+from apps.estoque.models import Estoque
+from apps.produtos.models import Produto
+from apps.treinamentos.models import TreinamentoPendencia, TurmaAula
+
+DASHBOARD_CACHE_TIMEOUT = 60
+
+STATUS_ENTREGA = {
+    "entregue": {"label": "Entregue", "class": "bg-success-subtle text-success"},
+    "aguardando": {"label": "Aguardando entrega", "class": "bg-warning-subtle text-warning"},
+    "cancelada": {"label": "Cancelada", "class": "bg-danger-subtle text-danger"},
+}
+
+
+def _dashboard_prefix(company_id):
+    return f"ui:dashboard:{company_id}"
+
+
+def _dashboard_versao(company_id):
+    key = f"{_dashboard_prefix(company_id)}:versao"
+    versao = cache.get(key)
+    if versao is None:
+        versao = 1
+        cache.add(key, versao, None)
+    return versao
+
+
+def invalidar_metricas_dashboard(company_id):
+    """Troca a versao das metricas do tenant (todas as plantas)."""
+    if not company_id:
+        return
+    key = f"{_dashboard_prefix(company_id)}:versao"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+
+
+def _contagens_entregas(tenant, planta_id, today):
+    yesterday = today - timedelta(days=1)
+    queryset = Entrega.objects.filter(company=tenant)
+    if planta_id:
+        queryset = queryset.filter(funcionario__planta_id=planta_id)
+    return queryset.aggregate(
+        hoje=Count("id", filter=Q(created_at__date=today)),
+        ontem=Count("id", filter=Q(created_at__date=yesterday)),
+        aguardando=Count("id", filter=Q(status="aguardando")),
+    )
+
+
+def _contagens_produtos(tenant, today):
+    return Produto.objects.filter(
+        company=tenant,
+        controle_epi=True,
+        data_vencimento_ca__isnull=False,
+    ).aggregate(
+        vencendo=Count(
+            "id",
+            filter=Q(data_vencimento_ca__gte=today, data_vencimento_ca__lte=today + timedelta(days=30)),
+        ),
+        expirado=Count("id", filter=Q(data_vencimento_ca__lt=today)),
+    )
+
+
+def _contagens_pendencias(tenant, planta_id):
+    queryset = TreinamentoPendencia.objects.filter(company=tenant, status__in=["pendente", "expirado"])
+    if planta_id:
+        queryset = queryset.filter(funcionario__planta_id=planta_id)
+    return queryset.aggregate(
+        pendentes=Count("id", filter=Q(status="pendente")),
+        expirados=Count("id", filter=Q(status="expirado")),
+    )
+
+
+def _estoque_critico(tenant, planta_id):
+    queryset = Estoque.objects.filter(
+        company=tenant,
+        produto__estoque_minimo__gt=0,
+        quantidade__lte=F("produto__estoque_minimo"),
+    )
+    if planta_id:
+        queryset = queryset.filter(deposito__planta_id=planta_id)
+    total = queryset.count()
+    if not total:
+        return 0, []
+    itens = (
+        queryset.select_related("produto", "deposito__planta")
+        .annotate(
+            percent=ExpressionWrapper(
+                F("quantidade") * 100.0 / F("produto__estoque_minimo"),
+                output_field=FloatField(),
+            )
+        )
+        .order_by("percent")[:3]
+    )
+    cards = []
+    for item in itens:
+        percent = int(max(0, min(100, item.percent or 0)))
+        if percent <= 15:
+            tone = "danger"
+        elif percent <= 35:
+            tone = "warning"
+        else:
+            tone = "secondary"
+        cards.append(
+            {
+                "produto": item.produto.nome,
+                "planta": item.deposito.planta.nome if item.deposito and item.deposito.planta else "-",
+                "percent": percent,
+                "tone": tone,
+            }
+        )
+    return total, cards
+
+
+def _operacoes(tenant, planta_id):
+    queryset = Entrega.objects.filter(company=tenant)
+    if planta_id:
+        queryset = queryset.filter(funcionario__planta_id=planta_id)
+    operacoes = []
+    for entrega in queryset.select_related("funcionario", "produto").order_by("-created_at")[:4]:
+        status = STATUS_ENTREGA.get(
+            entrega.status, {"label": entrega.status, "class": "bg-secondary-subtle text-secondary"}
+        )
+        operacoes.append(
+            {
+                "funcionario": entrega.funcionario.nome,
+                "produto": entrega.produto.nome,
+                "quantidade": entrega.quantidade,
+                "status_label": status["label"],
+                "status_class": status["class"],
+            }
+        )
+    return operacoes
+
+
+def _agenda(tenant, today):
+    aulas = (
+        TurmaAula.objects.filter(company=tenant, turma__finalizada=False, data__gte=today)
+        .select_related("turma__treinamento")
+        .annotate(inscritos=Count("turma__participantes", distinct=True))
+        .order_by("data")[:3]
+    )
+    agenda = []
+    for aula in aulas:
+        if aula.data == today:
+            data_label = "Hoje"
+        elif aula.data == today + timedelta(days=1):
+            data_label = "Amanha"
+        else:
+            data_label = aula.data.strftime("%d/%m")
+        agenda.append(
+            {
+                "treinamento": aula.turma.treinamento.nome,
+                "data_label": data_label,
+                "local": aula.turma.local,
+                "inscritos": aula.inscritos,
+            }
+        )
+    return agenda
+
+
+def _calcular_metricas(tenant, planta_id):
+    today = timezone.localdate()
+    entregas = _contagens_entregas(tenant, planta_id, today)
+    produtos = _contagens_produtos(tenant, today)
+    pendencias = _contagens_pendencias(tenant, planta_id)
+    estoque_critico, estoque_cards = _estoque_critico(tenant, planta_id)
+
+    if entregas["ontem"]:
+        delta = ((entregas["hoje"] - entregas["ontem"]) / entregas["ontem"]) * 100
+        entregas_delta_label = f"{delta:+.0f}% vs. ontem"
+    else:
+        entregas_delta_label = "Sem comparacao"
+
+    treinamentos_expirados = pendencias["expirados"]
+    ca_expirado = produtos["expirado"]
+    assinaturas_pendentes = entregas["aguardando"]
+    alerts = [
+        {
+            "title": "Treinamentos vencidos",
+            "subtitle": f"{treinamentos_expirados} colaboradores com pendencias",
+            "class": "bg-danger-subtle text-danger" if treinamentos_expirados else "bg-secondary-subtle text-secondary",
+            "label": "Alto" if treinamentos_expirados else "Baixo",
+        },
+        {
+            "title": "EPI com CA expirado",
+            "subtitle": f"{ca_expirado} itens precisam substituicao",
+            "class": "bg-warning-subtle text-warning" if ca_expirado else "bg-secondary-subtle text-secondary",
+            "label": "Medio" if ca_expirado else "Baixo",
+        },
+        {
+            "title": "Assinaturas pendentes",
+            "subtitle": f"{assinaturas_pendentes} recibos aguardando confirmacao",
+            "class": "bg-secondary-subtle text-secondary",
+            "label": "Baixo",
+        },
+    ]
+
+    return {
+        "entregas_hoje": entregas["hoje"],
+        "entregas_delta_label": entregas_delta_label,
+        "epis_vencendo": produtos["vencendo"],
+        "treinamentos_pendentes": pendencias["pendentes"],
+        "estoque_critico": estoque_critico,
+        "entregas_pendentes": assinaturas_pendentes,
+        "operacoes": _operacoes(tenant, planta_id),
+        "alerts": alerts,
+        "agenda_items": _agenda(tenant, today),
+        "estoque_cards": estoque_cards,
+    }
+
+
+def metricas_dashboard(tenant, planta_id=None):
+    """
+    Indicadores da home. Cada tabela e lida com uma consulta de agregacao
+    condicional (Count com filter); entregas, estoque e pendencias sao filtrados
+    pela planta quando informada. O resultado fica no cache por (tenant, planta)
+    durante DASHBOARD_CACHE_TIMEOUT e e invalidado pelos sinais de apps/ui/signals.py.
+    """
+    key = (
+        f"{_dashboard_prefix(tenant.pk)}:{_dashboard_versao(tenant.pk)}:"
+        f"{planta_id or 'todas'}:{timezone.localdate().isoformat()}"
+    )
+    metricas = cache.get(key)
+    if metricas is None:
+        metricas = _calcular_metricas(tenant, planta_id)
+        cache.set(key, metricas, DASHBOARD_CACHE_TIMEOUT)
+    return metricas
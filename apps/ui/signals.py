@@ -0,0 +1,34 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.entregas.models import Entrega
+from apps.estoque.models import Estoque
+from apps.estoque.signals import saldos_alterados
+from apps.treinamentos.models import TreinamentoPendencia
+from .services import invalidar_metricas_dashboard
+
+
+def _invalidar(company_id):
+    # Invalida ja (mesma transacao) e de novo no commit, para nao deixar no cache
+    # uma leitura feita por outra requisicao antes do commit.
+    invalidar_metricas_dashboard(company_id)
+    transaction.on_commit(lambda: invalidar_metricas_dashboard(company_id))
+
+
+@receiver(post_save, sender=Entrega)
+@receiver(post_delete, sender=Entrega)
+@receiver(post_save, sender=Estoque)
+@receiver(post_delete, sender=Estoque)
+@receiver(post_save, sender=TreinamentoPendencia)
+@receiver(post_delete, sender=TreinamentoPendencia)
+def invalidar_dashboard(sender, instance, **kwargs):
+    if not instance or not instance.company_id:
+        return
+    _invalidar(instance.company_id)
+
+
+@receiver(saldos_alterados)
+def invalidar_dashboard_saldos(sender, company_ids, **kwargs):
+    for company_id in company_ids:
+        _invalidar(company_id)
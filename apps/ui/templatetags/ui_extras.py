@@ -72,6 +72,8 @@ def _pick_active_item(path, items):
     best_item = None
     best_len = -1
     for item in items:
+        if _match_path(path, item.get("exclude", [])):
+            continue
         for prefix in item.get("prefixes", []):
             if path.startswith(prefix) and len(prefix) > best_len:
                 best_item = item
@@ -415,8 +417,16 @@ def sidebar_menu(context):
                     "icon": "bi-box-arrow-up-right",
                     "url_name": "entregas:list",
                     "prefixes": ["/entregas/"],
+                    "exclude": ["/entregas/trocas/"],
                     "perm": "entregas.view_entrega",
-                }
+                },
+                {
+                    "label": "Trocas previstas",
+                    "icon": "bi-arrow-repeat",
+                    "url_name": "entregas:trocas",
+                    "prefixes": ["/entregas/trocas/"],
+                    "perm": "entregas.view_entrega",
+                },
             ],
         },
         # Checklist
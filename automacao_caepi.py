@@ -79,7 +79,9 @@ class BaseDadosCaEPI:
         return arquivo.readline().split(',')
 
     def _retornarCAsSemErros(self) -> list:
-        listaCAsValidos = []
+        return list(self._linhasSemErros())
+
+    def _linhasSemErros(self):
         listaCAsInvalidos = []
 
         with open(self.nomeArquivoBase, encoding='UTF-8') as arquivo:
@@ -96,12 +98,10 @@ class BaseDadosCaEPI:
                         listaCAsInvalidos.append(linha_original)
                         continue
 
-                listaCAsValidos.append(linhaDf)
+                yield linhaDf
 
         if listaCAsInvalidos:
             self._criarArquivoComErros(listaCAsInvalidos)
-
-        return listaCAsValidos
     
     def _tratarCasComErros(self, linha) -> dict:
         linhaDf = re.split(r'(?<! )\|', linha)
@@ -129,67 +129,25 @@ class BaseDadosCaEPI:
         self._transformarEmDataFrame()
         return self.baseDadosDF
 
-    def inserir_no_banco(self, clear_existing=True) -> int:
+    def inserir_no_banco(self, clear_existing=True) -> dict:
+        """
+        Importa o arquivo em streaming (COPY em lotes + diff por registro_ca), sem
+        DataFrame. Com clear_existing, CAs ausentes do arquivo sao removidos.
+        """
         os.environ.setdefault("DJANGO_SETTINGS_MODULE", "clarus.settings")
         import django
         django.setup()
 
-        from django.utils import timezone
-        from django_tenants.utils import schema_context
-        from apps.caepi.models import CaEPI
-
-        if self.baseDadosDF is None:
-            self.retornarBaseDados()
-
-        df = self.baseDadosDF.copy()
-        df.columns = [str(col).strip() for col in df.columns]
-        if "DataValidade" in df.columns:
-            df["DataValidade"] = pd.to_datetime(df["DataValidade"], errors="coerce", dayfirst=True).dt.date
-
-        mapping = {
-            "RegistroCA": "registro_ca",
-            "DataValidade": "data_validade",
-            "Situacao": "situacao",
-            "NRProcesso": "nr_processo",
-            "CNPJ": "cnpj",
-            "RazaoSocial": "razao_social",
-            "Natureza": "natureza",
-            "NomeEquipamento": "nome_equipamento",
-            "DescricaoEquipamento": "descricao_equipamento",
-            "MarcaCA": "marca_ca",
-            "Referencia": "referencia",
-            "Cor": "cor",
-            "AprovadoParaLaudo": "aprovado_para_laudo",
-            "RestricaoLaudo": "restricao_laudo",
-            "ObservacaoAnaliseLaudo": "observacao_analise_laudo",
-            "CNPJLaboratorio": "cnpj_laboratorio",
-            "RazaoSocialLaboratorio": "razao_social_laboratorio",
-            "NRLaudo": "nr_laudo",
-            "Norma": "norma",
-        }
-        now = timezone.now()
-        def _clean_value(value):
-            if pd.isna(value):
-                return None
-            return value
-
-        objects = []
-        for _, row in df.iterrows():
-            registro = row.get("RegistroCA")
-            if pd.isna(registro) or not str(registro).strip():
-                continue
-            payload = {
-                model_key: _clean_value(row.get(csv_key))
-                for csv_key, model_key in mapping.items()
-            }
-            objects.append(CaEPI(ultima_atualizacao=now, **payload))
+        from apps.caepi.importacao import importar_base_caepi
 
-        with schema_context("public"):
-            if clear_existing:
-                CaEPI.objects.all().delete()
-            CaEPI.objects.bulk_create(objects, batch_size=2000)
+        if not os.path.exists(self.nomeArquivoBase):
+            print("Aguarde o download...")
+            self._baixarArquivoBaseCaEPI()
+            print("Download concluido!")
 
-        return len(objects)
+        linhas = self._linhasSemErros()
+        next(linhas, None)  # cabecalho
+        return importar_base_caepi(linhas, remover_ausentes=clear_existing)
 
 def _parse_args():
     parser = argparse.ArgumentParser(description="Importacao CA EPI (public)")
@@ -202,8 +160,12 @@ if __name__ == "__main__":
     args = _parse_args()
     base = BaseDadosCaEPI()
     if args.insert:
-        total = base.inserir_no_banco(clear_existing=not args.keep_existing)
-        print(f"Importacao concluida. Registros inseridos: {total}")
+        resumo = base.inserir_no_banco(clear_existing=not args.keep_existing)
+        print(
+            "Importacao concluida. "
+            f"Linhas lidas: {resumo['linhas']} | CAs inseridos: {resumo['inseridos']} | "
+            f"atualizados: {resumo['atualizados']} | removidos: {resumo['removidos']}"
+        )
     else:
         df = base.retornarBaseDados()
         print(df.head())
@@ -57,6 +57,7 @@ MIDDLEWARE = [
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
+    "apps.core.middleware.ChoicesCacheMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
@@ -127,3 +128,6 @@ MEDIA_URL = "media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+ESTOQUE_MODO_ATUALIZACAO = os.getenv("ESTOQUE_MODO_ATUALIZACAO", "lock")
+RELATORIOS_WIDGET_WORKERS = int(os.getenv("RELATORIOS_WIDGET_WORKERS", "4"))
+FICHAS_PDF_WORKERS = int(os.getenv("FICHAS_PDF_WORKERS", "2"))